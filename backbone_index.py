@@ -0,0 +1,205 @@
+'''Nearest neighbour search for spin systems in backbone chemical shift
+   space (H, N, CA, CB).
+
+Not every spin system has all backbone shifts. The spin systems are
+therefore grouped by the backbone atoms they have and a k-d tree is
+build for every group. A query only uses the dimensions it shares with
+a group, splits along other dimensions can not prune the search and
+are descended on both sides. The distance between two spin systems is
+the root of the summed squared shift differences of the backbone atoms
+they have in common, which is the deviation calculated by
+SpinSystemComparison restricted to these atoms (for CA and CB the
+average over the isotope states is used).
+
+'''
+
+import heapq
+
+import numpy
+
+BACKBONE_ATOMS = ('H', 'N', 'CA', 'CB')
+
+
+class KDTree(object):
+    '''A k-d tree over points that all have the same dimensions.
+
+    '''
+
+    def __init__(self, points, leaf_size=8):
+        '''Init.
+           args:    points:    float array (n x dimensions)
+                    leaf_size: int, nodes with fewer points are not
+                               split any further.
+
+        '''
+
+        self.points = numpy.asarray(points, dtype=float)
+        self.leaf_size = leaf_size
+        self.order = numpy.arange(len(self.points))
+        self.nodes = []
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def _build(self, start, end):
+        '''Recursively build the node for order[start:end].
+           returns: index of the node in self.nodes
+
+        '''
+
+        node_index = len(self.nodes)
+        indices = self.order[start:end]
+        points = self.points[indices]
+        lower = points.min(axis=0)
+        upper = points.max(axis=0)
+        node = [start, end, lower, upper, None, None]
+        self.nodes.append(node)
+
+        if end - start <= self.leaf_size:
+            return node_index
+
+        dimension = numpy.argmax(upper - lower)
+        if upper[dimension] == lower[dimension]:
+            return node_index
+
+        self.order[start:end] = indices[numpy.argsort(points[:, dimension],
+                                                      kind='mergesort')]
+        middle = (start + end) // 2
+        node[4] = self._build(start, middle)
+        node[5] = self._build(middle, end)
+        return node_index
+
+    def query(self, point, mask, k, bound=numpy.inf):
+        '''Find the k points closest to point, only the dimensions
+           where mask is True are used.
+           args:    point:  float array (dimensions)
+                    mask:   bool array (dimensions)
+                    k:      int
+                    bound:  float, points further away are ignored.
+           returns: list of (distance, index) sorted by distance.
+
+        '''
+
+        if not self.nodes:
+            return []
+
+        heap = []
+        squared_bound = bound ** 2
+        stack = [0]
+
+        while stack:
+            node = self.nodes[stack.pop()]
+            start, end, lower, upper, left, right = node
+            outside = numpy.maximum(lower - point, 0.0) + numpy.maximum(point - upper, 0.0)
+            minimal = (outside[mask] ** 2).sum()
+            worst = -heap[0][0] if len(heap) == k else squared_bound
+            if minimal > worst:
+                continue
+
+            if left is None:
+                indices = self.order[start:end]
+                differences = self.points[indices][:, mask] - point[mask]
+                distances = (differences ** 2).sum(axis=1)
+                for distance, index in zip(distances, indices):
+                    if distance > squared_bound:
+                        continue
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-distance, -index))
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, (-distance, -index))
+            else:
+                stack.append(right)
+                stack.append(left)
+
+        return sorted([((-distance) ** 0.5, -index) for distance, index in heap])
+
+
+class BackboneIndex(object):
+    '''Nearest neighbour index over the backbone shifts of spin
+       systems.
+
+    '''
+
+    def __init__(self, keys, vectors, leaf_size=8):
+        '''Init.
+           args:    keys:      list of objects (spin systems)
+                    vectors:   float array (keys x backbone atoms),
+                               nan where a spin system does not have
+                               a shift.
+                    leaf_size: int, see KDTree
+
+        '''
+
+        self.keys = list(keys)
+        self.vectors = numpy.asarray(vectors, dtype=float)
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+        present = ~numpy.isnan(self.vectors)
+        self.groups = []
+
+        patterns = {}
+        for row, pattern in enumerate(present):
+            if pattern.any():
+                patterns.setdefault(tuple(pattern), []).append(row)
+
+        for pattern, rows in patterns.items():
+            rows = numpy.array(rows)
+            dimensions = numpy.array(pattern)
+            tree = KDTree(self.vectors[rows][:, dimensions], leaf_size)
+            self.groups.append((dimensions, rows, tree))
+
+    @classmethod
+    def from_shift_matrix(cls, shiftMatrix, atom_names=BACKBONE_ATOMS,
+                          leaf_size=8):
+        '''Build the index from the first resonance of every backbone
+           atom type in a ShiftMatrix.
+           args:    shiftMatrix: ShiftMatrix
+                    atom_names:  the atom types to use as dimensions
+                    leaf_size:   int, see KDTree
+           returns: BackboneIndex
+
+        '''
+
+        n = len(shiftMatrix.keys)
+        vectors = numpy.empty((n, len(atom_names)))
+        vectors.fill(numpy.nan)
+
+        for dimension, atom_name in enumerate(atom_names):
+            if atom_name not in shiftMatrix.atom_names:
+                continue
+            column = shiftMatrix.atom_names.index(atom_name)
+            states = shiftMatrix.state_mask[column]
+            values = shiftMatrix.values[:, column, 0, states].mean(axis=-1)
+            present = shiftMatrix.present[:, column, 0]
+            vectors[present, dimension] = values[present]
+
+        return cls(shiftMatrix.keys, vectors, leaf_size=leaf_size)
+
+    def nearest(self, key, k=10, max_distance=numpy.inf):
+        '''Find the spin systems closest to a spin system in the
+           backbone dimensions they share with it.
+           args:    key:          the spin system
+                    k:            int, amount of results
+                    max_distance: float, spin systems further away are
+                                  left out.
+           returns: list of (distance, key), closest first. Spin
+                    systems without any backbone shift in common are
+                    left out.
+
+        '''
+
+        point = self.vectors[self.index[key]]
+        available = ~numpy.isnan(point)
+        point = numpy.where(available, point, 0.0)
+        results = []
+
+        for dimensions, rows, tree in self.groups:
+            mask = available[dimensions]
+            if not mask.any():
+                continue
+            bound = max_distance
+            if len(results) >= k:
+                bound = min(bound, results[k - 1][0])
+            found = tree.query(point[dimensions], mask, k, bound)
+            results.extend((distance, rows[index]) for distance, index in found)
+            results.sort()
+
+        return [(distance, self.keys[row]) for distance, row in results[:k]]
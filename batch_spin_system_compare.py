@@ -0,0 +1,277 @@
+'''Compare spin systems in exported shift lists without CCPN Analysis.
+
+Reads a protonated and (optionally) a deuterated shift list from CSV or
+NMR-STAR files (see shift_list_io), corrects for the deuterium isotope
+shift and writes either a ranked list of candidates for every spin
+system or the deviation of every overlapping pair of spin systems. The
+same ShiftMatrix engine as the popup is used. Results are written as
+CSV or JSON lines while they are calculated, only a few blocks of rows
+of the deviation matrix are kept in memory at a time. With --processes
+the blocks are compared in worker processes (see parallel_compare).
+
+More shift lists (other temperatures or samples) can be given, all are
+compared in one go. By default the first list is protonated and the
+others deuterated, --isotope and --offset describe every list. NMR-STAR
+files with more than one assigned chemical shift list need
+--shift-list-id.
+
+usage:
+    python batch_spin_system_compare.py protonated.str [deuterated.csv ...]
+        [--isotope protonated|deuterated ...] [--offset 0.0 ...]
+        [--shift-list-id ID|- ...]
+        [--mode ranked|matrix] [--best N] [--matches-only]
+        [--no-correction] [--format csv|jsonl] [--output results.csv]
+        [--report report.json] [--iso-corr iso_corr.json]
+        [--block-size 64] [--processes N]
+
+'''
+
+import argparse
+import csv
+import json
+import sys
+
+import numpy
+
+import instrumentation
+from isotope_calibration import read_iso_corr
+from isotope_shift import set_iso_corr
+from parallel_compare import iterate_blocks
+from shift_list_io import read_shifts
+from shift_list_models import ShiftListModel
+from spin_system_snapshot import SpinSystemSnapshot
+
+RANKED_FIELDS = ('spin_system', 'rank', 'candidate', 'deviation', 'match',
+                 'overlap')
+MATRIX_FIELDS = ('spin_system_1', 'spin_system_2', 'deviation', 'match',
+                 'overlap')
+
+
+def parse_arguments(arguments=None):
+    '''Parse the command line.'''
+
+    parser = argparse.ArgumentParser(description='Compare spin systems in '
+                                     'exported chemical shift lists.')
+    add_shift_list_arguments(parser)
+    parser.add_argument('--mode', choices=['ranked', 'matrix'],
+                        default='ranked', help='ranked candidates per spin '
+                        'system or the full deviation matrix')
+    parser.add_argument('--best', type=int, default=None,
+                        help='amount of candidates per spin system')
+    parser.add_argument('--matches-only', action='store_true',
+                        help='only report pairs that match')
+    parser.add_argument('--no-correction', action='store_true',
+                        help='do not correct for the deuterium isotope shift')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                        help='output format, by default determined from '
+                        'the output file name, CSV otherwise')
+    parser.add_argument('--output', default=None,
+                        help='output file, standard output by default')
+    parser.add_argument('--block-size', type=int, default=64,
+                        help='rows of the deviation matrix compared in '
+                        'one go')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='amount of worker processes comparing blocks '
+                        'of rows, 0 for one per cpu')
+    parser.add_argument('--report', default=None,
+                        help='record timings and counters and write them '
+                        'as JSON to this file')
+    parser.add_argument('--iso-corr', default=None,
+                        help='isotope shifts to use instead of the Talos+ '
+                        'values, as written by isotope_calibration')
+    options = parser.parse_args(arguments)
+    check_shift_list_arguments(parser, options)
+    return options
+
+
+def add_shift_list_arguments(parser):
+    '''Add the shift list files and the options describing every shift
+       list to an argument parser.
+
+    '''
+
+    parser.add_argument('shift_lists', nargs='+', metavar='shift_list',
+                        help='shift lists, CSV or NMR-STAR. The first one '
+                        'is protonated, the others deuterated, unless '
+                        '--isotope says otherwise.')
+    parser.add_argument('--isotope', nargs='+', default=None,
+                        choices=['protonated', 'deuterated'],
+                        help='isotope labelling of every shift list')
+    parser.add_argument('--offset', nargs='+', type=float, default=None,
+                        help='referencing offset added to the shifts of '
+                        'every shift list')
+    parser.add_argument('--shift-list-id', nargs='+', default=None,
+                        help='ID of the assigned chemical shift list to '
+                        'read from every NMR-STAR file, - for files with '
+                        'only one list')
+
+
+def check_shift_list_arguments(parser, options):
+    '''Stop with an error when the options describing every shift list
+       do not give one value per shift list.
+
+    '''
+
+    for option in ('isotope', 'offset', 'shift_list_id'):
+        values = getattr(options, option)
+        if values is not None and len(values) != len(options.shift_lists):
+            parser.error('give one --{} per shift list'.format(option.replace('_', '-')))
+
+
+def load_shift_lists(paths, isotopes=None, offsets=None, shift_list_ids=None):
+    '''Read any number of shift lists into a SpinSystemSnapshot.
+       args:    paths:          shift list files
+                isotopes:       'protonated' or 'deuterated' per shift
+                                list, by default the first one is
+                                protonated and the others deuterated.
+                offsets:        referencing offset per shift list, 0.0
+                                by default.
+                shift_list_ids: assigned chemical shift list ID per
+                                NMR-STAR file, None or '-' to read the
+                                only list in the file.
+       returns: SpinSystemSnapshot
+
+    '''
+
+    if isotopes is None:
+        isotopes = ['protonated'] + ['deuterated'] * (len(paths) - 1)
+    if offsets is None:
+        offsets = [0.0] * len(paths)
+    if shift_list_ids is None:
+        shift_list_ids = [None] * len(paths)
+    models = [ShiftListModel(deuterated=isotope == 'deuterated', offset=offset)
+              for isotope, offset in zip(isotopes, offsets)]
+    record_lists = [read_shifts(path, None if shift_list_id == '-' else shift_list_id)
+                    for path, shift_list_id in zip(paths, shift_list_ids)]
+    return SpinSystemSnapshot.from_record_lists(record_lists, models)
+
+
+def rank_candidates(shiftMatrix, best=None, matches_only=False,
+                    block_size=64, processes=1):
+    '''Rank all other spin systems for every spin system.
+       args:    shiftMatrix:  ShiftMatrix
+                best:         int, amount of candidates per spin system,
+                              None for all.
+                matches_only: Boolean
+                block_size:   int, rows compared in one go.
+                processes:    int, worker processes, see
+                              parallel_compare.iterate_blocks
+       returns: generator of dicts with the RANKED_FIELDS.
+
+    '''
+
+    n = len(shiftMatrix.keys)
+    blocks = [(start, min(start + block_size, n), 0, n)
+              for start in range(0, n, block_size)]
+    for (start, end, _, _), deviations, matches, overlaps in \
+            iterate_blocks(shiftMatrix, blocks, processes):
+        for i, row in enumerate(range(start, end)):
+            deviation, match, overlap = deviations[i], matches[i], overlaps[i]
+            allowed = overlap > 0
+            allowed[row] = False
+            if matches_only:
+                allowed &= match
+            candidates = numpy.nonzero(allowed)[0]
+            order = candidates[numpy.argsort(deviation[candidates], kind='mergesort')]
+            for rank, column in enumerate(order[:best], 1):
+                yield {'spin_system': shiftMatrix.keys[row],
+                       'rank': rank,
+                       'candidate': shiftMatrix.keys[column],
+                       'deviation': float(deviation[column]),
+                       'match': bool(match[column]),
+                       'overlap': int(overlap[column])}
+
+
+def deviation_matrix(shiftMatrix, matches_only=False, block_size=64,
+                     processes=1):
+    '''Compare every pair of spin systems once.
+       args:    shiftMatrix:  ShiftMatrix
+                matches_only: Boolean
+                block_size:   int, rows compared in one go.
+                processes:    int, worker processes, see
+                              parallel_compare.iterate_blocks
+       returns: generator of dicts with the MATRIX_FIELDS, pairs that do
+                not have any atom type in common are left out.
+
+    '''
+
+    n = len(shiftMatrix.keys)
+    columns = numpy.arange(n)
+    # Only the columns from every block on, the pairs before it were
+    # compared in earlier blocks.
+    blocks = [(start, min(start + block_size, n), start, n)
+              for start in range(0, n, block_size)]
+    for (start, end, _, _), deviation, match, overlap in \
+            iterate_blocks(shiftMatrix, blocks, processes):
+        rows = columns[start:end]
+        later = columns[start:]
+        allowed = (overlap > 0) & (later[None, :] > rows[:, None])
+        if matches_only:
+            allowed &= match
+        for i, j in zip(*numpy.nonzero(allowed)):
+            yield {'spin_system_1': shiftMatrix.keys[rows[i]],
+                   'spin_system_2': shiftMatrix.keys[later[j]],
+                   'deviation': float(deviation[i, j]),
+                   'match': bool(match[i, j]),
+                   'overlap': int(overlap[i, j])}
+
+
+def write_results(results, stream, fields, output_format='csv'):
+    '''Write result dicts one by one as CSV or JSON lines.'''
+
+    if output_format == 'jsonl':
+        for result in results:
+            stream.write(json.dumps(result, sort_keys=True) + '\n')
+        return
+
+    writer = csv.DictWriter(stream, fields)
+    writer.writeheader()
+    for result in results:
+        writer.writerow(result)
+
+
+def main(arguments=None):
+    '''Run the comparison described by the command line arguments.'''
+
+    options = parse_arguments(arguments)
+    output_format = options.format
+    if output_format is None:
+        output_format = 'jsonl' if (options.output or '').endswith(('.jsonl', '.json')) else 'csv'
+
+    processes = options.processes or None
+
+    if options.report:
+        instrumentation.enable()
+
+    if options.iso_corr:
+        set_iso_corr(read_iso_corr(options.iso_corr))
+
+    with instrumentation.timer('read_shift_lists'):
+        snapshot = load_shift_lists(options.shift_lists, options.isotope,
+                                    options.offset, options.shift_list_id)
+    with instrumentation.timer('pack_shifts'):
+        shiftMatrix = snapshot.shift_matrix(not options.no_correction)
+
+    if options.mode == 'ranked':
+        results = rank_candidates(shiftMatrix, options.best,
+                                  options.matches_only, options.block_size,
+                                  processes)
+        fields = RANKED_FIELDS
+    else:
+        results = deviation_matrix(shiftMatrix, options.matches_only,
+                                   options.block_size, processes)
+        fields = MATRIX_FIELDS
+
+    with instrumentation.timer('compare_and_write'):
+        if options.output:
+            with open(options.output, 'wb') as stream:
+                write_results(results, stream, fields, output_format)
+        else:
+            write_results(results, sys.stdout, fields, output_format)
+
+    if options.report:
+        instrumentation.write_report(options.report)
+
+
+if __name__ == '__main__':
+    main()
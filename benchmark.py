@@ -0,0 +1,201 @@
+'''Benchmarks of the spin system comparison on generated projects.
+
+Every scenario is timed on projects of different sizes made with
+fake_ccpn.make_project. The best of a few repeats is reported and
+appended as JSON lines to a results file, together with the version
+of the code, so runs of different versions can be compared.
+
+usage:
+    python benchmark.py [--sizes 100 1000 10000] [--scenarios ...]
+        [--repeats 3] [--output benchmark_results.jsonl]
+
+'''
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+import numpy
+
+from compare_spin_systems import SpinSystemComparison
+from fake_ccpn import make_project, sample_pairs
+from spin_system_snapshot import SpinSystemSnapshot
+
+#: Amount of pairs or queries timed in the pairwise and one-vs-all
+#: scenarios, the time per item is reported as well.
+SAMPLE_SIZE = 200
+
+
+def comparison_settings(project):
+    '''Keyword arguments for SpinSystemComparison and the snapshot.'''
+
+    return {'protonatedShiftList': project.protonatedShiftList,
+            'deuteratedShiftList': project.deuteratedShiftList}
+
+
+def bench_divide_resonances(project):
+    '''Time SpinSystemComparison.divide_resonances on sampled pairs.'''
+
+    comparisons = [SpinSystemComparison(spinSystem1, spinSystem2,
+                                        **comparison_settings(project))
+                   for spinSystem1, spinSystem2 in sample_pairs(project, SAMPLE_SIZE)]
+
+    def run():
+        for comparison in comparisons:
+            comparison.divide_resonances()
+
+    return run, len(comparisons)
+
+
+def bench_compare(project):
+    '''Time creating a SpinSystemComparison (which compares the two
+       spin systems) for sampled pairs.
+
+    '''
+
+    pairs = sample_pairs(project, SAMPLE_SIZE)
+    settings = comparison_settings(project)
+
+    def run():
+        for spinSystem1, spinSystem2 in pairs:
+            SpinSystemComparison(spinSystem1, spinSystem2, **settings)
+
+    return run, len(pairs)
+
+
+def bench_snapshot(project):
+    '''Time copying the project into a snapshot and packing it into a
+       ShiftMatrix.
+
+    '''
+
+    def run():
+        SpinSystemSnapshot.from_resonanceGroups(project.resonanceGroups,
+                                                **comparison_settings(project)).shift_matrix()
+
+    return run, len(project.resonanceGroups)
+
+
+def make_shift_matrix(project):
+    '''Pack the shifts of a project into a ShiftMatrix.'''
+
+    snapshot = SpinSystemSnapshot.from_resonanceGroups(project.resonanceGroups,
+                                                       **comparison_settings(project))
+    return snapshot.shift_matrix()
+
+
+def bench_one_vs_all(project):
+    '''Time comparing sampled spin systems to all others.'''
+
+    shiftMatrix = make_shift_matrix(project)
+    queries = [spinSystem for spinSystem, other in sample_pairs(project, SAMPLE_SIZE)]
+
+    def run():
+        for spinSystem in queries:
+            shiftMatrix.compare_one(spinSystem)
+
+    return run, len(queries)
+
+
+def bench_all_vs_all(project):
+    '''Time comparing all spin systems to each other in one process.'''
+
+    shiftMatrix = make_shift_matrix(project)
+
+    def run():
+        shiftMatrix.compare_all()
+
+    n = len(project.resonanceGroups)
+    return run, n * n
+
+
+SCENARIOS = [('divide_resonances', bench_divide_resonances),
+             ('compare', bench_compare),
+             ('snapshot', bench_snapshot),
+             ('one_vs_all', bench_one_vs_all),
+             ('all_vs_all', bench_all_vs_all)]
+
+
+def code_version():
+    '''Returns the git commit of the code, None outside a git tree.'''
+
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.STDOUT).strip().decode('utf-8')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_scenario(setup, project, repeats=3):
+    '''Time a scenario.
+       args:    setup:   function that takes a project and returns a
+                         function to time and the amount of items it
+                         processes.
+                project: fake_ccpn.Project
+                repeats: int
+       returns: (best time in seconds, amount of items)
+
+    '''
+
+    run, items = setup(project)
+    times = []
+    for repeat in range(repeats):
+        start = time.time()
+        run()
+        times.append(time.time() - start)
+    return min(times), items
+
+
+def run_benchmarks(sizes, scenarios=None, repeats=3, seed=0):
+    '''Run the scenarios for every project size.
+       returns: generator of result dicts
+
+    '''
+
+    version = code_version()
+    selected = [(name, setup) for name, setup in SCENARIOS
+                if scenarios is None or name in scenarios]
+
+    for size in sizes:
+        project = make_project(size, seed=seed)
+        for name, setup in selected:
+            seconds, items = time_scenario(setup, project, repeats)
+            yield {'version': version,
+                   'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'numpy': numpy.__version__,
+                   'scenario': name,
+                   'spin_systems': size,
+                   'items': items,
+                   'seconds': seconds,
+                   'seconds_per_item': seconds / items if items else None}
+
+
+def main(arguments=None):
+    '''Run the benchmarks described by the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Benchmark the spin '
+                                     'system comparison.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000],
+                        help='amounts of spin systems in the generated '
+                        'projects')
+    parser.add_argument('--scenarios', nargs='+', default=None,
+                        choices=[name for name, setup in SCENARIOS])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.jsonl',
+                        help='results are appended to this file')
+    options = parser.parse_args(arguments)
+
+    with open(options.output, 'a') as output:
+        for result in run_benchmarks(options.sizes, options.scenarios,
+                                     options.repeats, options.seed):
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            print('{scenario:>18} {spin_systems:>6} spin systems: '
+                  '{seconds:.4f} s'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,8 @@
 
 '''
 
-from isotope_shift import correct_for_isotope_shift as correct
-from ccpnmr.analysis.core.AssignmentBasic import makeResonanceGuiName
+import instrumentation
+from isotope_shift import correct_for_isotope_shift as correct, iso_corr_version
 
 
 class ShiftedResonce(object):
@@ -14,18 +14,26 @@ class ShiftedResonce(object):
 
     '''
 
+    __slots__ = ('isotope_correction', 'resonance', 'shiftedShifts',
+                 'protonatedShiftList', 'deuteratedShiftList', 'prefetch')
+
     def __init__(self, resonance, protonatedShiftList=None,
-                 deuteratedShiftList=None, isotope_correction=True):
+                 deuteratedShiftList=None, isotope_correction=True,
+                 prefetch=None):
         '''Init.
            args:    resonance:    resonance that is described.
                     protonatedShiftList: shift list of protonated shifts
                     deuteratedShiftList: shift list of deuterated shifts
+                    prefetch: optional ShiftListPrefetch to read the
+                              shifts from.
                     correct: If False, no isotope correction will be
-                             performed and the first shift that is found
-                             is used. The object will only contain one
-                             shiftedShift. If True, istope correction
-                             will be carried out for CA and CB chemical
-                             shifts.
+                             performed and the shift in the protonated
+                             list is used, else the one in the
+                             deuterated list, else the first shift
+                             that is found. The object will only
+                             contain one shiftedShift. If True, istope
+                             correction will be carried out for CA and
+                             CB chemical shifts.
 
         '''
 
@@ -34,7 +42,9 @@ class ShiftedResonce(object):
         self.shiftedShifts = []
         self.protonatedShiftList = protonatedShiftList
         self.deuteratedShiftList = deuteratedShiftList
-        self.determine_shifts()
+        self.prefetch = prefetch
+        with instrumentation.timer('shifted_resonance'):
+            self.determine_shifts()
 
     def determine_shifts(self):
         '''Determine protonated and deuterated shift for the described
@@ -47,18 +57,13 @@ class ShiftedResonce(object):
            and self.deuteratedShiftList \
            and self.resonance.assignNames[0] in ('CA', 'CB'):
 
-            protonated_shift = None
-            deuterated_shift = None
+            protonated_shift, deuterated_shift = find_shifts(self.resonance,
+                                                            self.protonatedShiftList,
+                                                            self.deuteratedShiftList,
+                                                            prefetch=self.prefetch)
             protonated_is_estimate = False
             deuterated_is_estimate = False
 
-            shift_object = self.resonance.findFirstShift(parentList=self.protonatedShiftList)
-            if shift_object:
-                protonated_shift = shift_object.value
-            shift_object = self.resonance.findFirstShift(parentList=self.deuteratedShiftList)
-            if shift_object:
-                deuterated_shift = shift_object.value
-
             # Find out amino acid type
             aa_name = self.resonance.resonanceGroup.ccpCode
             if not aa_name and self.resonance.resonanceGroup.residue:
@@ -99,15 +104,32 @@ class ShiftedResonce(object):
                                                deuterated=True)]
 
         else:
+            # Prefer the selected shift lists over whatever shift
+            # happens to come first, which can be in any shift list.
+            protonated_shift, deuterated_shift = find_shifts(self.resonance,
+                                                            self.protonatedShiftList,
+                                                            self.deuteratedShiftList,
+                                                            prefetch=self.prefetch)
+            if protonated_shift is not None:
+                value = protonated_shift
+            elif deuterated_shift is not None:
+                value = deuterated_shift
+            else:
+                value = self.resonance.findFirstShift().value
             shiftedShift = ShiftedShift(resonance=self.resonance,
-                                        value=self.resonance.findFirstShift().value)
+                                        value=value)
             self.shiftedShifts = [shiftedShift]
 
 
 class ShiftedShift(object):
-    """docstring for ShiftedShift"""
+    '''One (protonated or deuterated) chemical shift of a resonance,
+       which can be estimated from the other isotope state.
+
+    '''
+
+    __slots__ = ('resonance', 'value', 'estimated', 'deuterated')
+
     def __init__(self, resonance, value, estimated=False, deuterated=False):
-        super(ShiftedShift, self).__init__()
         self.resonance = resonance
         self.value = value
         self.estimated = estimated
@@ -120,7 +142,12 @@ class ShiftedShift(object):
 
         '''
 
-        name = makeResonanceGuiName(self.resonance, fullName=full)
+        # Imported here, so the rest of this module can be used
+        # without CCPN Analysis.
+        from ccpnmr.analysis.core.AssignmentBasic import makeResonanceGuiName
+
+        with instrumentation.timer('name_formatting'):
+            name = makeResonanceGuiName(self.resonance, fullName=full)
 
         if not self.deuterated:
             return name
@@ -138,3 +165,181 @@ class ShiftedShift(object):
             return '{}?'.format(round(self.value, 3))
         else:
             return str(round(self.value, 3))
+
+
+class ShiftListPrefetch(object):
+    '''Chemical shifts of all resonances in a protonated and a
+       deuterated shift list, fetched by walking over the measurements
+       of each list once instead of looking them up per resonance.
+
+    '''
+
+    def __init__(self, protonatedShiftList=None, deuteratedShiftList=None):
+        '''Init.
+           args:    protonatedShiftList: shift list of protonated shifts
+                    deuteratedShiftList: shift list of deuterated shifts
+
+        '''
+
+        self.protonatedShiftList = protonatedShiftList
+        self.deuteratedShiftList = deuteratedShiftList
+        self.shifts = {}
+        self.refresh()
+
+    def refresh(self):
+        '''(Re)build the map resonance -> (protonated shift,
+           deuterated shift).
+
+        '''
+
+        shifts = {}
+        shiftLists = [self.protonatedShiftList, self.deuteratedShiftList]
+
+        for index, shiftList in enumerate(shiftLists):
+            if not shiftList:
+                continue
+            for shift in shiftList.measurements:
+                values = shifts.setdefault(shift.resonance, [None, None])
+                values[index] = shift.value
+
+        self.shifts = shifts
+
+    def update_resonance(self, resonance):
+        '''Look up the shifts of one resonance again, for instance
+           after one of its shifts changed.
+
+        '''
+
+        self.shifts.pop(resonance, None)
+        values = find_shifts(resonance,
+                             self.protonatedShiftList,
+                             self.deuteratedShiftList)
+        if values != (None, None):
+            self.shifts[resonance] = list(values)
+
+    def covers(self, protonatedShiftList, deuteratedShiftList):
+        '''Returns True if this prefetch contains the shifts of exactly
+           these two shift lists.
+
+        '''
+
+        return (protonatedShiftList is not None and
+                deuteratedShiftList is not None and
+                protonatedShiftList is self.protonatedShiftList and
+                deuteratedShiftList is self.deuteratedShiftList)
+
+    def contains(self, resonance):
+        '''Returns True if the resonance has a shift in at least one
+           of the two shift lists.
+
+        '''
+
+        return resonance in self.shifts
+
+    def get_shifts(self, resonance):
+        '''Returns (protonated shift, deuterated shift), values are
+           None when the resonance has no shift in that list.
+
+        '''
+
+        return tuple(self.shifts.get(resonance, (None, None)))
+
+
+class ShiftedResonanceCache(object):
+    '''Keeps ShiftedResonce objects, so the (isotope corrected)
+       shifts of a resonance are determined only once, no matter how
+       many spin systems it is compared to. The cache has to be
+       invalidated when shifts, assign names or the residue type of
+       a spin system change. Everything is forgotten when other
+       isotope shifts are set with isotope_shift.set_iso_corr.
+
+    '''
+
+    def __init__(self):
+        '''Init.'''
+
+        self.shiftedResonances = {}
+        self.keys_per_resonance = {}
+        self.version = iso_corr_version()
+
+    def get(self, resonance, protonatedShiftList=None,
+            deuteratedShiftList=None, isotope_correction=True,
+            prefetch=None):
+        '''Get the ShiftedResonce for a resonance, creating it if it
+           is not cached yet.
+           args:    see ShiftedResonce
+           returns: ShiftedResonce
+
+        '''
+
+        if self.version != iso_corr_version():
+            self.clear()
+
+        key = (resonance, protonatedShiftList, deuteratedShiftList,
+               isotope_correction)
+        shiftedResonance = self.shiftedResonances.get(key)
+
+        if shiftedResonance is not None:
+            instrumentation.count('shifted_resonance_cache_hits')
+        else:
+            instrumentation.count('shifted_resonance_cache_misses')
+            shiftedResonance = ShiftedResonce(resonance,
+                                              protonatedShiftList,
+                                              deuteratedShiftList,
+                                              isotope_correction=isotope_correction,
+                                              prefetch=prefetch)
+            self.shiftedResonances[key] = shiftedResonance
+            self.keys_per_resonance.setdefault(resonance, set()).add(key)
+
+        return shiftedResonance
+
+    def invalidate_resonance(self, resonance):
+        '''Forget everything cached for a resonance.'''
+
+        for key in self.keys_per_resonance.pop(resonance, ()):
+            del self.shiftedResonances[key]
+
+    def invalidate_resonanceGroup(self, resonanceGroup):
+        '''Forget everything cached for the resonances of a spin
+           system, for instance after its residue type changed.
+
+        '''
+
+        for resonance in resonanceGroup.resonances:
+            self.invalidate_resonance(resonance)
+
+    def clear(self):
+        '''Forget everything.'''
+
+        self.shiftedResonances = {}
+        self.keys_per_resonance = {}
+        self.version = iso_corr_version()
+
+
+def find_shifts(resonance, protonatedShiftList, deuteratedShiftList,
+                prefetch=None):
+    '''Find the shift values of a resonance in the protonated and
+       deuterated shift list.
+       args:    resonance:    Resonance object
+                protonatedShiftList: shift list of protonated shifts
+                deuteratedShiftList: shift list of deuterated shifts
+                prefetch:     optional ShiftListPrefetch, used when it
+                              covers the two shift lists.
+       returns: (protonated shift, deuterated shift), values are None
+                if the resonance has no shift in that list.
+
+    '''
+
+    if prefetch and prefetch.covers(protonatedShiftList, deuteratedShiftList):
+        instrumentation.count('prefetched_shift_lookups')
+        return prefetch.get_shifts(resonance)
+
+    values = []
+    for shiftList in (protonatedShiftList, deuteratedShiftList):
+        shift = None
+        if shiftList:
+            instrumentation.count('ccpn_shift_lookups')
+            shift = resonance.findFirstShift(parentList=shiftList)
+        values.append(shift.value if shift else None)
+
+    return tuple(values)
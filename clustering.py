@@ -0,0 +1,149 @@
+'''Clustering of spin systems that describe the same residue.
+
+Spin systems that match (or deviate less than a threshold) are
+connected in a match graph. The connected components of this graph are
+found with union-find and reported as candidates for merging. To avoid
+scoring all pairs, every spin system is only compared to the
+candidates a ShiftIndex finds within the tolerance, so the work is
+close to linear in the amount of spin systems for realistic data.
+
+'''
+
+import numpy
+
+from shift_matrix import MATCH_CUTOFF
+
+
+class UnionFind(object):
+    '''Disjoint sets over the integers 0 .. n-1, with union by size and
+       path halving.
+
+    '''
+
+    def __init__(self, n):
+        '''Init.
+           args:    n:  int, amount of elements
+
+        '''
+
+        self.parents = list(range(n))
+        self.sizes = [1] * n
+
+    def find(self, element):
+        '''Returns the representative of the set an element is in.'''
+
+        parents = self.parents
+        while parents[element] != element:
+            parents[element] = parents[parents[element]]
+            element = parents[element]
+        return element
+
+    def union(self, element1, element2):
+        '''Join the sets of two elements.
+           returns: Boolean, False if they already were in the same set.
+
+        '''
+
+        root1 = self.find(element1)
+        root2 = self.find(element2)
+        if root1 == root2:
+            return False
+        if self.sizes[root1] < self.sizes[root2]:
+            root1, root2 = root2, root1
+        self.parents[root2] = root1
+        self.sizes[root1] += self.sizes[root2]
+        return True
+
+    def groups(self):
+        '''Returns a list of the sets with more than one element, every
+           set is a sorted list of elements.
+
+        '''
+
+        groups = {}
+        for element in range(len(self.parents)):
+            groups.setdefault(self.find(element), []).append(element)
+        return [group for group in groups.values() if len(group) > 1]
+
+
+def find_edges(shiftMatrix, shiftIndex, tables, max_deviation=None,
+               matches_only=True):
+    '''Find the pairs of spin systems that are connected in the match
+       graph. Candidates are pruned with the shift index and then
+       scored with the ShiftMatrix.
+       args:    shiftMatrix:   ShiftMatrix of all spin systems
+                shiftIndex:    ShiftIndex over the same spin systems
+                tables:        dict key -> shift table the ShiftIndex
+                               was built from.
+                max_deviation: float, pairs deviating this much or more
+                               are not connected. None for no limit.
+                matches_only:  Boolean, if True only matching pairs are
+                               connected.
+       returns: generator of (row1, row2, deviation) with row1 < row2
+
+    '''
+
+    # A match means every delta is below the cut-off. The deviation
+    # averages the deltas of an atom over its isotope states (or shift
+    # lists), so every delta of a pair deviating less than
+    # max_deviation is below that many times max_deviation.
+    tolerances = []
+    if matches_only:
+        tolerances.append(MATCH_CUTOFF)
+    if max_deviation is not None:
+        # The most states any atom has.
+        n_states = shiftMatrix.state_mask.shape[1]
+        tolerances.append(n_states * max_deviation)
+    tolerance = min(tolerances) if tolerances else numpy.inf
+
+    for row, key in enumerate(shiftMatrix.keys):
+        if numpy.isinf(tolerance):
+            candidates = shiftMatrix.keys[row + 1:]
+        else:
+            candidates = [candidate for candidate in shiftIndex.candidates(tables[key], tolerance)
+                          if shiftMatrix.index[candidate] > row]
+        if not candidates:
+            continue
+
+        rows = numpy.array(sorted(shiftMatrix.index[candidate] for candidate in candidates))
+        deviation, match, overlap = shiftMatrix.compare_one(key, rows=rows)
+        connected = overlap > 0
+        if matches_only:
+            connected &= match
+        if max_deviation is not None:
+            connected[connected] = deviation[connected] < max_deviation
+
+        for column in numpy.nonzero(connected)[0]:
+            yield row, int(rows[column]), float(deviation[column])
+
+
+def cluster_spin_systems(shiftMatrix, shiftIndex, tables, max_deviation=None,
+                         matches_only=True):
+    '''Group spin systems into clusters of (probable) duplicates.
+       args:    see find_edges
+       returns: list of (keys, complete, largest deviation), largest
+                clusters first. complete is True when every pair in
+                the cluster is connected, not just through others.
+
+    '''
+
+    unionFind = UnionFind(len(shiftMatrix.keys))
+    edges = {}
+    largest = {}
+
+    for row1, row2, deviation in find_edges(shiftMatrix, shiftIndex, tables,
+                                            max_deviation, matches_only):
+        unionFind.union(row1, row2)
+        edges[row1] = edges.get(row1, 0) + 1
+        largest[row1] = max(largest.get(row1, 0.0), deviation)
+
+    clusters = []
+    for group in unionFind.groups():
+        n_edges = sum(edges.get(row, 0) for row in group)
+        complete = n_edges == len(group) * (len(group) - 1) // 2
+        clusters.append(([shiftMatrix.keys[row] for row in group],
+                         complete,
+                         max(largest.get(row, 0.0) for row in group)))
+
+    clusters.sort(key=lambda cluster: (-len(cluster[0]), cluster[2]))
+    return clusters
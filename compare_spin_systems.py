@@ -2,7 +2,14 @@
    map the differences and
 '''
 
+import heapq
+
+import instrumentation
+
 from ccpn_isotope_shift import ShiftedResonce
+from shift_index import ShiftIndex
+from shift_matrix import MATCH_CUTOFF
+from spin_system_snapshot import SpinSystemSnapshot
 
 
 class SpinSystemComparison(object):
@@ -11,20 +18,32 @@ class SpinSystemComparison(object):
 
     '''
 
+    __slots__ = ('spinSystem1', 'spinSystem2', 'protonatedShiftList',
+                 'deuteratedShiftList', 'deviation', 'match', 'overlap',
+                 'combinations', 'differences', '_intersection', '_unique',
+                 'isotope_correction', 'prefetch', 'cache')
+
     def __init__(self, spinSystem1, spinSystem2,
                  isotope_correction=True,
                  protonatedShiftList=None,
-                 deuteratedShiftList=None):
+                 deuteratedShiftList=None,
+                 prefetch=None,
+                 cache=None):
 
         self.spinSystem1 = spinSystem1
         self.spinSystem2 = spinSystem2
         self.protonatedShiftList = protonatedShiftList
         self.deuteratedShiftList = deuteratedShiftList
         self.deviation = None
-        self.intersection = []
-        self.unique_to_1 = set()
-        self.unique_to_2 = set()
+        self.match = True
+        self.overlap = 0
+        self.combinations = []
+        self.differences = (set(), set())
+        self._intersection = None
+        self._unique = None
         self.isotope_correction = isotope_correction
+        self.prefetch = prefetch
+        self.cache = cache
 
         self.compare()
 
@@ -34,6 +53,10 @@ class SpinSystemComparison(object):
                B. Unique to spin system 2
                C. Resonances that have assign names that are present in
                   both spin system 1 and 2.
+           Resonances that are in neither of the shift lists are left
+           out. When several resonances of a spin system share the
+           same assign name, each of them is paired with every
+           resonance with that name in the other spin system.
            returns: [list A, list B, list of 2-tuples C.]
 
         '''
@@ -41,113 +64,145 @@ class SpinSystemComparison(object):
         shiftLists = [self.protonatedShiftList, self.deuteratedShiftList]
         resonances1 = self.spinSystem1.getResonances()
         resonances2 = self.spinSystem2.getResonances()
+        names2, bad2 = index_resonances(resonances2, shiftLists, self.prefetch)
         combinations = []
         compared = set()
-        bad = set()
+        bad1 = set()
 
         for res1 in resonances1:
-            if not resonance_in_shiftLists(res1, shiftLists):
-                bad.add(res1)
+            if not resonance_in_shiftLists(res1, shiftLists, self.prefetch):
+                bad1.add(res1)
                 continue
             if not res1.assignNames:
                 continue
 
-            for res2 in resonances2:
-                if not resonance_in_shiftLists(res2, shiftLists):
-                    bad.add(res2)
-                    continue
-                if not res2.assignNames:
-                    continue
-                if not res1.assignNames[0] == res2.assignNames[0]:
-                    continue
-
+            for res2 in names2.get(res1.assignNames[0], []):
                 combinations.append((res1, res2))
                 compared.update((res1, res2))
 
-        difference1 = resonances1 - compared - bad
-        difference2 = resonances2 - compared - bad
+        difference1 = resonances1 - compared - bad1
+        difference2 = resonances2 - compared - bad2
 
         return difference1, difference2, combinations
 
     def compare(self):
-        '''Compares the two spin systems to each other and
-           and thereby sets up some of the objects attributes
-           like 'deviation', 'intersection', 'unique_to_1'
-           and 'unique_to_2'.
+        '''Scores the two spin systems against each other and thereby
+           sets the 'deviation', 'match' and 'overlap' attributes.
+           The detailed break down in 'intersection', 'unique_to_1'
+           and 'unique_to_2' is only made when it is asked for.
 
         '''
 
-        difference1, difference2, combinations = self.divide_resonances()
+        instrumentation.count('pairs_compared')
+        with instrumentation.timer('divide_resonances'):
+            difference1, difference2, combinations = self.divide_resonances()
+        self.differences = (difference1, difference2)
+        self.combinations = combinations
 
-        for res1, res2 in combinations:
+        with instrumentation.timer('pairwise_compare'):
+            shift_pairs = []
+            for res1, res2 in combinations:
+                shifted1 = self.shift_resonance(res1)
+                shifted2 = self.shift_resonance(res2)
+                shift_pairs.append(([shiftedShift.value for shiftedShift in shifted1.shiftedShifts],
+                                    [shiftedShift.value for shiftedShift in shifted2.shiftedShifts]))
 
-            shifted1 = ShiftedResonce(res1,
-                                      self.protonatedShiftList,
-                                      self.deuteratedShiftList,
-                                      isotope_correction=self.isotope_correction)
-            shifted2 = ShiftedResonce(res2,
-                                      self.protonatedShiftList,
-                                      self.deuteratedShiftList,
-                                      isotope_correction=self.isotope_correction)
+            self.deviation, self.match, self.overlap = score_shift_pairs(shift_pairs)
 
-            average_delta = 0.0
-            isotope_sorted_shifts = zip(shifted1.shiftedShifts,
-                                        shifted2.shiftedShifts)
-            for shiftedShifts in isotope_sorted_shifts:
-                shiftComparison = ShiftComparison(shiftedShifts=shiftedShifts)
-                self.intersection.append(shiftComparison)
-                average_delta += shiftComparison.delta
-            average_delta /= len(isotope_sorted_shifts)
-
-            if not self.deviation:
-                self.deviation = 0.0
-            self.deviation += average_delta**2
+    @property
+    def intersection(self):
+        '''List of ShiftComparison objects, one for every isotope state
+           of every pair of resonances with the same assign name.
 
-        if self.deviation:
-            self.deviation = self.deviation**0.5
+        '''
 
-        for resonances, difference_set in [(difference1, self.unique_to_1),
-                                           (difference2, self.unique_to_2)]:
+        if self._intersection is None:
+            intersection = []
+            for res1, res2 in self.combinations:
+                shifted1 = self.shift_resonance(res1)
+                shifted2 = self.shift_resonance(res2)
+                for shiftedShifts in zip(shifted1.shiftedShifts,
+                                         shifted2.shiftedShifts):
+                    intersection.append(ShiftComparison(shiftedShifts=shiftedShifts))
+            self._intersection = intersection
 
-            for resonance in resonances:
-                shiftedResonance = ShiftedResonce(resonance,
-                                                  isotope_correction=self.isotope_correction)
-                difference_set.update(shiftedResonance.shiftedShifts)
+        return self._intersection
 
     @property
-    def match(self):
-        '''Bool, True if all overlapping shifts within the two spin
-           systems 'match'.
+    def unique_to_1(self):
+        '''Set of ShiftedShifts of resonance types only present in
+           spin system 1.
+
         '''
 
-        for resonance_comparison in self.intersection:
-            if not resonance_comparison.match:
-                return False
-        return True
+        return self.make_unique_sets()[0]
 
+    @property
+    def unique_to_2(self):
+        '''Set of ShiftedShifts of resonance types only present in
+           spin system 2.
 
-class ShiftComparison(object):
-    """docstring for ShiftComparison"""
-    def __init__(self, shiftedShifts):
-        super(ShiftComparison, self).__init__()
-        self.shiftedShifts = shiftedShifts
+        '''
 
-    @property
-    def delta(self):
-        '''Absolute difference between two shifts.
+        return self.make_unique_sets()[1]
+
+    def make_unique_sets(self):
+        '''Make the sets of ShiftedShifts of resonances unique to
+           either one of the spin systems.
+           returns: (set for spin system 1, set for spin system 2)
 
         '''
-        return abs(self.shiftedShifts[0].value - self.shiftedShifts[1].value)
 
-    @property
-    def match(self):
-        '''Boolean, True if shifts match under cut-off value.
+        if self._unique is None:
+            unique = (set(), set())
+            for resonances, difference_set in zip(self.differences, unique):
+                for resonance in resonances:
+                    shiftedResonance = self.shift_resonance(resonance,
+                                                            use_shiftLists=False)
+                    difference_set.update(shiftedResonance.shiftedShifts)
+            self._unique = unique
+
+        return self._unique
+
+    def shift_resonance(self, resonance, use_shiftLists=True):
+        '''Get the ShiftedResonce for a resonance, from the cache if
+           this comparison has one.
+           args:    resonance:      Resonance object
+                    use_shiftLists: Boolean, if False the shifts are
+                                    not looked up in the protonated and
+                                    deuterated shift lists.
+           returns: ShiftedResonce
 
         '''
 
-        if self.delta < 0.5:
-            return True
-        return False
+        if use_shiftLists:
+            shiftLists = [self.protonatedShiftList, self.deuteratedShiftList]
+        else:
+            shiftLists = [None, None]
+
+        if self.cache is not None:
+            return self.cache.get(resonance, *shiftLists,
+                                  isotope_correction=self.isotope_correction,
+                                  prefetch=self.prefetch)
+
+        return ShiftedResonce(resonance, *shiftLists,
+                              isotope_correction=self.isotope_correction,
+                              prefetch=self.prefetch)
+
+
+class ShiftComparison(object):
+    '''Comparison of two shifts. The absolute difference (delta) and
+       whether the shifts match under the cut-off value are calculated
+       once.
+
+    '''
+
+    __slots__ = ('shiftedShifts', 'delta', 'match')
+
+    def __init__(self, shiftedShifts):
+        self.shiftedShifts = shiftedShifts
+        self.delta = abs(shiftedShifts[0].value - shiftedShifts[1].value)
+        self.match = self.delta < MATCH_CUTOFF
 
     @property
     def resonance_name(self):
@@ -170,6 +225,210 @@ class ShiftComparison(object):
                 self.shiftedShifts[1].create_shift_description()]
 
 
+def score_shift_pairs(shift_pairs, cutoff=MATCH_CUTOFF, bound=None):
+    '''Score a set of compared resonances without building any
+       ShiftComparison objects.
+       args:    shift_pairs:  iterable of (values1, values2) where
+                              values are the shifts of a resonance per
+                              isotope state.
+                cutoff:       float, maximal delta for a match.
+                bound:        optional float, scoring stops as soon as
+                              the deviation exceeds this value.
+       returns: (deviation, match, overlap): deviation is the root of
+                the summed squared deltas (averaged over isotope
+                states) or None when there are no pairs, match is True
+                when all deltas are below the cut-off and overlap is
+                the amount of pairs. Returns None when the deviation
+                exceeds the bound.
+
+    '''
+
+    deviation = None
+    match = True
+    overlap = 0
+    if bound is not None:
+        squared_bound = bound**2
+
+    for values1, values2 in shift_pairs:
+        deltas = [abs(value1 - value2) for value1, value2 in zip(values1, values2)]
+        average_delta = sum(deltas) / len(deltas)
+        if max(deltas) >= cutoff:
+            match = False
+        if not deviation:
+            deviation = 0.0
+        deviation += average_delta**2
+        overlap += 1
+        if bound is not None and deviation > squared_bound:
+            return None
+
+    if deviation:
+        deviation = deviation**0.5
+
+    return deviation, match, overlap
+
+
+def score_spin_systems(spinSystem1, spinSystem2, **kwargs):
+    '''Score two spin systems without building the detailed
+       comparison.
+       args:    spinSystem1:    the first spin system
+                spinSystem2:    the second spin system
+                kwargs:         passed on to SpinSystemComparison
+       returns: (deviation, match, overlap), see score_shift_pairs
+
+    '''
+
+    comparison = SpinSystemComparison(spinSystem1, spinSystem2, **kwargs)
+    return comparison.deviation, comparison.match, comparison.overlap
+
+
+def spin_system_shifts(spinSystem, isotope_correction=True,
+                       protonatedShiftList=None, deuteratedShiftList=None,
+                       prefetch=None, cache=None):
+    '''Collect the (isotope corrected) shifts of a spin system by
+       assign name, the same resonances are used as in
+       SpinSystemComparison.
+       args:    spinSystem:     spin system
+                others:         see SpinSystemComparison
+       returns: dict assign name -> list of shift value lists, one
+                list for every resonance with that name.
+
+    '''
+
+    shiftLists = [protonatedShiftList, deuteratedShiftList]
+    names, bad = index_resonances(spinSystem.getResonances(), shiftLists,
+                                  prefetch)
+    shifts = {}
+
+    for name, resonances in names.items():
+        values = []
+        for resonance in resonances:
+            if cache is not None:
+                shifted = cache.get(resonance, protonatedShiftList,
+                                    deuteratedShiftList,
+                                    isotope_correction=isotope_correction,
+                                    prefetch=prefetch)
+            else:
+                shifted = ShiftedResonce(resonance, protonatedShiftList,
+                                         deuteratedShiftList,
+                                         isotope_correction=isotope_correction,
+                                         prefetch=prefetch)
+            values.append([shiftedShift.value for shiftedShift in shifted.shiftedShifts])
+        shifts[name] = values
+
+    return shifts
+
+
+def iterate_shift_pairs(shifts1, shifts2):
+    '''Iterate over all pairs of shift values with the same assign
+       name in two tables made by spin_system_shifts.
+
+    '''
+
+    for name, values_list1 in shifts1.items():
+        values_list2 = shifts2.get(name)
+        if not values_list2:
+            continue
+        for values1 in values_list1:
+            for values2 in values_list2:
+                yield values1, values2
+
+
+def find_best_matches(spinSystem, candidates, k=None, max_deviation=None,
+                      matches_only=False, tables=None, **kwargs):
+    '''Find the candidates that deviate least from a spin system. Only
+       the k best results are kept in a bounded heap and scoring of a
+       candidate stops as soon as its partial deviation exceeds the
+       k-th best deviation found so far or max_deviation.
+       args:    spinSystem:     spin system
+                candidates:     iterable of spin systems
+                k:              int, amount of results, None for all.
+                max_deviation:  float, candidates deviating more are
+                                left out. None for no cut-off.
+                matches_only:   Boolean, if True candidates that do not
+                                match are left out.
+                tables:         optional dict spin system -> shift table,
+                                for instance from
+                                SpinSystemSnapshot.shift_tables, used
+                                instead of looking up the shifts.
+                kwargs:         passed on to spin_system_shifts
+       returns: list of (deviation, match, candidate), best first.
+                Candidates that do not share any resonance type with
+                the spin system are left out.
+
+    '''
+
+    def get_shifts(spinSystem):
+        if tables is not None:
+            return tables[spinSystem]
+        return spin_system_shifts(spinSystem, **kwargs)
+
+    shifts1 = get_shifts(spinSystem)
+    heap = []
+
+    for count, candidate in enumerate(candidates):
+
+        bound = max_deviation
+        if k and len(heap) == k:
+            worst = -heap[0][0]
+            if bound is None or worst < bound:
+                bound = worst
+
+        shifts2 = get_shifts(candidate)
+        score = score_shift_pairs(iterate_shift_pairs(shifts1, shifts2),
+                                  bound=bound)
+        if score is None or score[0] is None:
+            continue
+
+        deviation, match, overlap = score
+        if matches_only and not match:
+            continue
+        item = (-deviation, -count, match, candidate)
+
+        if not k or len(heap) < k:
+            heapq.heappush(heap, item)
+        elif deviation < -heap[0][0]:
+            heapq.heapreplace(heap, item)
+
+    return [(-item[0], item[2], item[3]) for item in sorted(heap, reverse=True)]
+
+
+def make_shift_index(spinSystems, **kwargs):
+    '''Build a ShiftIndex over the shifts of many spin systems.
+       args:    spinSystems:    iterable of spin systems
+                kwargs:         passed on to spin_system_shifts
+       returns: ShiftIndex
+
+    '''
+
+    tables = dict((spinSystem, spin_system_shifts(spinSystem, **kwargs))
+                  for spinSystem in spinSystems)
+    return ShiftIndex(tables)
+
+
+def find_matching_spin_systems(spinSystem, shiftIndex, k=None, tables=None,
+                               **kwargs):
+    '''Find the spin systems that match a spin system. Only the
+       spin systems whose shifts fall within the match cut-off
+       windows in the ShiftIndex are scored.
+       args:    spinSystem:     spin system
+                shiftIndex:     ShiftIndex build with the same kwargs
+                k:              int, amount of results, None for all.
+                tables:         optional dict spin system -> shift
+                                table, see find_best_matches
+                kwargs:         passed on to spin_system_shifts
+       returns: list of (deviation, match, candidate), best first.
+
+    '''
+
+    if tables is not None:
+        table = tables[spinSystem]
+    else:
+        table = spin_system_shifts(spinSystem, **kwargs)
+    candidates = shiftIndex.candidates(table)
+    return find_best_matches(spinSystem, candidates, k=k,
+                             matches_only=True, tables=tables, **kwargs)
+
+
 def find_all_shiftLists_for_resonanceGroup(resonanceGroup):
     '''Find all shift lists the resonance of a resonanceGroup (spin system)
        are represented in.
@@ -186,17 +445,211 @@ def find_all_shiftLists_for_resonanceGroup(resonanceGroup):
     return sorted(list(shiftLists), reverse=True)
 
 
-def resonance_in_shiftLists(resonance, shiftLists):
+def index_resonances(resonances, shiftLists, prefetch=None):
+    '''Index resonances by their first assign name.
+       args:    resonances:   iterable of Resonance objects
+                shiftLists:   iterable of shiftLists the resonances
+                              should be present in.
+                prefetch:     optional ShiftListPrefetch
+       returns: dict assign name -> list of resonances, in the order
+                they were given, and the set of resonances that are
+                not present in any of the shift lists.
+
+    '''
+
+    names = {}
+    bad = set()
+
+    for resonance in resonances:
+        if not resonance_in_shiftLists(resonance, shiftLists, prefetch):
+            bad.add(resonance)
+            continue
+        if not resonance.assignNames:
+            continue
+        names.setdefault(resonance.assignNames[0], []).append(resonance)
+
+    return names, bad
+
+
+def group_by_shiftLists(resonanceGroups):
+    '''Group spin systems by the combination of shift lists their
+       resonances are in, for instance to separate spin systems from
+       proton detected and carbon detected experiments.
+       args:    resonanceGroups:    iterable of spin systems
+       returns: dict tuple of shift lists -> list of spin systems
+
+    '''
+
+    groups = {}
+
+    for resonanceGroup in resonanceGroups:
+        shiftLists = tuple(find_all_shiftLists_for_resonanceGroup(resonanceGroup))
+        groups.setdefault(shiftLists, []).append(resonanceGroup)
+
+    return groups
+
+
+def resonance_in_shiftLists(resonance, shiftLists, prefetch=None):
     '''Returns True if resonance is present in at least one of the
        shiftLists.
        args:    resonance:    Resonance object
                 shiftLists:   iterable of shiftLists that should be
                               searched.
+                prefetch:     optional ShiftListPrefetch, used when it
+                              covers the (protonated, deuterated)
+                              shiftLists.
        returns: Boolean
 
     '''
 
+    if prefetch and prefetch.covers(*shiftLists):
+        return prefetch.contains(resonance)
+
     for shiftList in shiftLists:
         if resonance.findFirstShift(parentList=shiftList):
             return True
     return False
+
+
+def make_shift_matrix(spinSystems, isotope_correction=True,
+                      protonatedShiftList=None, deuteratedShiftList=None,
+                      prefetch=None, shiftLists=None, models=None):
+    '''Pack the shifts of many spin systems into a ShiftMatrix, so
+       they can be compared one-vs-all or all-vs-all at once. The
+       shifts are copied into a SpinSystemSnapshot first and the same
+       resonances and (isotope corrected) shifts are used as in
+       SpinSystemComparison.
+       args:    spinSystems:    iterable of spin systems
+                isotope_correction: Boolean
+                protonatedShiftList: shift list of protonated shifts
+                deuteratedShiftList: shift list of deuterated shifts
+                prefetch:       optional ShiftListPrefetch
+                shiftLists:     optional, any number of shift lists to
+                                use instead of the protonated and
+                                deuterated one.
+                models:         ShiftListModel per shift list in
+                                shiftLists, see SpinSystemSnapshot.
+       returns: ShiftMatrix
+
+    '''
+
+    if shiftLists is not None:
+        snapshot = SpinSystemSnapshot.from_shiftLists(spinSystems, shiftLists,
+                                                      models)
+        return snapshot.shift_matrix(isotope_correction)
+
+    snapshot = SpinSystemSnapshot.from_resonanceGroups(spinSystems,
+                                                       protonatedShiftList,
+                                                       deuteratedShiftList,
+                                                       prefetch=prefetch)
+    return snapshot.shift_matrix(isotope_correction)
+
+
+def merge_unique_resonances(pairs, undo, **kwargs):
+    '''Move the resonances of a spin system that have an assign name
+       the other spin system does not have into that other spin
+       system, for many pairs at once. Resonances whose assign name is
+       present in both spin systems stay where they are. Pairs are
+       handled in order, so a spin system that received resonances
+       can be the source of a later pair. The notifiers of the whole
+       project for moved resonances are held back until all pairs are
+       merged, then every notifier is called once per moved resonance.
+       args:    pairs:      iterable of (target spin system, source
+                            spin system)
+                undo:       memops Undo object of the project, a
+                            waypoint is set before the first move so
+                            the whole batch is undone in one step.
+                kwargs:     passed on to SpinSystemComparison
+       returns: list of (resonance, source, target) for every moved
+                resonance.
+       raises:  ValueError when there is no undo object, the merge
+                could not be undone.
+
+    '''
+
+    if undo is None or not hasattr(undo, 'newWaypoint'):
+        raise ValueError('Spin systems are only merged when the change '
+                         'can be undone, the project has no undo object.')
+
+    moved = []
+    cache = kwargs.get('cache')
+    notifiers = DeferredNotifiers('setResonanceGroup')
+
+    try:
+        for target, source in pairs:
+            if target is source or target.isDeleted or source.isDeleted:
+                continue
+            comparison = SpinSystemComparison(target, source, **kwargs)
+            resonances = sorted(comparison.differences[1],
+                                key=lambda resonance: resonance.serial)
+            if resonances and not moved:
+                undo.newWaypoint()
+            for resonance in resonances:
+                notifiers.hold(resonance)
+                resonance.setResonanceGroup(target)
+                if cache is not None:
+                    # The isotope correction depends on the residue type.
+                    cache.invalidate_resonance(resonance)
+                moved.append((resonance, source, target))
+    finally:
+        notifiers.release()
+
+    return moved
+
+
+class DeferredNotifiers(object):
+    '''Holds back the notifiers registered for one method of the
+       CCPN classes of some objects, project wide, and calls each of
+       them once per changed object when released. The API classes
+       keep their notifiers per method name in the class attribute
+       _notifies, classes without it are left alone.
+
+    '''
+
+    def __init__(self, funcName):
+        '''Init.
+           args:    funcName: name of the method, e.g.
+                              'setResonanceGroup'
+
+        '''
+
+        self.funcName = funcName
+        self.held = {}
+        self.changed = []
+
+    def hold(self, obj):
+        '''Hold back the notifiers of the class of an object that is
+           about to change, and remember the object.
+
+        '''
+
+        cls = type(obj)
+        if cls not in self.held:
+            notifies = getattr(cls, '_notifies', None)
+            if notifies is not None:
+                self.held[cls] = notifies.get(self.funcName)
+                notifies[self.funcName] = []
+        self.changed.append(obj)
+
+    def release(self):
+        '''Restore the notifiers and call them once for every changed
+           object.
+
+        '''
+
+        for cls, notifiers in self.held.items():
+            if notifiers is None:
+                del cls._notifies[self.funcName]
+            else:
+                cls._notifies[self.funcName] = notifiers
+        held = self.held
+        self.held = {}
+
+        done = set()
+        for obj in self.changed:
+            if obj in done:
+                continue
+            done.add(obj)
+            for notify in held.get(type(obj)) or ():
+                notify(obj)
+        self.changed = []
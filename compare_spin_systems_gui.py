@@ -15,16 +15,47 @@ You should have received a copy of the GNU General Public License along with thi
 If not, see http://www.gnu.org/licenses/.
 '''
 
+import os
+import time
+
 from memops.gui.LabelFrame import LabelFrame
 from memops.gui.PulldownList import PulldownList
 from memops.gui.CheckButton import CheckButton
 from memops.gui.Label import Label
 from memops.gui.ScrolledMatrix import ScrolledMatrix
+from memops.gui.TabbedFrame import TabbedFrame
+from memops.gui.ButtonList import ButtonList
+from memops.gui.MessageReporter import showInfo, showWarning
 from ccpnmr.analysis.popups.BasePopup import BasePopup
 from ccpnmr.analysis.core.MoleculeBasic import getResidueCode
 from ccpnmr.analysis.core.AssignmentBasic import getShiftLists
+import instrumentation
+from backbone_index import BackboneIndex
+from ccpn_isotope_shift import ShiftListPrefetch, ShiftedResonanceCache
+from clustering import cluster_spin_systems
+from deviation_cache import (cache_directory, has_cache, load_results,
+                             row_hashes, save_results)
+from isotope_calibration import calibrate
+from isotope_shift import iso_corr_version, set_iso_corr
 from compare_spin_systems import (SpinSystemComparison,
-                                  find_all_shiftLists_for_resonanceGroup)
+                                  find_best_matches,
+                                  find_matching_spin_systems,
+                                  group_by_shiftLists,
+                                  merge_unique_resonances)
+from optimal_matching import match_sets
+from shift_index import ShiftIndex
+from spin_system_snapshot import SpinSystemSnapshot
+from table_cache import ShownTables, SpinSystemRowCache, make_shiftLists_string
+
+#: Seconds of work done in one go before Tk gets to handle events.
+TIME_SLICE = 0.05
+#: Spin systems compared at once when filling table A2.
+CHUNK_SIZE = 256
+#: Spin systems compared to all others at once in the all vs all
+#: comparison.
+ALL_VS_ALL_ROWS = 16
+#: Milliseconds to wait for more changes before updating the scores.
+UPDATE_DELAY = 200
 
 
 class SpinSystemComparePopup(BasePopup):
@@ -41,6 +72,25 @@ class SpinSystemComparePopup(BasePopup):
         self.correction = True
         self.protonatedShiftList = None
         self.deuteratedShiftList = None
+        self.snapshot = None
+        self.shiftMatrix = None
+        self.shiftTables = None
+        self.shiftIndex = None
+        self.backboneIndex = None
+        self.backboneOnly = False
+        self.bestAmount = None
+        self.matchesOnly = False
+        self.shiftPrefetch = None
+        self.shiftedResonanceCache = ShiftedResonanceCache()
+        self.isoCorrVersion = iso_corr_version()
+        self.comparisonJob = None
+        self.allVsAllJob = None
+        self.comparisons = []
+        self.rowCache = SpinSystemRowCache(make_resonanceGroup_string)
+        self.shownTables = ShownTables()
+        self.pendingChanges = None
+        self.dirtySpinSystems = set()
+        self.spinSystemsChanged = False
         BasePopup.__init__(self, parent, title="Compare Spin Systems", **kw)
         self.waiting = False
 
@@ -56,18 +106,36 @@ class SpinSystemComparePopup(BasePopup):
 
         '''
 
-        self.geometry('800x530')
+        self.geometry('800x560')
 
         guiFrame.grid_columnconfigure(0, weight=1)
         guiFrame.grid_rowconfigure(0, weight=0)
-        guiFrame.grid_rowconfigure(1, weight=2)
-        guiFrame.grid_rowconfigure(2, weight=1)
+        guiFrame.grid_rowconfigure(1, weight=1)
 
         isotopeFrame = LabelFrame(guiFrame, text='Isotope Shift Correction CA and CB')
         isotopeFrame.grid(row=0, column=0, sticky='nsew')
 
-        frameA = LabelFrame(guiFrame, text='Spin Systems')
-        frameA.grid(row=1, column=0, sticky='nsew')
+        tabbedFrame = TabbedFrame(guiFrame,
+                                  options=['Compare', 'Batch Matching', 'Duplicates'],
+                                  grid=(1, 0))
+        compareFrame, batchFrame, duplicatesFrame = tabbedFrame.frames
+
+        statusFrame = LabelFrame(guiFrame, text='Instrumentation')
+        statusFrame.grid(row=2, column=0, sticky='nsew')
+        statusFrame.grid_columnconfigure(2, weight=1)
+
+        compareFrame.grid_columnconfigure(0, weight=1)
+        compareFrame.grid_rowconfigure(0, weight=2)
+        compareFrame.grid_rowconfigure(1, weight=1)
+
+        batchFrame.grid_columnconfigure(0, weight=1)
+        batchFrame.grid_rowconfigure(1, weight=1)
+
+        duplicatesFrame.grid_columnconfigure(0, weight=1)
+        duplicatesFrame.grid_rowconfigure(1, weight=1)
+
+        frameA = LabelFrame(compareFrame, text='Spin Systems')
+        frameA.grid(row=0, column=0, sticky='nsew')
         frameA.grid_rowconfigure(0, weight=1)
         frameA.grid_columnconfigure(0, weight=1)
         frameA.grid_columnconfigure(1, weight=1)
@@ -75,15 +143,15 @@ class SpinSystemComparePopup(BasePopup):
         frameA1 = LabelFrame(frameA, text='Spin System 1')
         frameA1.grid(row=0, column=0, sticky='nsew')
         frameA1.grid_columnconfigure(0, weight=1)
-        frameA1.grid_rowconfigure(0, weight=1)
+        frameA1.grid_rowconfigure(1, weight=1)
 
         frameA2 = LabelFrame(frameA, text='Spin System 2')
         frameA2.grid(row=0, column=1, sticky='nsew')
-        frameA2.grid_columnconfigure(0, weight=1)
-        frameA2.grid_rowconfigure(0, weight=1)
+        frameA2.grid_columnconfigure(1, weight=1)
+        frameA2.grid_rowconfigure(1, weight=1)
 
-        frameB = LabelFrame(guiFrame, text='Comparison')
-        frameB.grid(row=2, column=0, sticky='nsew')
+        frameB = LabelFrame(compareFrame, text='Comparison')
+        frameB.grid(row=1, column=0, sticky='nsew')
 
         frameB.grid_rowconfigure(0, weight=1)
         frameB.grid_columnconfigure(0, weight=1)
@@ -107,6 +175,7 @@ class SpinSystemComparePopup(BasePopup):
         shiftLists = getShiftLists(self.nmrProject)
         self.protonatedShiftList = shiftLists[0]
         self.deuteratedShiftList = shiftLists[1]
+        self.refreshShiftPrefetch()
         shiftListNames = ['{}: {}'.format(shiftList.serial, shiftList.name) for shiftList in shiftLists]
 
         Label(isotopeFrame, text='Correct for isotope shift:', grid=(0, 0))
@@ -130,25 +199,66 @@ class SpinSystemComparePopup(BasePopup):
                                                grid=(2, 1),
                                                index=1)
 
+        ButtonList(isotopeFrame,
+                   texts=['Calibrate Isotope Shifts', 'Use Talos+ Isotope Shifts'],
+                   commands=[self.calibrateIsotopeShifts, self.resetIsotopeShifts],
+                   grid=(3, 0), gridSpan=(1, 2))
+
+        # Status line with timings and counters
+
+        Label(statusFrame, text='Record timings:', grid=(0, 0))
+        CheckButton(statusFrame,
+                    selected=False,
+                    callback=self.setInstrumentation,
+                    grid=(0, 1))
+        self.statusLabel = Label(statusFrame, text='', grid=(0, 2))
+
 
 
         # Table A1
-        headingList = ['#', 'shift lists', 'Assignment']
+        ButtonList(frameA1,
+                   texts=['Count Matches (All vs All)'],
+                   commands=[self.compareAllSpinSystems],
+                   grid=(0, 0))
+
+        headingList = ['#', 'shift lists', 'Assignment', 'matches']
 
         tipTexts = ['Spin System Serial',
                     'shift lists', 'The residue (tentatively) assigned to this spin system',
                     'The amount of spin systems that overlap with this spin system and have no violations']
 
-        editGetCallbacks = [self.setSpinSystem1]*3
-        editSetCallbacks = [None]*3
+        editGetCallbacks = [self.setSpinSystem1]*4
+        editSetCallbacks = [None]*4
         self.tableA1 = ScrolledMatrix(frameA1, headingList=headingList,
                                       multiSelect=False,
                                       editGetCallbacks=editGetCallbacks,
                                       editSetCallbacks=editSetCallbacks,
                                       tipTexts=tipTexts)
-        self.tableA1.grid(row=0, column=0, sticky='nsew')
+        self.tableA1.grid(row=1, column=0, sticky='nsew')
 
         # Table A2
+        Label(frameA2, text='Show best:', grid=(0, 0))
+        self.bestPulldown = PulldownList(frameA2,
+                                         callback=self.setBestAmount,
+                                         texts=['all', '5', '10', '25', '50'],
+                                         objects=[None, 5, 10, 25, 50],
+                                         grid=(0, 1),
+                                         sticky='w',
+                                         index=0)
+        Label(frameA2, text='Matches only:', grid=(0, 2))
+        self.matchesOnlyCheck = CheckButton(frameA2,
+                                            selected=False,
+                                            callback=self.setMatchesOnly,
+                                            grid=(0, 3))
+        Label(frameA2, text='Rank on:', grid=(0, 4))
+        self.rankPulldown = PulldownList(frameA2,
+                                         callback=self.setBackboneOnly,
+                                         texts=['all resonances', 'backbone (H, N, CA, CB)'],
+                                         objects=[False, True],
+                                         grid=(0, 5),
+                                         sticky='w',
+                                         index=0)
+
         headingList = ['#', 'shift lists', 'Assignment', 'offset']
         tipTexts = ['Spin System Serial', 'The residue (tentatively) assigned to this spin system',
                     'Root mean squared deviation of this spin system to the spin system selected in the table on the left.']
@@ -160,7 +270,7 @@ class SpinSystemComparePopup(BasePopup):
                                       editGetCallbacks=editGetCallbacks,
                                       editSetCallbacks=editSetCallbacks,
                                       tipTexts=tipTexts)
-        self.tableA2.grid(row=0, column=0, sticky='nsew')
+        self.tableA2.grid(row=1, column=0, columnspan=6, sticky='nsew')
 
         # Table B1
         headingList = ['atom', 'c.s.']
@@ -191,19 +301,313 @@ class SpinSystemComparePopup(BasePopup):
                                       tipTexts=tipTexts)
         self.tableB3.grid(row=0, column=0, sticky='nsew')
 
-        self.matchMatrix = {}
+        # Batch matching of two sets of spin systems
+
+        batchSettingsFrame = LabelFrame(batchFrame, text='Settings')
+        batchSettingsFrame.grid(row=0, column=0, sticky='nsew')
+
+        Label(batchSettingsFrame, text='Spin systems in shift lists:', grid=(0, 0))
+        self.batchPulldown1 = PulldownList(batchSettingsFrame, grid=(0, 1))
+        Label(batchSettingsFrame, text='Pair with spin systems in shift lists:', grid=(1, 0))
+        self.batchPulldown2 = PulldownList(batchSettingsFrame, grid=(1, 1))
+        Label(batchSettingsFrame, text='Max deviation:', grid=(2, 0))
+        self.maxDeviationPulldown = PulldownList(batchSettingsFrame,
+                                                 texts=['0.5', '1.0', '2.0', '5.0'],
+                                                 objects=[0.5, 1.0, 2.0, 5.0],
+                                                 grid=(2, 1),
+                                                 index=1)
+        Label(batchSettingsFrame, text='Matches only:', grid=(3, 0))
+        self.batchMatchesOnlyCheck = CheckButton(batchSettingsFrame,
+                                                 selected=False,
+                                                 grid=(3, 1))
+        ButtonList(batchSettingsFrame,
+                   texts=['Find Optimal Pairing', 'Merge Selected Pairs'],
+                   commands=[self.findOptimalPairing, self.mergeSelectedPairs],
+                   grid=(4, 0), gridSpan=(1, 2))
+
+        batchTableFrame = LabelFrame(batchFrame, text='Proposed Pairs')
+        batchTableFrame.grid(row=1, column=0, sticky='nsew')
+        batchTableFrame.expandGrid(0, 0)
+
+        headingList = ['#1', 'Assignment 1', '#2', 'Assignment 2', 'offset']
+        tipTexts = ['Serial of the spin system in the first set',
+                    'The residue (tentatively) assigned to the spin system in the first set',
+                    'Serial of the spin system in the second set',
+                    'The residue (tentatively) assigned to the spin system in the second set',
+                    'Root mean squared deviation between the two spin systems']
+        editGetCallbacks = [self.setPair]*5
+        editSetCallbacks = [None]*5
+        self.pairTable = ScrolledMatrix(batchTableFrame,
+                                        headingList=headingList,
+                                        multiSelect=True,
+                                        editGetCallbacks=editGetCallbacks,
+                                        editSetCallbacks=editSetCallbacks,
+                                        tipTexts=tipTexts)
+        self.pairTable.grid(row=0, column=0, sticky='nsew')
+
+        # Clusters of spin systems that describe the same residue
+
+        clusterSettingsFrame = LabelFrame(duplicatesFrame, text='Settings')
+        clusterSettingsFrame.grid(row=0, column=0, sticky='nsew')
+
+        Label(clusterSettingsFrame, text='Max deviation:', grid=(0, 0))
+        self.clusterDeviationPulldown = PulldownList(clusterSettingsFrame,
+                                                     texts=['-', '0.5', '1.0', '2.0'],
+                                                     objects=[None, 0.5, 1.0, 2.0],
+                                                     grid=(0, 1),
+                                                     index=0)
+        Label(clusterSettingsFrame, text='Matches only:', grid=(1, 0))
+        self.clusterMatchesOnlyCheck = CheckButton(clusterSettingsFrame,
+                                                   selected=True,
+                                                   grid=(1, 1))
+        ButtonList(clusterSettingsFrame,
+                   texts=['Find Duplicates'],
+                   commands=[self.findDuplicates],
+                   grid=(2, 0), gridSpan=(1, 2))
+
+        clusterTableFrame = LabelFrame(duplicatesFrame, text='Merge Candidates')
+        clusterTableFrame.grid(row=1, column=0, sticky='nsew')
+        clusterTableFrame.expandGrid(0, 0)
+
+        headingList = ['size', 'spin systems', 'Assignments', 'all pairs', 'max offset']
+        tipTexts = ['Amount of spin systems in the cluster',
+                    'Serials of the spin systems in the cluster',
+                    'The residues (tentatively) assigned to the spin systems',
+                    'Whether every pair of spin systems in the cluster is connected, instead of only through other spin systems',
+                    'Largest deviation between two connected spin systems in the cluster']
+        editGetCallbacks = [self.setCluster]*5
+        editSetCallbacks = [None]*5
+        self.clusterTable = ScrolledMatrix(clusterTableFrame,
+                                           headingList=headingList,
+                                           multiSelect=False,
+                                           editGetCallbacks=editGetCallbacks,
+                                           editSetCallbacks=editSetCallbacks,
+                                           tipTexts=tipTexts)
+        self.clusterTable.grid(row=0, column=0, sticky='nsew')
+
+        # ComparisonResults of all spin systems against each other,
+        # only calculated on request.
+        self.matchMatrix = None
         self.amountOfMatchesPerSpinSystem = {}
 
         self.updateTableA1()
+        self.loadCachedMatches()
+        self.updateBatchGroups()
+        self.administerNotifiers(self.registerNotify)
+
+    def administerNotifiers(self, notifyFunc):
+        '''(Un)register the notifiers that keep the cached shifts,
+           scores and tables up to date.
+               args:    notifyFunc: registerNotify or unregisterNotify
+
+        '''
+
+        for func in ('__init__', 'delete', 'setValue'):
+            notifyFunc(self.changedShift, 'ccp.nmr.Nmr.Shift', func)
+
+        for func in ('setAssignNames', 'setResonanceGroup'):
+            notifyFunc(self.changedResonance, 'ccp.nmr.Nmr.Resonance', func)
+
+        for func in ('setCcpCode', 'setResidue'):
+            notifyFunc(self.changedResonanceGroup, 'ccp.nmr.Nmr.ResonanceGroup', func)
+
+        for func in ('__init__', 'delete'):
+            notifyFunc(self.changedSpinSystems, 'ccp.nmr.Nmr.ResonanceGroup', func)
+
+        for func in ('__init__', 'delete', 'setWeight'):
+            notifyFunc(self.changedResidueProb, 'ccp.nmr.Nmr.ResidueProb', func)
+
+    def destroy(self):
+        '''Unregister notifiers and close the popup.'''
+
+        self.cancelComparison()
+        self.cancelAllVsAll()
+        if self.pendingChanges is not None:
+            self.after_cancel(self.pendingChanges)
+        self.administerNotifiers(self.unregisterNotify)
+        BasePopup.destroy(self)
+
+    def changedShift(self, shift):
+        '''Called when a shift is created, deleted or changes value.
+               args:    shift: the Shift
+
+        '''
+
+        resonance = shift.resonance
+        if self.shiftPrefetch:
+            self.shiftPrefetch.update_resonance(resonance)
+        self.changedResonance(resonance)
+
+    def changedResonance(self, resonance):
+        '''Called when the assign names or spin system of a
+           resonance change.
+               args:    resonance: the Resonance
+
+        '''
+
+        self.dirtySpinSystems.add(self.rowCache.resonanceGroups.get(resonance))
+        self.dirtySpinSystems.add(resonance.resonanceGroup)
+        self.shiftedResonanceCache.invalidate_resonance(resonance)
+        self.rowCache.invalidate_resonance(resonance)
+        self.scheduleChanges()
+
+    def changedResonanceGroup(self, resonanceGroup):
+        '''Called when the residue type of a spin system changes.
+               args:    resonanceGroup: the spin system
+
+        '''
+
+        self.dirtySpinSystems.add(resonanceGroup)
+        self.shiftedResonanceCache.invalidate_resonanceGroup(resonanceGroup)
+        self.rowCache.invalidate_resonanceGroup(resonanceGroup)
+        self.scheduleChanges()
+
+    def changedSpinSystems(self, resonanceGroup):
+        '''Called when a spin system is created or deleted.
+               args:    resonanceGroup: the spin system
+
+        '''
+
+        self.spinSystemsChanged = True
+        self.rowCache.invalidate_resonanceGroup(resonanceGroup)
+        self.scheduleChanges()
+
+    def changedResidueProb(self, residueProb):
+        '''Called when a residue type probability of a spin system
+           changes, which only affects its assignment label.
+               args:    residueProb: the ResidueProb
+
+        '''
+
+        self.rowCache.invalidate_resonanceGroup(residueProb.resonanceGroup)
+        self.scheduleChanges()
+
+    def scheduleChanges(self):
+        '''Process the changes that came in through the notifiers a
+           little later, so a burst of changes (like re-referencing a
+           whole shift list) is handled in one go.
+
+        '''
+
+        if self.pendingChanges is None:
+            self.pendingChanges = self.after(UPDATE_DELAY, self.applyChanges)
+
+    def applyChanges(self):
+        '''Bring the scores and tables up to date with the changes
+           collected since the last time. Only the spin systems that
+           changed are compared again, unless spin systems were created
+           or deleted, then everything is rebuilt.
+
+        '''
+
+        self.pendingChanges = None
+        changed = self.dirtySpinSystems - set([None])
+        self.dirtySpinSystems = set()
+        spinSystemsChanged = self.spinSystemsChanged
+        self.spinSystemsChanged = False
+
+        # Other isotope shifts were set, every corrected shift is stale.
+        if self.isoCorrVersion != iso_corr_version():
+            spinSystemsChanged = True
+
+        if spinSystemsChanged:
+            for attribute in ('spinSystem1', 'spinSystem2'):
+                spinSystem = getattr(self, attribute)
+                if spinSystem is not None and spinSystem.isDeleted:
+                    setattr(self, attribute, None)
+            self.updateBatchGroups()
+
+        if spinSystemsChanged or not self.updateScores(changed):
+            self.invalidateScores()
+            if self.matchMatrix is not None:
+                self.compareAllSpinSystems()
+
+        # The all vs all comparison that is still running started from
+        # the old shifts.
+        if self.allVsAllJob is not None and (spinSystemsChanged or changed):
+            self.compareAllSpinSystems()
+
+        self.updateTableA1()
+
+        if spinSystemsChanged:
+            self.updateTableA2()
+        elif changed:
+            self.updateComparisons(changed)
+        else:
+            self.showComparisons(self.comparisons)
+
+        if spinSystemsChanged or changed & set([self.spinSystem1, self.spinSystem2]):
+            self.updateCompareTables()
+
+    def updateScores(self, spinSystems):
+        '''Update the snapshot, packed shifts and all vs all results
+           for spin systems whose shifts, resonances or residue type
+           changed. Only the pairs these spin systems are in are
+           compared again.
+           args:    spinSystems: set of spin systems that changed
+           returns: Boolean, False if the scores could not be updated
+                    in place and should be rebuilt.
+
+        '''
+
+        if not spinSystems:
+            return True
+
+        if self.snapshot is None:
+            return self.matchMatrix is None
+
+        spinSystems = list(spinSystems)
+        if not self.snapshot.update_resonanceGroups(spinSystems,
+                                                    self.protonatedShiftList,
+                                                    self.deuteratedShiftList,
+                                                    prefetch=self.shiftPrefetch):
+            return False
+
+        if self.shiftMatrix is not None:
+            records = self.snapshot.records(self.correction, spinSystems)
+            if not self.shiftMatrix.update_rows(spinSystems, records):
+                return False
+
+        if self.shiftTables is not None:
+            self.shiftTables.update(self.snapshot.shift_tables(self.correction,
+                                                               spinSystems))
+        self.shiftIndex = None
+        self.backboneIndex = None
+
+        if self.matchMatrix is not None:
+            self.matchMatrix.update_rows(self.getShiftMatrix(), spinSystems)
+            self.amountOfMatchesPerSpinSystem = self.matchMatrix.amount_of_matches()
+
+        return True
 
     def update(self):
         '''Updates all tables except for tableA1.
 
         '''
 
+        self.cancelAllVsAll()
+        self.invalidateScores()
+        if self.matchMatrix is not None:
+            self.matchMatrix = None
+            self.amountOfMatchesPerSpinSystem = {}
+            self.updateTableA1()
+        self.loadCachedMatches()
         self.updateTableA2()
         self.updateCompareTables()
 
+    def invalidateScores(self):
+        '''Forget the snapshot, packed shifts and shift index of all
+           spin systems, they are rebuilt when needed.
+
+        '''
+
+        self.snapshot = None
+        self.shiftMatrix = None
+        self.shiftTables = None
+        self.shiftIndex = None
+        self.backboneIndex = None
+        self.isoCorrVersion = iso_corr_version()
+
     def setCorrection(self, selected):
         '''Toggles on/off whether the isotope correction should
            be applied or not.
@@ -215,6 +619,75 @@ class SpinSystemComparePopup(BasePopup):
             self.correction = selected
             self.update()
 
+    def calibrateIsotopeShifts(self):
+        '''Fit the CA and CB isotope shifts to the resonances that have
+           a shift in both the protonated and the deuterated shift list
+           (see isotope_calibration) and use them from now on.
+
+        '''
+
+        if (self.protonatedShiftList is None or self.deuteratedShiftList is None
+                or self.protonatedShiftList is self.deuteratedShiftList):
+            showWarning('Calibrate isotope shifts',
+                        'Select two different shift lists first.', parent=self)
+            return
+
+        iso_corr, amounts = calibrate(self.getSnapshot())
+        measurements = amounts['Avg']
+        if not sum(measurements):
+            showWarning('Calibrate isotope shifts',
+                        'No CA or CB resonance has a shift in both shift '
+                        'lists, the isotope shifts are not changed.', parent=self)
+            return
+
+        set_iso_corr(iso_corr)
+        self.update()
+        showInfo('Calibrate isotope shifts',
+                 'Fitted to {} CA and {} CB shifts. Residue types with '
+                 'less than 3 shifts keep the Talos+ value.'.format(*measurements),
+                 parent=self)
+
+    def resetIsotopeShifts(self):
+        '''Go back to the Talos+ isotope shifts.
+
+        '''
+
+        set_iso_corr(None)
+        self.update()
+
+    def setBestAmount(self, amount):
+        '''Set how many of the best matching spin systems are
+           shown in table A2.
+               args:    amount: int or None to show all spin systems.
+
+        '''
+
+        if amount != self.bestAmount:
+            self.bestAmount = amount
+            self.updateTableA2()
+
+    def setMatchesOnly(self, selected):
+        '''Toggles on/off whether only matching spin systems are
+           shown in table A2.
+               args:    selected: Boolean
+
+        '''
+
+        if self.matchesOnly is not selected:
+            self.matchesOnly = selected
+            self.updateTableA2()
+
+    def setBackboneOnly(self, backboneOnly):
+        '''Set whether spin systems in table A2 are ranked on the
+           backbone shifts only, using a nearest neighbour search.
+               args:    backboneOnly: Boolean
+
+        '''
+
+        if backboneOnly is not self.backboneOnly:
+            self.backboneOnly = backboneOnly
+            self.updateTableA2()
+
     def setProtonatedShiftList(self, shiftList):
         '''Set the shift list where protonated values of
            the chemical shifts should be fetched.
@@ -225,6 +698,7 @@ class SpinSystemComparePopup(BasePopup):
 
         if not self.protonatedShiftList is shiftList:
             self.protonatedShiftList = shiftList
+            self.refreshShiftPrefetch()
             self.update()
 
     def setDeuteratedShiftList(self, shiftList):
@@ -237,8 +711,18 @@ class SpinSystemComparePopup(BasePopup):
 
         if not self.deuteratedShiftList is shiftList:
             self.deuteratedShiftList = shiftList
+            self.refreshShiftPrefetch()
             self.update()
 
+    def refreshShiftPrefetch(self):
+        '''Fetch the shifts of all resonances in the selected
+           protonated and deuterated shift lists in one go.
+
+        '''
+
+        self.shiftPrefetch = ShiftListPrefetch(self.protonatedShiftList,
+                                               self.deuteratedShiftList)
+
     def setSpinSystem1(self, spinSystem):
         '''Set the first of two spin systems that should
            be compared.
@@ -274,56 +758,460 @@ class SpinSystemComparePopup(BasePopup):
 
         for spinSystem in spinSystems:
             objectList.append(spinSystem)
-            shiftLists_string = make_shiftLists_string(find_all_shiftLists_for_resonanceGroup(spinSystem))
+            shiftLists_string, label = self.rowCache.get(spinSystem)
             data.append([spinSystem.serial,
                          shiftLists_string,
-                         make_resonanceGroup_string(spinSystem)])
+                         label,
+                         self.amountOfMatchesPerSpinSystem.get(spinSystem, '-')])
+
+        if self.updateTable(self.tableA1, objectList, data):
+            self.tableA1.sortLine(2)
+
+    def compareAllSpinSystems(self):
+        '''Compare all spin systems to each other and count for every
+           spin system how many other spin systems it matches. The rows
+           in the cache are loaded straight away, the other spin
+           systems are compared in time slices on the Tk event loop, so
+           the popup stays responsive. A comparison that is still
+           running is started over.
+
+        '''
+
+        self.cancelAllVsAll()
+        shiftMatrix = self.getShiftMatrix()
+        serials = [spinSystem.serial for spinSystem in shiftMatrix.keys]
+        directory = self.getCacheDirectory()
+        with instrumentation.timer('all_vs_all'):
+            results, stale, saved = load_results(directory, shiftMatrix, serials)
+
+        if not stale:
+            self.finishAllVsAll(results, directory, serials, saved)
+            return
+
+        batches = (stale[start:start + ALL_VS_ALL_ROWS]
+                   for start in range(0, len(stale), ALL_VS_ALL_ROWS))
+        self.allVsAllJob = self.after_idle(self.continueAllVsAll, results,
+                                           shiftMatrix, batches, directory,
+                                           serials)
+
+    def continueAllVsAll(self, results, shiftMatrix, batches, directory, serials):
+        '''Do one time slice of the all vs all comparison and schedule
+           the next one.
+           args:    results:     ComparisonResults being filled in
+                    shiftMatrix: ShiftMatrix the comparison started from
+                    batches:     iterator of lists of spin systems that
+                                 still have to be compared.
+                    directory:   cache directory, None for no cache
+                    serials:     serial of every spin system in the
+                                 ShiftMatrix.
+
+        '''
+
+        self.allVsAllJob = None
+        finished = False
+        deadline = time.time() + TIME_SLICE
+
+        with instrumentation.timer('all_vs_all'):
+            while not finished and time.time() < deadline:
+                batch = next(batches, None)
+                if batch is None:
+                    finished = True
+                else:
+                    results.update_rows(shiftMatrix, batch)
+
+        if finished:
+            self.finishAllVsAll(results, directory, serials, False)
+        else:
+            self.allVsAllJob = self.after(1, self.continueAllVsAll, results,
+                                          shiftMatrix, batches, directory,
+                                          serials)
+
+    def finishAllVsAll(self, results, directory, serials, saved):
+        '''Save and show the completed all vs all comparison.
+           args:    results:   ComparisonResults of all spin systems
+                    directory: cache directory, None for no cache
+                    serials:   serial of every spin system in results
+                    saved:     Boolean, True if the cache already holds
+                               these results.
 
-        self.tableA1.update(objectList=objectList, textMatrix=data)
-        self.tableA1.sortLine(2)
+        '''
+
+        if directory is not None and not saved:
+            with instrumentation.timer('all_vs_all'):
+                save_results(directory, results, serials,
+                             row_hashes(self.getShiftMatrix()))
+        self.matchMatrix = results
+        self.amountOfMatchesPerSpinSystem = results.amount_of_matches()
+        self.updateTableA1()
+
+    def cancelAllVsAll(self):
+        '''Stop the all vs all comparison, if one is running.
+
+        '''
+
+        if self.allVsAllJob is not None:
+            self.after_cancel(self.allVsAllJob)
+            self.allVsAllJob = None
+
+    def loadCachedMatches(self):
+        '''Load the all vs all comparison saved for the current project,
+           shift lists and correction setting, if there is one. Only
+           spin systems whose shifts changed since are compared again.
+
+        '''
+
+        if has_cache(self.getCacheDirectory()):
+            self.compareAllSpinSystems()
+
+    def getCacheDirectory(self):
+        '''Get the directory next to the project where the all vs all
+           comparison is cached for the current settings.
+           returns: str, None when the project has no user data
+                    repository, nothing is cached then.
+
+        '''
+
+        project = self.nmrProject.root
+        repository = project.findFirstRepository(name='userData')
+        if repository is None:
+            return None
+        base = os.path.join(repository.url.path, 'compare_spin_systems')
+        serials = [shiftList.serial if shiftList else None
+                   for shiftList in (self.protonatedShiftList,
+                                     self.deuteratedShiftList)]
+        return cache_directory(base, project.name, serials, self.correction)
 
     def updateTableA2(self):
-        '''Update tableA2 where the second spin systems is picked from.
+        '''Start comparing the first spin system to all others. The
+           comparison runs in time slices on the Tk event loop, so the
+           popup stays responsive. Table A2 is filled in while results
+           come in, best first, and a comparison that is still running
+           is cancelled when a new one starts.
 
         '''
 
+        self.cancelComparison()
+        self.comparisons = []
+
         if not self.spinSystem1:
             return
 
-        comparisons = self.compareToSpinSystem(self.spinSystem1)
+        batches = self.compareToSpinSystem(self.spinSystem1)
+        self.comparisonJob = self.after_idle(self.continueComparison, batches)
+
+    def cancelComparison(self):
+        '''Stop the comparison that is filling table A2, if any.
+
+        '''
+
+        if self.comparisonJob is not None:
+            self.after_cancel(self.comparisonJob)
+            self.comparisonJob = None
+
+    def continueComparison(self, batches):
+        '''Do one time slice of the comparison that fills table A2 and
+           schedule the next one.
+           args:    batches:    iterator of lists of (spin system,
+                                deviation, match), see
+                                compareToSpinSystem.
+
+        '''
+
+        self.comparisonJob = None
+        finished = False
+        deadline = time.time() + TIME_SLICE
+
+        while not finished and time.time() < deadline:
+            batch = next(batches, None)
+            if batch is None:
+                finished = True
+            else:
+                self.comparisons.extend(batch)
+
+        self.comparisons.sort(key=comparison_sort_key)
+        if self.bestAmount:
+            del self.comparisons[self.bestAmount:]
+
+        self.showComparisons(self.comparisons)
+
+        if not finished:
+            self.comparisonJob = self.after(1, self.continueComparison, batches)
+
+    def updateComparisons(self, spinSystems):
+        '''Compare the first spin system again to spin systems that
+           changed, keeping the other results in table A2. If table A2
+           shows a selection of spin systems (best N, matches only or
+           backbone neighbours) or the first spin system itself
+           changed, the comparison is started over.
+           args:    spinSystems: set of spin systems that changed
+
+        '''
+
+        if (self.spinSystem1 is None or self.spinSystem1 in spinSystems
+                or self.comparisonJob is not None or self.bestAmount
+                or self.matchesOnly or self.backboneOnly):
+            self.updateTableA2()
+            return
+
+        shiftMatrix = self.getShiftMatrix()
+        spinSystems = [spinSystem for spinSystem in spinSystems
+                       if spinSystem in shiftMatrix.index]
+        rows = [shiftMatrix.index[spinSystem] for spinSystem in spinSystems]
+        deviations, matches, overlap = shiftMatrix.compare_one(self.spinSystem1,
+                                                               rows=rows)
+        changed = {}
+
+        for spinSystem2, deviation, match, amount in zip(spinSystems,
+                                                         deviations,
+                                                         matches,
+                                                         overlap):
+            if amount:
+                deviation = float(deviation)
+            else:
+                deviation = None
+            changed[spinSystem2] = (spinSystem2, deviation, bool(match))
+
+        self.comparisons = [changed.get(comparison[0], comparison)
+                            for comparison in self.comparisons]
+        self.comparisons.sort(key=comparison_sort_key)
+        self.showComparisons(self.comparisons)
+
+    def showComparisons(self, comparisons):
+        '''Update tableA2 where the second spin systems is picked from.
+           args:    comparisons:    list of (spin system, deviation,
+                                    match), best first.
+
+        '''
 
         data = []
         objectList = []
         colorMatrix = []
 
-        for comp in comparisons:
-
-            resonanceGroup = comp.spinSystem2
+        for resonanceGroup, deviation, match in comparisons:
 
             objectList.append(resonanceGroup)
             oneRow = []
             oneRow.append(resonanceGroup.serial)
-            shiftLists_string = make_shiftLists_string(find_all_shiftLists_for_resonanceGroup(resonanceGroup))
-            oneRow.append(shiftLists_string)
-            oneRow.append(make_resonanceGroup_string(resonanceGroup))
+            oneRow.extend(self.rowCache.get(resonanceGroup))
 
-            if comp.deviation is None:
+            if deviation is None:
                 oneRow.append('-')
             else:
-                oneRow.append(comp.deviation)
+                oneRow.append(deviation)
 
-            if comp.match:
+            if match:
                 colorMatrix.append(['#298A08']*4)
             else:
                 colorMatrix.append([None]*4)
 
             data.append(oneRow)
 
+        self.updateTable(self.tableA2, objectList, data, colorMatrix)
 
-        data, objectList, colorMatrix = zip(*sorted(zip(data, objectList, colorMatrix), key=lambda x: x[0][3]))
-        self.tableA2.update(objectList=objectList,
-                            textMatrix=data,
-                            colorMatrix=colorMatrix)
+    def updateTable(self, table, objectList, data, colorMatrix=None):
+        '''Update a table, unless it already shows exactly these rows.
+           args:    table:       ScrolledMatrix
+                    objectList:  list of objects, one per row
+                    data:        list of rows
+                    colorMatrix: optional list of row colours
+           returns: Boolean, True if the table was updated.
+
+        '''
+
+        if not self.shownTables.changed(table, objectList, data, colorMatrix):
+            return False
+
+        with instrumentation.timer('table_update'):
+            table.update(objectList=list(objectList), textMatrix=data,
+                         colorMatrix=colorMatrix)
+        self.updateStatus()
+        return True
+
+    def setInstrumentation(self, selected):
+        '''Toggles on/off recording of timings and counters, which are
+           shown in the status line.
+               args:    selected: Boolean
+
+        '''
+
+        instrumentation.reset()
+        if selected:
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+        self.updateStatus()
+
+    def updateStatus(self):
+        '''Show the recorded timings and counters in the status line.
+
+        '''
+
+        if instrumentation.instruments.enabled:
+            self.statusLabel.set(instrumentation.status_line())
+        else:
+            self.statusLabel.set('')
+
+    def updateBatchGroups(self):
+        '''Update the pulldowns to pick the two sets of spin systems
+           for batch matching. Spin systems are grouped by the
+           combination of shift lists their resonances are in.
+
+        '''
+
+        groups = group_by_shiftLists(self.nmrProject.resonanceGroups)
+        shiftListCombinations = sorted(groups, key=len, reverse=True)
+        texts = [make_shiftLists_string(shiftLists) or '-' for shiftLists in shiftListCombinations]
+        objects = [groups[shiftLists] for shiftLists in shiftListCombinations]
+
+        self.batchPulldown1.setup(texts, objects, 0)
+        self.batchPulldown2.setup(texts, objects, 1 if len(texts) > 1 else 0)
+
+    def findOptimalPairing(self):
+        '''Pair the spin systems of the two selected sets one-to-one,
+           so that the total deviation is as small as possible.
+
+        '''
+
+        spinSystems1 = self.batchPulldown1.getObject()
+        spinSystems2 = self.batchPulldown2.getObject()
+        if not spinSystems1 or not spinSystems2:
+            return
+
+        pairs = match_sets(self.getShiftMatrix(), spinSystems1, spinSystems2,
+                           max_deviation=self.maxDeviationPulldown.getObject(),
+                           matches_only=self.batchMatchesOnlyCheck.get())
+        self.updatePairTable(pairs)
+
+    def updatePairTable(self, pairs):
+        '''Update the table with proposed pairs of spin systems.
+           args:    pairs:    list of (spin system 1, spin system 2,
+                              deviation, match) tuples.
+
+        '''
+
+        data = []
+        colorMatrix = []
+
+        for spinSystem1, spinSystem2, deviation, match in pairs:
+            data.append([spinSystem1.serial,
+                         self.rowCache.get(spinSystem1)[1],
+                         spinSystem2.serial,
+                         self.rowCache.get(spinSystem2)[1],
+                         deviation])
+            if match:
+                colorMatrix.append(['#298A08']*5)
+            else:
+                colorMatrix.append([None]*5)
+
+        self.pairTable.update(objectList=list(pairs),
+                              textMatrix=data,
+                              colorMatrix=colorMatrix)
+
+    def findDuplicates(self):
+        '''Cluster all spin systems that match (or deviate less than
+           the selected maximum) into groups that probably describe the
+           same residue.
+
+        '''
+
+        clusters = cluster_spin_systems(self.getShiftMatrix(),
+                                        self.getShiftIndex(),
+                                        self.getShiftTables(),
+                                        max_deviation=self.clusterDeviationPulldown.getObject(),
+                                        matches_only=self.clusterMatchesOnlyCheck.get())
+        self.updateClusterTable(clusters)
+
+    def updateClusterTable(self, clusters):
+        '''Update the table with clusters of duplicate spin systems.
+           args:    clusters:    list of (spin systems, complete,
+                                 largest deviation) tuples.
+
+        '''
+
+        data = []
+        colorMatrix = []
+
+        for spinSystems, complete, deviation in clusters:
+            data.append([len(spinSystems),
+                         ', '.join(str(spinSystem.serial) for spinSystem in spinSystems),
+                         ' | '.join(self.rowCache.get(spinSystem)[1] for spinSystem in spinSystems),
+                         'yes' if complete else 'no',
+                         deviation])
+            if complete:
+                colorMatrix.append(['#298A08']*5)
+            else:
+                colorMatrix.append([None]*5)
+
+        self.clusterTable.update(objectList=list(clusters),
+                                 textMatrix=data,
+                                 colorMatrix=colorMatrix)
+
+    def setCluster(self, cluster):
+        '''Show the comparison of the first two spin systems in a
+           cluster.
+               args:    cluster: (spin systems, complete, largest
+                                 deviation)
+
+        '''
+
+        spinSystems = cluster[0]
+        self.setSpinSystem1(spinSystems[0])
+        self.setSpinSystem2(spinSystems[1])
+
+    def mergeSelectedPairs(self):
+        '''Move the resonances of the second spin system of every
+           selected pair that have an assign name the first spin system
+           does not have into the first spin system. Notifiers are held
+           back for the whole project while the resonances are moved,
+           the popup then updates its scores and tables once, and the
+           whole batch is one step on the undo stack. Nothing is merged
+           when the project has no undo.
+
+        '''
+
+        pairs = self.pairTable.currentObjects
+        if not pairs:
+            return
+
+        undo = getattr(self.nmrProject.root, '_undo', None)
+        if undo is None:
+            showWarning('Merge spin systems',
+                        'Undo is switched off for this project, the spin '
+                        'systems are not merged.', parent=self)
+            return
+
+        self.administerNotifiers(self.unregisterNotify)
+        try:
+            moved = merge_unique_resonances([pair[:2] for pair in pairs], undo,
+                                            isotope_correction=self.correction,
+                                            protonatedShiftList=self.protonatedShiftList,
+                                            deuteratedShiftList=self.deuteratedShiftList,
+                                            prefetch=self.shiftPrefetch,
+                                            cache=self.shiftedResonanceCache)
+        finally:
+            self.administerNotifiers(self.registerNotify)
+
+        for resonance, source, target in moved:
+            self.dirtySpinSystems.update((source, target))
+            self.rowCache.invalidate_resonance(resonance)
+
+        remaining = [pair for pair in self.pairTable.objectList if pair not in pairs]
+        self.updatePairTable(remaining)
+
+        if self.pendingChanges is not None:
+            self.after_cancel(self.pendingChanges)
+        self.applyChanges()
+
+    def setPair(self, pair):
+        '''Show the comparison of a proposed pair of spin systems.
+               args:    pair: (spin system 1, spin system 2,
+                              deviation, match)
+
+        '''
+
+        spinSystem1, spinSystem2 = pair[:2]
+        self.setSpinSystem1(spinSystem1)
+        self.setSpinSystem2(spinSystem2)
 
     def updateCompareTables(self):
         '''Update all tables that compare 2 spin systems. These are the
@@ -387,22 +1275,170 @@ class SpinSystemComparePopup(BasePopup):
                             colorMatrix=colorMatrix)
 
     def compareToSpinSystem(self, spinSystem):
-        '''Compare one spin system to all others.
+        '''Compare one spin system to all others. The backbone and
+           matches only searches use an index and are done in one go,
+           the best N and full comparisons are done a chunk of spin
+           systems at a time.
            args:    spinSystem:    spin system
-           returns: list of SpinSystemComparison objects.
+           returns: generator of lists of (spin system, deviation,
+                    match) tuples, deviation is None if the spin
+                    systems have no resonance types in common.
 
         '''
 
-        spinSystems = self.nmrProject.resonanceGroups
-        comparisons = []
+        if self.backboneOnly:
+            yield self.compareBackbone(spinSystem)
+            return
 
-        for spinSystem2 in spinSystems:
+        if self.matchesOnly:
+            best = find_matching_spin_systems(spinSystem,
+                                              self.getShiftIndex(),
+                                              k=self.bestAmount,
+                                              tables=self.getShiftTables())
+            yield [(spinSystem2, deviation, match) for deviation, match, spinSystem2 in best]
+            return
+
+        if self.bestAmount:
+            for comparisons in self.findBestSpinSystems(spinSystem):
+                yield comparisons
+            return
 
-            comparisons.append(self.compare2spinSystems(spinSystem,
-                                                        spinSystem2))
+        shiftMatrix = self.getShiftMatrix()
+
+        for start, deviations, matches, overlap in shiftMatrix.iterate_compare_one(spinSystem, CHUNK_SIZE):
+            comparisons = []
+            spinSystems = shiftMatrix.keys[start:start + len(deviations)]
+
+            for spinSystem2, deviation, match, amount in zip(spinSystems,
+                                                             deviations,
+                                                             matches,
+                                                             overlap):
+                if amount:
+                    deviation = float(deviation)
+                else:
+                    deviation = None
+                comparisons.append((spinSystem2, deviation, bool(match)))
+
+            yield comparisons
+
+    def findBestSpinSystems(self, spinSystem):
+        '''Find the best N spin systems with find_best_matches, a chunk
+           of candidates at a time. Once N spin systems are shown, the
+           worst of them bounds the search in the next chunks, so
+           candidates that cannot make it into the table are not
+           scored completely.
+           args:    spinSystem:    spin system
+           returns: generator of lists of (spin system, deviation,
+                    match) tuples.
+
+        '''
+
+        tables = self.getShiftTables()
+        candidates = self.getShiftMatrix().keys
+
+        for start in range(0, len(candidates), CHUNK_SIZE):
+            # The comparisons of the current time slice are not sorted
+            # yet.
+            deviations = sorted(comparison[1] for comparison in self.comparisons)
+            bound = None
+            if len(deviations) >= self.bestAmount:
+                bound = deviations[self.bestAmount - 1]
+            best = find_best_matches(spinSystem,
+                                     candidates[start:start + CHUNK_SIZE],
+                                     k=self.bestAmount,
+                                     max_deviation=bound,
+                                     tables=tables)
+            yield [(spinSystem2, deviation, match) for deviation, match, spinSystem2 in best]
+
+    def compareBackbone(self, spinSystem):
+        '''Find the spin systems closest to a spin system in backbone
+           (H, N, CA, CB) chemical shift space.
+           args:    spinSystem:    spin system
+           returns: list of (spin system, backbone deviation, match)
+                    tuples.
+
+        '''
+
+        shiftMatrix = self.getShiftMatrix()
+        k = self.bestAmount or len(shiftMatrix.keys)
+        nearest = self.getBackboneIndex().nearest(spinSystem, k=k)
+        if not nearest:
+            return []
+
+        rows = [shiftMatrix.index[spinSystem2] for distance, spinSystem2 in nearest]
+        deviations, matches, overlap = shiftMatrix.compare_one(spinSystem, rows=rows)
+        comparisons = []
+
+        for (distance, spinSystem2), match in zip(nearest, matches):
+            if self.matchesOnly and not match:
+                continue
+            comparisons.append((spinSystem2, float(distance), bool(match)))
 
         return comparisons
 
+    def getBackboneIndex(self):
+        '''Get the nearest neighbour index over the backbone shifts
+           of all spin systems, build once until the settings change.
+           returns: BackboneIndex
+
+        '''
+
+        if self.backboneIndex is None:
+            self.backboneIndex = BackboneIndex.from_shift_matrix(self.getShiftMatrix())
+        return self.backboneIndex
+
+    def getSnapshot(self):
+        '''Get a plain data copy of all spin systems and their shifts
+           in the selected shift lists. All scores are calculated from
+           this snapshot, it is made once and re-used until the
+           settings or shifts change.
+           returns: SpinSystemSnapshot
+
+        '''
+
+        if self.snapshot is None:
+            spinSystems = self.nmrProject.resonanceGroups
+            self.snapshot = SpinSystemSnapshot.from_resonanceGroups(spinSystems,
+                                                                    self.protonatedShiftList,
+                                                                    self.deuteratedShiftList,
+                                                                    prefetch=self.shiftPrefetch)
+        return self.snapshot
+
+    def getShiftMatrix(self):
+        '''Get the shifts of all spin systems packed in one
+           ShiftMatrix. The matrix is build once and re-used until
+           the settings change.
+           returns: ShiftMatrix
+
+        '''
+
+        if self.shiftMatrix is None:
+            self.shiftMatrix = self.getSnapshot().shift_matrix(self.correction)
+        return self.shiftMatrix
+
+    def getShiftTables(self):
+        '''Get the shifts of every spin system by assign name.
+           returns: dict spin system -> dict assign name -> list of
+                    shift value lists
+
+        '''
+
+        if self.shiftTables is None:
+            self.shiftTables = self.getSnapshot().shift_tables(self.correction)
+        return self.shiftTables
+
+    def getShiftIndex(self):
+        '''Get the index of sorted shifts per atom type of all spin
+           systems. The index is build once and re-used until the
+           settings change.
+           returns: ShiftIndex
+
+        '''
+
+        if self.shiftIndex is None:
+            self.shiftIndex = ShiftIndex(self.getShiftTables())
+        return self.shiftIndex
+
     def compare2spinSystems(self, spinSystem1, spinSystem2):
         '''Compare two spin systems to each other.
            args:    spinSystem1:    the first spin system
@@ -415,19 +1451,19 @@ class SpinSystemComparePopup(BasePopup):
                                     spinSystem2=spinSystem2,
                                     isotope_correction=self.correction,
                                     protonatedShiftList=self.protonatedShiftList,
-                                    deuteratedShiftList=self.deuteratedShiftList)
+                                    deuteratedShiftList=self.deuteratedShiftList,
+                                    prefetch=self.shiftPrefetch,
+                                    cache=self.shiftedResonanceCache)
         return comp
 
 
-def make_shiftLists_string(shiftLists):
-    '''For a list iterable of shift lists, produce a short string
-       that identifies those shiftlists.
-       args:    shiftLists:    iterable of shift lists
-       returns: str of comma seperated shift list serials
+def comparison_sort_key(comparison):
+    '''Sort key for (spin system, deviation, match) tuples, spin
+       systems without resonance types in common go last.
 
     '''
 
-    return ','.join([str(shiftList.serial) for shiftList in shiftLists])
+    return comparison[1] is None, comparison[1]
 
 
 def make_resonanceGroup_string(resonanceGroup):
@@ -0,0 +1,248 @@
+'''On-disk cache of the all-vs-all comparison of spin systems.
+
+The deviation, match and overlap arrays are saved as .npy files and
+loaded memory-mapped, so re-opening the popup does not copy or
+recalculate them. Every cache lives in its own directory, named after
+the project, the selected shift lists and the isotope correction flag.
+Next to the arrays a small JSON file records the serial of the spin
+system on every row and a hash of its shifts. When the cache is
+loaded, the rows of spin systems that are still there and did not
+change are reused, only new spin systems and spin systems whose shifts
+changed are compared again. The files on disk are never written to
+through the loaded arrays, they are replaced by save_results together
+with the meta data.
+
+'''
+
+import hashlib
+import json
+import os
+
+import numpy
+
+from shift_matrix import OVERLAP_DTYPE, ComparisonResults
+
+ARRAYS = ('deviation', 'match', 'overlap')
+META_FILE = 'meta.json'
+#: Bumped when the meta data changes, older caches are not used.
+VERSION = 1
+
+
+def cache_directory(base, project_name, shiftList_serials, isotope_correction):
+    '''Returns the directory for the cache of one combination of
+       project, shift lists and correction flag.
+       args:    base:               directory holding all caches
+                project_name:       str
+                shiftList_serials:  serials of the protonated and
+                                    deuterated shift list, None if
+                                    not selected.
+                isotope_correction: Boolean
+
+    '''
+
+    key = json.dumps([project_name, list(shiftList_serials),
+                      bool(isotope_correction)])
+    return os.path.join(base, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def row_hashes(shiftMatrix):
+    '''Hash the shifts of every spin system in a ShiftMatrix. The hash
+       only depends on the atom names, shifts and isotope states of the
+       spin system itself, not on the order of the columns or the
+       amount of copies in the rest of the matrix. Two spin systems
+       with the same hashes as before compare the same as before.
+       returns: list of str
+
+    '''
+
+    n_states = shiftMatrix.state_mask.sum(axis=1)
+    columns = sorted(range(len(shiftMatrix.atom_names)),
+                     key=lambda column: shiftMatrix.atom_names[column])
+    hashes = []
+
+    for values, present in zip(shiftMatrix.values, shiftMatrix.present):
+        digest = hashlib.sha1()
+        for column in columns:
+            if not present[column].any():
+                continue
+            shifts = values[column][present[column]][:, :n_states[column]]
+            # The comparison does not depend on the order of the copies.
+            shifts = shifts[numpy.lexsort(shifts.T[::-1])]
+            digest.update(json.dumps([shiftMatrix.atom_names[column],
+                                      list(shifts.shape)]).encode('utf-8'))
+            digest.update(numpy.ascontiguousarray(shifts).tobytes())
+        hashes.append(digest.hexdigest())
+
+    return hashes
+
+
+def has_cache(directory):
+    '''Returns True if a cache was saved in the directory. There is
+       never a cache when the directory is None.
+
+    '''
+
+    return directory is not None and os.path.exists(os.path.join(directory, META_FILE))
+
+
+def read_meta(directory):
+    '''Returns the meta data of a cache, None if there is none or it
+       was written by an older version.
+
+    '''
+
+    if not has_cache(directory):
+        return None
+    with open(os.path.join(directory, META_FILE)) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('version') != VERSION:
+        return None
+    return meta
+
+
+def write_meta(directory, serials, hashes):
+    '''Write the meta data of a cache, after the arrays.'''
+
+    path = os.path.join(directory, META_FILE)
+    with open(path + '.tmp', 'w') as meta_file:
+        json.dump({'version': VERSION,
+                   'serials': [int(serial) for serial in serials],
+                   'hashes': hashes}, meta_file)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(path + '.tmp', path)
+
+
+def save_results(directory, results, serials, hashes):
+    '''Save comparison results.
+       args:    directory:  cache directory, created if needed.
+                results:    ComparisonResults
+                serials:    serial of the spin system on every row
+                hashes:     see row_hashes
+
+    '''
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # Without meta data a half written cache is never used.
+    if has_cache(directory):
+        os.remove(os.path.join(directory, META_FILE))
+
+    # Arrays are replaced by new files, never overwritten, as they may
+    # still be memory-mapped.
+    for name in ARRAYS:
+        path = os.path.join(directory, name + '.npy')
+        with open(path + '.tmp', 'wb') as array_file:
+            numpy.save(array_file, getattr(results, name))
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+    write_meta(directory, serials, hashes)
+
+
+def load_arrays(directory):
+    '''Memory-map the cached arrays copy-on-write: they can be changed
+       in memory, but the files and their meta data stay as they were
+       saved.
+       returns: (deviation, match, overlap)
+
+    '''
+
+    return tuple(numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='c')
+                 for name in ARRAYS)
+
+
+def empty_results(keys):
+    '''Returns ComparisonResults for the keys with nothing compared
+       yet.
+
+    '''
+
+    shape = (len(keys), len(keys))
+    return ComparisonResults(keys, numpy.full(shape, numpy.nan),
+                             numpy.zeros(shape, dtype=bool),
+                             numpy.zeros(shape, dtype=OVERLAP_DTYPE))
+
+
+def load_results(directory, shiftMatrix, serials):
+    '''Get as much of the all-vs-all comparison of the spin systems in
+       a ShiftMatrix from the cache as possible.
+       args:    directory:   cache directory, or None for no cache.
+                shiftMatrix: ShiftMatrix with the current shifts
+                serials:     serial of every spin system in the
+                             ShiftMatrix, identifies the rows on disk.
+       returns: (ComparisonResults, keys of the spin systems that still
+                have to be compared, Boolean True if the results are
+                exactly what is saved). The arrays are memory-mapped
+                when the cache could be used as it is.
+
+    '''
+
+    keys = shiftMatrix.keys
+    meta = read_meta(directory)
+    if meta is None:
+        return empty_results(keys), list(keys), False
+
+    hashes = row_hashes(shiftMatrix)
+    old_rows = dict((serial, row) for row, serial in enumerate(meta['serials']))
+    new, old, stale = [], [], []
+    for row, (key, serial, row_hash) in enumerate(zip(keys, serials, hashes)):
+        old_row = old_rows.get(int(serial))
+        if old_row is not None and meta['hashes'][old_row] == row_hash:
+            new.append(row)
+            old.append(old_row)
+        else:
+            stale.append(key)
+
+    if not new:
+        return empty_results(keys), stale, False
+
+    arrays = load_arrays(directory)
+    if not stale and old == list(range(len(meta['serials']))):
+        return ComparisonResults(keys, *arrays), [], True
+
+    results = empty_results(keys)
+    new_index = numpy.ix_(new, new)
+    old_index = numpy.ix_(old, old)
+    for name, array in zip(ARRAYS, arrays):
+        getattr(results, name)[new_index] = array[old_index]
+    return results, stale, False
+
+
+def cached_compare_all(directory, shiftMatrix, serials, compare_all=None,
+                       block_size=64):
+    '''Get the all-vs-all comparison of the spin systems in a
+       ShiftMatrix, from the cache if possible. New spin systems and
+       spin systems whose shifts changed since the cache was saved are
+       compared again and the cache is saved.
+       args:    directory:   cache directory, or None to not use a
+                             cache.
+                shiftMatrix: ShiftMatrix with the current shifts
+                serials:     serial of every spin system in the
+                             ShiftMatrix, identifies the rows on disk.
+                compare_all: optional function calculating (deviation,
+                             match, overlap) for a ShiftMatrix when
+                             nothing can be reused, for instance
+                             parallel_compare.compare_all_parallel.
+                             ShiftMatrix.compare_all by default.
+                block_size:  int, see ShiftMatrix.compare_subsets
+       returns: ComparisonResults, the arrays are memory-mapped when
+                they come from the cache unchanged.
+
+    '''
+
+    results, stale, saved = load_results(directory, shiftMatrix, serials)
+
+    if len(stale) == len(shiftMatrix.keys) and stale:
+        if compare_all is None:
+            arrays = shiftMatrix.compare_all(block_size)
+        else:
+            arrays = compare_all(shiftMatrix)
+        results = ComparisonResults(shiftMatrix.keys, *arrays)
+    elif stale:
+        results.update_rows(shiftMatrix, stale, block_size)
+
+    if directory is not None and not saved:
+        save_results(directory, results, serials, row_hashes(shiftMatrix))
+    return results
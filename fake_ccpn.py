@@ -0,0 +1,181 @@
+'''Lightweight stand-ins for the CCPN objects this macro uses, so the
+   comparison code can be tested and benchmarked without a CCPN project.
+
+Only the attributes and methods that are actually used are mimicked:
+ResonanceGroup (serial, ccpCode, residue, residueProbs, resonances,
+getResonances), Resonance (serial, assignNames, resonanceGroup,
+findFirstShift, getShifts, setResonanceGroup and its notifiers), Shift
+(resonance, value, parentList) and ShiftList (serial, measurements).
+
+make_project generates a project with realistic backbone and side chain
+shifts, where part of the spin systems are noisy duplicates of others,
+as happens when the same residue is picked in different experiments.
+sample_pairs picks reproducible pairs of its spin systems.
+
+'''
+
+import random
+
+import numpy
+
+from isotope_shift import correct_for_isotope_shift as correct, talos_iso_corr
+
+#: Mean and standard deviation of the shift of every atom type.
+ATOM_SHIFTS = {'H': (8.2, 0.6),
+               'N': (119.0, 4.0),
+               'CA': (56.0, 4.0),
+               'CB': (38.0, 12.0),
+               'C': (176.0, 2.0),
+               'HA': (4.4, 0.5)}
+
+RESIDUE_TYPES = sorted(name for name in talos_iso_corr if name != 'Avg')
+
+
+class ShiftList(object):
+    '''Stand-in for ccp.nmr.Nmr.ShiftList.'''
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.measurements = []
+
+    def __lt__(self, other):
+        return self.serial < other.serial
+
+    def __repr__(self):
+        return '<ShiftList {}>'.format(self.serial)
+
+
+class Shift(object):
+    '''Stand-in for ccp.nmr.Nmr.Shift.'''
+
+    def __init__(self, parentList, resonance, value):
+        self.parentList = parentList
+        self.resonance = resonance
+        self.value = value
+        parentList.measurements.append(self)
+        resonance.shifts.append(self)
+
+
+class Resonance(object):
+    '''Stand-in for ccp.nmr.Nmr.Resonance.'''
+
+    #: Notifiers per method name, like the CCPN API classes keep them.
+    _notifies = {}
+
+    def __init__(self, serial, resonanceGroup, assignName):
+        self.serial = serial
+        self.resonanceGroup = resonanceGroup
+        self.assignNames = (assignName,)
+        self.shifts = []
+        resonanceGroup.resonances.append(self)
+
+    def getShifts(self):
+        return frozenset(self.shifts)
+
+    def setResonanceGroup(self, resonanceGroup):
+        self.resonanceGroup.resonances.remove(self)
+        self.resonanceGroup = resonanceGroup
+        resonanceGroup.resonances.append(self)
+        for notify in self._notifies.get('setResonanceGroup', ()):
+            notify(self)
+
+    def findFirstShift(self, parentList=None):
+        for shift in self.shifts:
+            if parentList is None or shift.parentList is parentList:
+                return shift
+        return None
+
+
+class ResonanceGroup(object):
+    '''Stand-in for ccp.nmr.Nmr.ResonanceGroup (spin system).'''
+
+    def __init__(self, serial, ccpCode=None):
+        self.serial = serial
+        self.ccpCode = ccpCode
+        self.residue = None
+        self.residueProbs = ()
+        self.resonances = []
+        self.isDeleted = False
+
+    def getResonances(self):
+        return frozenset(self.resonances)
+
+
+class Project(object):
+    '''A generated set of spin systems and two shift lists.'''
+
+    def __init__(self, resonanceGroups, protonatedShiftList,
+                 deuteratedShiftList):
+        self.resonanceGroups = resonanceGroups
+        self.protonatedShiftList = protonatedShiftList
+        self.deuteratedShiftList = deuteratedShiftList
+
+
+def make_project(n_spin_systems, duplicate_fraction=0.3,
+                 deuterated_fraction=0.5, noise=0.05, seed=0):
+    '''Generate a project.
+       args:    n_spin_systems:      int, amount of spin systems
+                duplicate_fraction:  float, fraction of the spin systems
+                                     that are a noisy copy of another one.
+                deuterated_fraction: float, fraction of the spin systems
+                                     that were measured on a deuterated
+                                     sample, their shifts go in the
+                                     deuterated shift list and CA/CB
+                                     shifts are isotope shifted.
+                noise:               float, standard deviation of the
+                                     difference between duplicates.
+                seed:                int, the same seed gives the same
+                                     project.
+       returns: Project
+
+    '''
+
+    generator = random.Random(seed)
+    protonatedShiftList = ShiftList(1)
+    deuteratedShiftList = ShiftList(2)
+    resonanceGroups = []
+    templates = []
+    resonance_serial = 0
+
+    for serial in range(1, n_spin_systems + 1):
+
+        if templates and generator.random() < duplicate_fraction:
+            residue_type, shifts = generator.choice(templates)
+            shifts = dict((name, value + generator.gauss(0.0, noise))
+                          for name, value in shifts.items())
+        else:
+            residue_type = generator.choice(RESIDUE_TYPES)
+            shifts = dict((name, generator.gauss(*ATOM_SHIFTS[name]))
+                          for name in ATOM_SHIFTS
+                          if not (name == 'CB' and residue_type == 'Gly'))
+            templates.append((residue_type, shifts))
+
+        # Amide only spin systems (HSQC) have not been typed yet.
+        if generator.random() < 0.2:
+            shifts = dict((name, shifts[name]) for name in ('H', 'N'))
+            residue_type = None
+
+        resonanceGroup = ResonanceGroup(serial, residue_type)
+        resonanceGroups.append(resonanceGroup)
+        deuterated = generator.random() < deuterated_fraction
+        shiftList = deuteratedShiftList if deuterated else protonatedShiftList
+
+        for name in sorted(shifts):
+            resonance_serial += 1
+            resonance = Resonance(resonance_serial, resonanceGroup, name)
+            value = shifts[name]
+            if deuterated and name in ('CA', 'CB'):
+                value = correct(residue_type or 'Avg', name, value,
+                                deuterated=False)
+            Shift(shiftList, resonance, value)
+
+    return Project(resonanceGroups, protonatedShiftList, deuteratedShiftList)
+
+
+def sample_pairs(project, amount, seed=0):
+    '''Returns a reproducible list of pairs of spin systems.'''
+
+    generator = numpy.random.RandomState(seed)
+    spinSystems = project.resonanceGroups
+    indices = generator.randint(0, len(spinSystems), size=(amount, 2))
+    return [(spinSystems[i], spinSystems[j]) for i, j in indices]
@@ -0,0 +1,161 @@
+'''Opt-in timers and counters for the hot paths of the comparison.
+
+Instrumentation is off by default and then costs one attribute lookup
+per call. When it is switched on, every timed stage keeps the amount
+of calls and the total time spent, and counters keep track of things
+like the amount of compared pairs, shift lookups and cache hits and
+misses. The results can be shown as a one line summary (the status
+line of the popup) or as a structured report (for headless runs).
+
+usage:
+    import instrumentation
+    instrumentation.enable()
+    with instrumentation.timer('snapshot'):
+        ...
+    instrumentation.count('pairs', 10)
+    instrumentation.report()
+
+'''
+
+import json
+import time
+
+
+class _NullTimer(object):
+    '''Context manager that does nothing, used when disabled.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Timer(object):
+    '''Context manager that adds the time spent to a stage.'''
+
+    def __init__(self, instruments, stage):
+        self.instruments = instruments
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.add_time(self.stage, time.time() - self.start)
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class Instruments(object):
+    '''Timers per stage and counters.'''
+
+    def __init__(self):
+        '''Init.'''
+
+        self.enabled = False
+        self.timers = {}
+        self.counters = {}
+
+    def reset(self):
+        '''Forget all timings and counts.'''
+
+        self.timers = {}
+        self.counters = {}
+
+    def timer(self, stage):
+        '''Returns a context manager timing a stage.'''
+
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, stage)
+
+    def add_time(self, stage, seconds):
+        '''Add one call that took some time to a stage.'''
+
+        calls, total = self.timers.get(stage, (0, 0.0))
+        self.timers[stage] = (calls + 1, total + seconds)
+
+    def count(self, counter, amount=1):
+        '''Add to a counter.'''
+
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def report(self):
+        '''Returns a dict with the timers ({stage: {'calls', 'seconds'}})
+           and the counters.
+
+        '''
+
+        timers = dict((stage, {'calls': calls, 'seconds': seconds})
+                      for stage, (calls, seconds) in self.timers.items())
+        return {'timers': timers, 'counters': dict(self.counters)}
+
+    def status_line(self):
+        '''Returns a short summary, slowest stages first.'''
+
+        stages = sorted(self.timers.items(), key=lambda item: -item[1][1])
+        parts = ['{} {:.3f}s'.format(stage, seconds)
+                 for stage, (calls, seconds) in stages]
+        parts.extend('{} {}'.format(counter, amount)
+                     for counter, amount in sorted(self.counters.items()))
+        return ', '.join(parts)
+
+
+#: Instruments shared by all modules.
+instruments = Instruments()
+
+
+def enable():
+    '''Switch instrumentation on.'''
+
+    instruments.enabled = True
+
+
+def disable():
+    '''Switch instrumentation off, collected data is kept.'''
+
+    instruments.enabled = False
+
+
+def timer(stage):
+    '''Returns a context manager timing a stage, see Instruments.timer.'''
+
+    return instruments.timer(stage)
+
+
+def count(counter, amount=1):
+    '''Add to a counter, see Instruments.count.'''
+
+    if instruments.enabled:
+        instruments.count(counter, amount)
+
+
+def reset():
+    '''Forget all timings and counts.'''
+
+    instruments.reset()
+
+
+def report():
+    '''Returns the structured report, see Instruments.report.'''
+
+    return instruments.report()
+
+
+def status_line():
+    '''Returns a one line summary, see Instruments.status_line.'''
+
+    return instruments.status_line()
+
+
+def write_report(path):
+    '''Write the report as JSON.'''
+
+    with open(path, 'w') as report_file:
+        json.dump(report(), report_file, indent=2, sort_keys=True)
@@ -0,0 +1,239 @@
+'''Calibrate the deuterium isotope shifts of CA and CB on a project.
+
+The Talos+ isotope shifts are averages from the literature. Samples
+that are partially back-exchanged or measured in the solid state can
+show systematically different isotope shifts. Every resonance that has
+a shift in both the protonated and the deuterated shift list is a
+direct measurement of its isotope shift (deuterated - protonated). The
+isotope shift of every residue type and atom is fitted to these with a
+robust (Huber) weighted mean, all residue types at once. Residue types
+with too few measurements keep their default value.
+
+The result can be written as JSON and used instead of the Talos+
+values with isotope_shift.set_iso_corr.
+
+usage:
+    python isotope_calibration.py protonated.str deuterated.str [...]
+        [--isotope protonated|deuterated ...] [--offset 0.0 ...]
+        [--shift-list-id ID|- ...] [--output iso_corr.json]
+        [--min-pairs 3]
+
+The shift list options are the same as for batch_spin_system_compare,
+the first protonated and the first deuterated shift list are used.
+
+'''
+
+import argparse
+import json
+import sys
+
+import numpy
+
+from isotope_shift import ISOTOPE_ATOMS, talos_iso_corr
+
+#: Huber tuning constant, in units of the robust standard deviation.
+HUBER_K = 1.345
+#: Scale factor from the median absolute deviation to the standard
+#: deviation of a normal distribution.
+MAD_SCALE = 1.4826
+
+
+def calibration_pairs(snapshot):
+    '''Collect the CA and CB resonances that have a shift in both the
+       protonated and the deuterated shift list. When the snapshot has
+       more shift lists, the first protonated and the first deuterated
+       one (according to their models) are used.
+       args:    snapshot: SpinSystemSnapshot
+       returns: (residue types, atom names, observed isotope shifts)
+
+    '''
+
+    columns = [[column for column, model in enumerate(snapshot.models)
+                if model.deuterated == deuterated] for deuterated in (False, True)]
+    if not all(columns):
+        return [], [], numpy.zeros(0)
+    protonated, deuterated = columns[0][0], columns[1][0]
+
+    names = snapshot.resonance_names
+    shifts = snapshot.shifts[:, [protonated, deuterated]]
+    selected = numpy.nonzero(numpy.in1d(names, ISOTOPE_ATOMS) &
+                             ~numpy.isnan(shifts).any(axis=1))[0]
+    residue_types = [snapshot.residue_types[row] for row in snapshot.resonance_groups[selected]]
+    atom_names = [names[index] for index in selected]
+    isotope_shifts = (snapshot.models[deuterated].rereference(atom_names, shifts[selected, 1]) -
+                      snapshot.models[protonated].rereference(atom_names, shifts[selected, 0]))
+    return residue_types, atom_names, isotope_shifts
+
+
+def group_medians(groups, values, n_groups):
+    '''Returns the (lower) median of the values in every group, nan for
+       empty groups.
+
+    '''
+
+    order = numpy.lexsort((values, groups))
+    counts = numpy.bincount(groups, minlength=n_groups)
+    starts = numpy.cumsum(counts) - counts
+    medians = numpy.full(n_groups, numpy.nan)
+    filled = counts > 0
+    medians[filled] = values[order][starts[filled] + (counts[filled] - 1) // 2]
+    return medians
+
+
+def robust_group_means(groups, values, n_groups, iterations=20):
+    '''Huber estimate of the location of the values in every group, by
+       iteratively reweighted least squares over all groups at once.
+       args:    groups:     int array, group of every value
+                values:     float array
+                n_groups:   int
+                iterations: int, maximum amount of reweighting steps
+       returns: (locations, amount of values) per group, nan for empty
+                groups.
+
+    '''
+
+    counts = numpy.bincount(groups, minlength=n_groups)
+    locations = group_medians(groups, values, n_groups)
+    if not len(values):
+        return locations, counts
+
+    residuals = values - locations[groups]
+    scales = MAD_SCALE * group_medians(groups, numpy.abs(residuals), n_groups)
+    # Groups without spread would give infinite weights.
+    scales = numpy.fmax(scales, 1e-6)
+    cutoffs = HUBER_K * scales[groups]
+
+    for iteration in range(iterations):
+        residuals = numpy.abs(values - locations[groups])
+        weights = numpy.ones(len(values))
+        outliers = residuals > cutoffs
+        weights[outliers] = cutoffs[outliers] / residuals[outliers]
+        totals = numpy.bincount(groups, weights, minlength=n_groups)
+        updated = numpy.bincount(groups, weights * values, minlength=n_groups)
+        filled = totals > 0
+        updated[filled] /= totals[filled]
+        updated[~filled] = numpy.nan
+        converged = numpy.allclose(updated[filled], locations[filled], rtol=0.0,
+                                   atol=1e-6)
+        locations = updated
+        if converged:
+            break
+
+    return locations, counts
+
+
+def fit_isotope_shifts(residue_types, atom_names, isotope_shifts, min_pairs=3,
+                       default=talos_iso_corr):
+    '''Fit the isotope shift of every residue type and atom.
+       args:    residue_types:  three letter code per measurement, None
+                                or unknown codes only count for 'Avg'.
+                atom_names:     'CA' or 'CB' per measurement
+                isotope_shifts: float array, deuterated - protonated
+                                shift per measurement.
+                min_pairs:      int, residue types and atoms with fewer
+                                measurements keep the default.
+                default:        dict like talos_iso_corr
+       returns: (iso_corr dict like talos_iso_corr, dict residue type
+                -> (amount of CA, amount of CB measurements))
+
+    '''
+
+    names = sorted(default)
+    index = dict((name, row) for row, name in enumerate(names))
+    average = index['Avg']
+    n_groups = len(names) * len(ISOTOPE_ATOMS)
+
+    rows = numpy.array([index.get(residue_type, average) for residue_type in residue_types],
+                       dtype=int)
+    columns = numpy.array([ISOTOPE_ATOMS.index(name) for name in atom_names],
+                          dtype=int)
+    values = numpy.asarray(isotope_shifts, dtype=float)
+
+    # Every measurement counts for its own residue type and for 'Avg',
+    # measurements of unknown residue types only for 'Avg'.
+    typed = rows != average
+    groups = numpy.concatenate([rows[typed] * len(ISOTOPE_ATOMS) + columns[typed],
+                                average * len(ISOTOPE_ATOMS) + columns])
+    values = numpy.concatenate([values[typed], values])
+
+    locations, counts = robust_group_means(groups, values, n_groups)
+    locations = locations.reshape(len(names), len(ISOTOPE_ATOMS))
+    counts = counts.reshape(len(names), len(ISOTOPE_ATOMS))
+
+    fitted = numpy.array([default[name] for name in names], dtype=float)
+    enough = counts >= max(min_pairs, 1)
+    fitted[enough] = locations[enough]
+
+    iso_corr = dict((name, tuple(fitted[row].tolist())) for row, name in enumerate(names))
+    amounts = dict((name, tuple(counts[row].tolist())) for row, name in enumerate(names))
+    return iso_corr, amounts
+
+
+def calibrate(snapshot, min_pairs=3, default=talos_iso_corr):
+    '''Fit the isotope shifts to the resonances in a snapshot that have
+       a protonated and a deuterated shift, see fit_isotope_shifts.
+
+    '''
+
+    return fit_isotope_shifts(*calibration_pairs(snapshot),
+                              min_pairs=min_pairs, default=default)
+
+
+def write_iso_corr(iso_corr, stream, amounts=None):
+    '''Write an isotope shift table as JSON, residue type -> [CA, CB],
+       optionally with the amount of measurements they are based on.
+
+    '''
+
+    table = {'iso_corr': dict((name, list(values)) for name, values in iso_corr.items())}
+    if amounts is not None:
+        table['measurements'] = dict((name, list(values)) for name, values in amounts.items())
+    json.dump(table, stream, indent=2, sort_keys=True)
+    stream.write('\n')
+
+
+def read_iso_corr(path):
+    '''Read a table written by write_iso_corr.
+       returns: dict like talos_iso_corr
+
+    '''
+
+    with open(path) as table_file:
+        table = json.load(table_file)
+    return dict((str(name), tuple(values)) for name, values in table['iso_corr'].items())
+
+
+def main(arguments=None):
+    '''Calibrate on the shift lists given on the command line.'''
+
+    # Imported here, the batch module imports this one for --iso-corr.
+    from batch_spin_system_compare import (add_shift_list_arguments,
+                                           check_shift_list_arguments,
+                                           load_shift_lists)
+
+    parser = argparse.ArgumentParser(description='Fit CA and CB deuterium '
+                                     'isotope shifts to resonances in a '
+                                     'protonated and a deuterated shift '
+                                     'list.')
+    add_shift_list_arguments(parser)
+    parser.add_argument('--output', default=None,
+                        help='output file, standard output by default')
+    parser.add_argument('--min-pairs', type=int, default=3,
+                        help='residue types with fewer measurements keep '
+                        'the Talos+ value')
+    options = parser.parse_args(arguments)
+    check_shift_list_arguments(parser, options)
+
+    snapshot = load_shift_lists(options.shift_lists, options.isotope,
+                                options.offset, options.shift_list_id)
+    iso_corr, amounts = calibrate(snapshot, options.min_pairs)
+
+    if options.output:
+        with open(options.output, 'w') as stream:
+            write_iso_corr(iso_corr, stream, amounts)
+    else:
+        write_iso_corr(iso_corr, sys.stdout, amounts)
+
+
+if __name__ == '__main__':
+    main()
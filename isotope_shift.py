@@ -38,6 +38,8 @@ If not, see http://www.gnu.org/licenses/.
 
 '''
 
+import numpy
+
 groupA_deuterons = [(1, 2, 0), (2, 1, 0)]
 groupB_deuterons = [(1, 2, 2), (2, 3, 2)]
 groupC_deuterons = [(1, 2, 2), (2, 3, 0)]
@@ -132,7 +134,8 @@ def predict_isotope_shifts(aa_name):
     return ca_shift, cb_shift
 
 
-def correct_for_isotope_shift(aa_name, atom_name, shift, deuterated=False):
+def correct_for_isotope_shift(aa_name, atom_name, shift, deuterated=False,
+                              iso_corr=None):
     '''Return the expected observed chemical shift in a deuterated
        sample, based on the shift in a protonated sample, or vise versa.
        args:    aa_name:     three letter amino acid code
@@ -140,14 +143,20 @@ def correct_for_isotope_shift(aa_name, atom_name, shift, deuterated=False):
                 shift:       float measured shift
                 deuterated:  Boolean, should be True if the given shift
                              corresponds to the deuterated sample.
+                iso_corr:    optional dict like talos_iso_corr, by
+                             default the table set with set_iso_corr
+                             (talos_iso_corr unless changed). Unknown
+                             residue types get the 'Avg' value.
     '''
 
     if atom_name not in ('CA', 'CB'):
         raise ValueError('''Only isotope correction data available
                             for CA and CB, not for {}'''.format(atom_name))
 
-    atom_index = ['CA', 'CB'].index(atom_name)
-    isotope_shift = talos_iso_corr[aa_name][atom_index]
+    if iso_corr is None:
+        iso_corr = active_iso_corr
+    atom_index = 0 if atom_name == 'CA' else 1
+    isotope_shift = iso_corr.get(aa_name, iso_corr['Avg'])[atom_index]
 
     if deuterated:
         isotope_shift *= -1
@@ -155,6 +164,150 @@ def correct_for_isotope_shift(aa_name, atom_name, shift, deuterated=False):
     return shift + isotope_shift
 
 
+#: Atoms isotope shifts are known for, in the order of the columns of
+#: the lookup tables.
+ISOTOPE_ATOMS = ('CA', 'CB')
+
+
+class IsotopeShiftTable(object):
+    '''Dense (residue type x atom) array of isotope shifts, so that
+       many shifts can be corrected in one call. Residue types that are
+       not in the table get the isotope shift of the fallback type.
+
+    '''
+
+    def __init__(self, iso_corr, fallback='Avg'):
+        '''Init.
+           args:    iso_corr:   dict three letter code -> (CA, CB)
+                                isotope shift, like talos_iso_corr.
+                    fallback:   key in iso_corr used for unknown
+                                residue types.
+
+        '''
+
+        self.residue_types = sorted(iso_corr)
+        self.index = dict((residue_type, row) for row, residue_type
+                          in enumerate(self.residue_types))
+        self.values = numpy.array([iso_corr[residue_type] for residue_type
+                                   in self.residue_types], dtype=float)
+        self.fallback = self.index[fallback]
+
+    def residue_indices(self, aa_names):
+        '''Returns the row of every residue type, the fallback row for
+           unknown types (and None).
+
+        '''
+
+        unique, inverse = numpy.unique(numpy.asarray(aa_names).astype(str),
+                                       return_inverse=True)
+        rows = numpy.array([self.index.get(name, self.fallback) for name in unique],
+                           dtype=int)
+        return rows[inverse]
+
+    def atom_indices(self, atom_names):
+        '''Returns the column of every atom name.'''
+
+        unique, inverse = numpy.unique(numpy.asarray(atom_names).astype(str),
+                                       return_inverse=True)
+        unknown = [name for name in unique if name not in ISOTOPE_ATOMS]
+        if unknown:
+            raise ValueError('''Only isotope correction data available
+                                for CA and CB, not for {}'''.format(', '.join(unknown)))
+        columns = numpy.array([ISOTOPE_ATOMS.index(name) for name in unique],
+                              dtype=int)
+        return columns[inverse]
+
+    def correct(self, aa_names, atom_names, shifts, deuterated=False):
+        '''Vectorized version of correct_for_isotope_shift.
+           args:    aa_names:    sequence of three letter codes
+                    atom_names:  sequence of 'CA' or 'CB'
+                    shifts:      float array of measured shifts
+                    deuterated:  Boolean or Boolean array, True for
+                                 shifts measured on the deuterated
+                                 sample.
+           returns: float array
+
+        '''
+
+        shifts = numpy.asarray(shifts, dtype=float)
+        if not shifts.size:
+            return shifts.copy()
+        isotope_shifts = self.values[self.residue_indices(aa_names),
+                                     self.atom_indices(atom_names)]
+        return shifts + numpy.where(deuterated, -isotope_shifts, isotope_shifts)
+
+
+def predict_iso_corr():
+    '''Isotope shifts of all residue types predicted as described by
+       Venters et al. Glycine is not covered by the method, its Talos+
+       value is used. 'Avg' is the mean of the predictions.
+
+    '''
+
+    iso_corr = dict((aa_name, predict_isotope_shifts(aa_name))
+                    for aa_name in deuterons_aa_dict)
+    averages = numpy.mean(list(iso_corr.values()), axis=0)
+    iso_corr['Gly'] = talos_iso_corr['Gly']
+    iso_corr['Avg'] = tuple(averages)
+    return iso_corr
+
+
+TALOS_TABLE = IsotopeShiftTable(talos_iso_corr)
+VENTERS_TABLE = IsotopeShiftTable(predict_iso_corr())
+
+#: Isotope shifts used when no table is passed, see set_iso_corr.
+active_iso_corr = talos_iso_corr
+active_table = TALOS_TABLE
+#: Incremented by set_iso_corr, see iso_corr_version.
+_iso_corr_version = 0
+
+
+def set_iso_corr(iso_corr=None):
+    '''Use other isotope shifts than the Talos+ values by default, for
+       instance a table calibrated on the project (see
+       isotope_calibration). Everything that keeps corrected shifts
+       has to compare iso_corr_version to the version it was made with
+       and throw its corrected shifts away when it changed.
+       args:    iso_corr: dict like talos_iso_corr, with an 'Avg'
+                          entry. None to go back to talos_iso_corr.
+
+    '''
+
+    global active_iso_corr, active_table, _iso_corr_version
+
+    if iso_corr is None or iso_corr is talos_iso_corr:
+        active_iso_corr, active_table = talos_iso_corr, TALOS_TABLE
+    else:
+        active_iso_corr, active_table = dict(iso_corr), IsotopeShiftTable(iso_corr)
+    _iso_corr_version += 1
+
+
+def iso_corr_version():
+    '''Returns an int that changes every time set_iso_corr is called.'''
+
+    return _iso_corr_version
+
+
+def correct_for_isotope_shifts(aa_names, atom_names, shifts, deuterated=False,
+                               table=None):
+    '''Correct many shifts at once, see correct_for_isotope_shift.
+       args:    aa_names:    sequence of three letter codes, unknown
+                             codes are treated as 'Avg'.
+                atom_names:  sequence of 'CA' or 'CB'
+                shifts:      float array of measured shifts
+                deuterated:  Boolean or Boolean array
+                table:       IsotopeShiftTable, for instance TALOS_TABLE
+                             or VENTERS_TABLE. By default the table
+                             set with set_iso_corr.
+       returns: float array
+
+    '''
+
+    if table is None:
+        table = active_table
+    return table.correct(aa_names, atom_names, shifts, deuterated)
+
+
 if __name__ == '__main__':
 
     for aa in deuterons_aa_dict.keys():
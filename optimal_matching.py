@@ -0,0 +1,169 @@
+'''Optimal one-to-one pairing of two sets of spin systems.
+
+The deviation between every spin system of the first set and every
+spin system of the second set is used as cost. Only pairs that have
+resonance types in common and deviate less than a cut-off are
+considered, which keeps the problem sparse. Every spin system can
+also stay unpaired, which costs as much as the cut-off. The pairing
+with the lowest total cost is found with the Hungarian method, using
+shortest augmenting paths on the sparse graph of allowed pairs.
+
+'''
+
+import heapq
+
+import numpy
+
+
+def solve_assignment(n_rows, rows, columns, costs, unmatched_cost):
+    '''Solve a sparse assignment problem where rows can be left
+       unassigned, using successive shortest augmenting paths (the
+       Hungarian method on a sparse graph). Node potentials keep all
+       reduced costs non-negative, so every augmenting path is found
+       with Dijkstra's algorithm.
+       args:    n_rows:         int, amount of rows
+                rows:           int array, row of every allowed pair
+                columns:        int array, column of every allowed pair
+                costs:          float array, cost of every allowed pair,
+                                should not be negative.
+                unmatched_cost: float, cost of leaving a row unassigned
+       returns: int array with the assigned column for every row,
+                -1 for rows that are left unassigned.
+
+    '''
+
+    rows = numpy.asarray(rows, dtype=int)
+    columns = numpy.asarray(columns, dtype=int)
+    costs = numpy.asarray(costs, dtype=float)
+    n_columns = int(columns.max()) + 1 if len(columns) else 0
+
+    # Arcs from rows point to column nodes, which are numbered after
+    # the rows. Column n_columns + row is the dummy column of a row,
+    # taking it means the row stays unassigned.
+    arcs = [[] for row in range(n_rows)]
+    for row, column, cost in zip(rows.tolist(), columns.tolist(), costs.tolist()):
+        arcs[row].append((n_rows + column, cost))
+    for row in range(n_rows):
+        arcs[row].append((n_rows + n_columns + row, float(unmatched_cost)))
+
+    sink = n_rows + n_columns + n_rows
+    # Potentials of all nodes (rows, columns, sink) are stored minus a
+    # common offset, so raising all of them is one addition.
+    potentials = [0.0] * (sink + 1)
+    offset = 0.0
+    assigned_column = [-1] * n_rows
+    assigned_cost = [0.0] * n_rows
+    owner = [-1] * (n_columns + n_rows)
+
+    for start in range(n_rows):
+
+        distances = {start: 0.0}
+        previous = {}
+        step_costs = {}
+        finished = set()
+        heap = [(0.0, start)]
+
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if node in finished:
+                continue
+            finished.add(node)
+            if node == sink:
+                break
+
+            if node < n_rows:
+                steps = arcs[node]
+                skip = n_rows + assigned_column[node]
+            else:
+                row = owner[node - n_rows]
+                if row < 0:
+                    steps = [(sink, 0.0)]
+                else:
+                    steps = [(row, -assigned_cost[row])]
+                skip = None
+
+            potential = potentials[node] + distance
+            for next_node, cost in steps:
+                if next_node == skip or next_node in finished:
+                    continue
+                reduced = cost + potential - potentials[next_node]
+                next_distance = max(reduced, distance)
+                if next_distance < distances.get(next_node, numpy.inf):
+                    distances[next_node] = next_distance
+                    previous[next_node] = node
+                    step_costs[next_node] = cost
+                    heapq.heappush(heap, (next_distance, next_node))
+
+        shortest = distances[sink]
+        offset += shortest
+        for node in finished:
+            potentials[node] -= shortest - distances[node]
+
+        # Augment along the path, column -> row steps alternate with
+        # row -> column steps.
+        node = previous[sink]
+        while True:
+            row = previous[node]
+            column = node - n_rows
+            owner[column] = row
+            assigned_column[row] = column
+            assigned_cost[row] = step_costs[node]
+            if row == start:
+                break
+            node = previous[row]
+
+    assignment = numpy.array(assigned_column, dtype=int)
+    assignment[assignment >= n_columns] = -1
+    return assignment
+
+
+def match_sets(shiftMatrix, keys1, keys2, max_deviation=1.0,
+               matches_only=False, block_size=64):
+    '''Find the optimal one-to-one pairing between two sets of spin
+       systems.
+       args:    shiftMatrix:   ShiftMatrix containing all spin systems
+                keys1:         spin systems in the first set
+                keys2:         spin systems in the second set
+                max_deviation: float, pairs that deviate more are not
+                               considered, leaving a spin system
+                               unpaired costs the same.
+                matches_only:  Boolean, if True only pairs that match
+                               are considered.
+                block_size:    int, see ShiftMatrix.compare_subsets
+       returns: list of (key1, key2, deviation, match), best first.
+
+    '''
+
+    keys1 = list(keys1)
+    keys2 = list(keys2)
+    rows1 = [shiftMatrix.index[key] for key in keys1]
+    rows2 = [shiftMatrix.index[key] for key in keys2]
+
+    deviation, match, overlap = shiftMatrix.compare_subsets(rows1, rows2,
+                                                            block_size)
+    allowed = overlap > 0
+    allowed[allowed] = deviation[allowed] < max_deviation
+    if matches_only:
+        allowed &= match
+
+    # A spin system that is in both sets can not be paired with itself.
+    columns2 = dict((key, column) for column, key in enumerate(keys2))
+    for row, key in enumerate(keys1):
+        if key in columns2:
+            allowed[row, columns2[key]] = False
+
+    rows, columns = numpy.nonzero(allowed)
+    assignment = solve_assignment(len(keys1), rows, columns,
+                                  deviation[rows, columns],
+                                  unmatched_cost=max_deviation)
+
+    pairs = []
+    for row, column in enumerate(assignment):
+        if column < 0:
+            continue
+        pairs.append((keys1[row], keys2[column],
+                      float(deviation[row, column]),
+                      bool(match[row, column])))
+
+    pairs.sort(key=lambda pair: pair[2])
+    return pairs
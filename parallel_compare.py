@@ -0,0 +1,134 @@
+'''Parallel all-vs-all comparison of spin systems.
+
+The comparison of all pairs of spin systems grows quadratically with
+the amount of spin systems. Because the deviation is symmetric, only
+the blocks in the upper triangle of the pair matrix are computed and
+these blocks are spread over a pool of worker processes. The workers
+only receive the plain arrays of a ShiftMatrix, never CCPN objects.
+This is meant for headless scripts like batch_spin_system_compare; the
+popup does not fork worker processes from the running Tk process.
+
+'''
+
+import collections
+import multiprocessing
+
+import numpy
+
+from shift_matrix import OVERLAP_DTYPE, compare_blocks
+
+_arrays = None
+
+
+def _init_worker(values, present, state_mask):
+    '''Keep the shift arrays in the worker process, so they are sent
+       only once instead of with every block.
+
+    '''
+
+    global _arrays
+    _arrays = (values, present, state_mask)
+
+
+def _compare_block(bounds):
+    '''Compare the rows in one range to the rows in another range.
+       args:    bounds: (start1, end1, start2, end2)
+       returns: (bounds, deviation, match, overlap)
+
+    '''
+
+    values, present, state_mask = _arrays
+    start1, end1, start2, end2 = bounds
+    results = compare_blocks(values[start1:end1], present[start1:end1],
+                             values[start2:end2], present[start2:end2],
+                             state_mask)
+    return (bounds,) + results
+
+
+def upper_triangle_blocks(n, block_size):
+    '''Divide an n x n pair matrix into blocks on and above the
+       diagonal.
+       returns: list of (start1, end1, start2, end2)
+
+    '''
+
+    starts = list(range(0, n, block_size))
+    return [(start1, min(start1 + block_size, n),
+             start2, min(start2 + block_size, n))
+            for i, start1 in enumerate(starts)
+            for start2 in starts[i:]]
+
+
+def iterate_blocks(shiftMatrix, blocks, processes=None):
+    '''Compare blocks of the pair matrix of a ShiftMatrix, using a pool
+       of worker processes. Only a few blocks are handed to the workers
+       ahead of the one being yielded, so the results of a long
+       comparison do not pile up in memory.
+       args:    shiftMatrix: ShiftMatrix
+                blocks:      list of (start1, end1, start2, end2)
+                processes:   int, amount of worker processes, by
+                             default the amount of cpus. With 1 the
+                             comparison runs in this process.
+       returns: generator of (bounds, deviation, match, overlap), in
+                the order of the blocks.
+
+    '''
+
+    global _arrays
+    arrays = (shiftMatrix.values, shiftMatrix.present, shiftMatrix.state_mask)
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes <= 1 or len(blocks) <= 1:
+        _init_worker(*arrays)
+        try:
+            for bounds in blocks:
+                yield _compare_block(bounds)
+        finally:
+            # Do not hold on to the arrays after the comparison.
+            _arrays = None
+        return
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=arrays)
+    try:
+        pending = collections.deque()
+        for bounds in blocks:
+            pending.append(pool.apply_async(_compare_block, (bounds,)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def compare_all_parallel(shiftMatrix, processes=None, block_size=64):
+    '''Compare all spin systems in a ShiftMatrix to each other, using
+       a pool of worker processes.
+       args:    shiftMatrix: ShiftMatrix
+                processes:   int, see iterate_blocks
+                block_size:  int, size of the square blocks the pair
+                             matrix is divided in.
+       returns: (deviation, match, overlap) square arrays, the same as
+                ShiftMatrix.compare_all
+
+    '''
+
+    n = len(shiftMatrix.keys)
+    deviation = numpy.empty((n, n))
+    match = numpy.empty((n, n), dtype=bool)
+    overlap = numpy.empty((n, n), dtype=OVERLAP_DTYPE)
+
+    blocks = upper_triangle_blocks(n, block_size)
+    for (start1, end1, start2, end2), block_deviation, block_match, block_overlap \
+            in iterate_blocks(shiftMatrix, blocks, processes):
+        for matrix, block in [(deviation, block_deviation),
+                              (match, block_match),
+                              (overlap, block_overlap)]:
+            matrix[start1:end1, start2:end2] = block
+            matrix[start2:end2, start1:end1] = block.T
+
+    return deviation, match, overlap
@@ -0,0 +1,104 @@
+'''Index of chemical shifts per atom type, to quickly find the spin
+   systems that could match a given spin system.
+
+A spin system can only match when every shift it has in common with
+the other spin system lies within the match cut-off. For every atom
+type (and isotope state) the shifts of all spin systems are kept in a
+sorted list, so the spin systems with a shift inside the tolerance
+window can be found by bisection instead of comparing to every spin
+system.
+
+'''
+
+from bisect import bisect_left, bisect_right
+
+from shift_matrix import MATCH_CUTOFF
+
+
+class ShiftIndex(object):
+    '''Sorted chemical shifts per (atom name, isotope state).
+
+    '''
+
+    def __init__(self, tables):
+        '''Init.
+           args:    tables: dict key (spin system) -> dict atom name ->
+                            list of shift value lists, as made by
+                            compare_spin_systems.spin_system_shifts.
+
+        '''
+
+        columns = {}
+        self.columns_per_key = {}
+
+        for key, table in tables.items():
+            key_columns = set()
+            for name, values_list in table.items():
+                for values in values_list:
+                    for state, value in enumerate(values):
+                        columns.setdefault((name, state), []).append((value, key))
+                        key_columns.add((name, state))
+            self.columns_per_key[key] = key_columns
+
+        self.columns = {}
+        for column, entries in columns.items():
+            entries.sort(key=lambda entry: entry[0])
+            counts = {}
+            for value, key in entries:
+                counts[key] = counts.get(key, 0) + 1
+            self.columns[column] = ([entry[0] for entry in entries],
+                                    [entry[1] for entry in entries],
+                                    counts)
+
+    def window(self, column, low, high):
+        '''Find the keys with shifts inside an open window.
+           args:    column:  (atom name, isotope state)
+                    low:     float, lower bound (exclusive)
+                    high:    float, upper bound (exclusive)
+           returns: dict key -> amount of its shifts in the window
+
+        '''
+
+        if column not in self.columns:
+            return {}
+
+        values, keys, counts = self.columns[column]
+        start = bisect_right(values, low)
+        end = bisect_left(values, high)
+        inside = {}
+        for key in keys[start:end]:
+            inside[key] = inside.get(key, 0) + 1
+        return inside
+
+    def candidates(self, table, tolerance=MATCH_CUTOFF):
+        '''Find the keys that could match a spin system: all their
+           shifts of atom types they share with the spin system are
+           within the tolerance of the shifts of the spin system.
+           args:    table:     dict atom name -> list of shift value
+                               lists of the spin system.
+                    tolerance: float, the match cut-off.
+           returns: set of keys that share at least one atom type with
+                    the spin system and lie inside all windows.
+
+        '''
+
+        query = {}
+        for name, values_list in table.items():
+            for values in values_list:
+                for state, value in enumerate(values):
+                    query.setdefault((name, state), []).append(value)
+
+        passed = {}
+        for column, values in query.items():
+            if column not in self.columns:
+                continue
+            counts = self.columns[column][2]
+            inside = self.window(column, max(values) - tolerance,
+                                 min(values) + tolerance)
+            for key, amount in inside.items():
+                if amount == counts[key]:
+                    passed[key] = passed.get(key, 0) + 1
+
+        query_columns = set(query)
+        return set(key for key, amount in passed.items()
+                   if amount == len(self.columns_per_key[key] & query_columns))
@@ -0,0 +1,255 @@
+'''Reading chemical shift lists exported from CCPN or the BMRB, so
+   spin systems can be compared without CCPN Analysis.
+
+All readers generate (spin system id, residue type, atom name, shift)
+records. The residue type is a three letter code like 'Ala', or None
+when it is not known.
+
+Supported formats:
+    CSV:       a header line with the columns spin_system,
+               residue_type, atom and shift.
+    NMR-STAR:  the atom chemical shift loop of NMR-STAR 3 files or
+               the chemical shift loop of NMR-STAR 2.1 files. When an
+               NMR-STAR 3 loop has an Entity_ID column, the spin system
+               id is '<entity>:<sequence number>', so residues with the
+               same number in different entities are kept apart.
+
+'''
+
+import csv
+import re
+
+CSV_COLUMNS = ('spin_system', 'residue_type', 'atom', 'shift')
+
+#: Tags in the NMR-STAR chemical shift loop for the fields of a record,
+#: in order of preference (NMR-STAR 3 first, then 2.1).
+NMRSTAR_TAGS = {'spin_system': ['_Atom_chem_shift.Seq_ID',
+                                '_Atom_chem_shift.Comp_index_ID',
+                                '_Residue_seq_code'],
+                'residue_type': ['_Atom_chem_shift.Comp_ID',
+                                 '_Residue_label'],
+                'atom': ['_Atom_chem_shift.Atom_ID',
+                         '_Atom_name'],
+                'shift': ['_Atom_chem_shift.Val',
+                          '_Chem_shift_value']}
+
+SHIFT_LIST_TAG = '_Atom_chem_shift.Assigned_chem_shift_list_ID'
+
+ENTITY_TAG = '_Atom_chem_shift.Entity_ID'
+
+_token = re.compile(r"""'[^']*'|"[^"]*"|\S+""")
+
+# States of the NMR-STAR parser.
+_OUTSIDE, _HEADER, _SHIFT_LOOP, _OTHER_LOOP = range(4)
+
+
+def normalise_residue_type(residue_type):
+    '''Turn 'ALA' or 'ala' into 'Ala', unknown values into None.'''
+
+    if not residue_type or residue_type in ('.', '?'):
+        return None
+    return residue_type.capitalize()
+
+
+def read_csv_shifts(path):
+    '''Read shifts from a CSV file.
+       args:    path:    file name
+       returns: generator of (spin system, residue type, atom, shift)
+
+    '''
+
+    with open(path, 'rb') as csv_file:
+        for row in csv.DictReader(csv_file):
+            missing = [column for column in CSV_COLUMNS if column not in row]
+            if missing:
+                raise ValueError('{} lacks the columns {}'.format(path, ', '.join(missing)))
+            if not row['shift']:
+                continue
+            yield (row['spin_system'],
+                   normalise_residue_type(row['residue_type']),
+                   row['atom'],
+                   float(row['shift']))
+
+
+def read_nmrstar_shifts(path, shift_list_id=None):
+    '''Read shifts from the chemical shift loop of an NMR-STAR file.
+       The file is read line by line, see parse_nmrstar_shifts.
+       args:    path:          file name
+                shift_list_id: optional, only read the shifts of the
+                               assigned chemical shift list with this
+                               ID (NMR-STAR 3 only). Required when the
+                               file has more than one list.
+       returns: generator of (spin system, residue type, atom, shift)
+       raises:  ValueError while reading, when the file has more than
+                one chemical shift list and no shift_list_id is given,
+                or when a shift_list_id is given but a chemical shift
+                loop has no list ID column.
+
+    '''
+
+    with open(path) as star_file:
+        for record in parse_nmrstar_shifts(star_file, shift_list_id):
+            yield record
+
+
+def parse_nmrstar_shifts(lines, shift_list_id=None):
+    '''Incrementally parse the chemical shift loops out of NMR-STAR
+       text. Only the rows of chemical shift loops are tokenized, all
+       other save frames and loops are skipped line by line, so large
+       entries are never held in memory.
+       args:    lines:         iterable of lines, for instance an open
+                               file.
+                shift_list_id: see read_nmrstar_shifts
+       returns: generator of (spin system, residue type, atom, shift)
+
+    '''
+
+    state = _OUTSIDE
+    in_text = False
+    tags = []
+    columns = None
+    shift_list_column = None
+    shift_loops = 0
+    first_list = None
+    row = []
+
+    for line in lines:
+
+        # Multi-line values are delimited by lines starting with ';'.
+        if line.startswith(';'):
+            in_text = not in_text
+            if not in_text and state == _SHIFT_LOOP:
+                row.append('.')
+            continue
+        if in_text or line.startswith('#'):
+            continue
+
+        if state == _OUTSIDE:
+            if 'loop_' in line and line.split()[0] == 'loop_':
+                state = _HEADER
+                tags = []
+            continue
+
+        if state == _OTHER_LOOP:
+            if 'stop_' in line and line.split()[0] == 'stop_':
+                state = _OUTSIDE
+            continue
+
+        if state == _HEADER:
+            tokens = line.split()
+            if not tokens:
+                continue
+            if tokens[0].startswith('_'):
+                tags.append(tokens[0])
+                continue
+            columns = find_columns(tags)
+            if columns is None:
+                state = _OTHER_LOOP if tokens[0] != 'stop_' else _OUTSIDE
+                continue
+            shift_list_column = find_column(tags, [SHIFT_LIST_TAG])
+            if shift_list_id is not None and shift_list_column is None:
+                raise ValueError('shift list {} was asked for, but the chemical '
+                                 'shift loop has no {} column'.format(shift_list_id,
+                                                                     SHIFT_LIST_TAG))
+            shift_loops += 1
+            if shift_list_id is None and shift_list_column is None and shift_loops > 1:
+                raise ValueError('more than one chemical shift loop, the shift '
+                                 'lists can not be told apart')
+            state = _SHIFT_LOOP
+            row = []
+
+        for token in _token.findall(line):
+            if token == 'stop_':
+                state = _OUTSIDE
+                break
+            if token.startswith('#'):
+                break
+            if len(token) > 1 and token[0] in '\'"' and token[-1] == token[0]:
+                token = token[1:-1]
+            row.append(token)
+            if len(row) == len(tags):
+                if shift_list_column is None:
+                    selected = True
+                elif shift_list_id is not None:
+                    selected = row[shift_list_column] == str(shift_list_id)
+                else:
+                    # Silently mixing the shifts of several lists would
+                    # give spin systems with duplicated atoms.
+                    if first_list is None:
+                        first_list = row[shift_list_column]
+                    elif row[shift_list_column] != first_list:
+                        raise ValueError('more than one assigned chemical shift '
+                                         'list ({} and {}), select one with '
+                                         'shift_list_id'.format(first_list,
+                                                                row[shift_list_column]))
+                    selected = True
+                if selected:
+                    record = make_record(row, columns)
+                    if record:
+                        yield record
+                row = []
+
+
+def find_column(tags, candidates):
+    '''Returns the column of the first candidate tag that is present,
+       None if there is none.
+
+    '''
+
+    for tag in candidates:
+        if tag in tags:
+            return tags.index(tag)
+    return None
+
+
+def find_columns(tags):
+    '''Find the column of every record field in the tags of an
+       NMR-STAR loop.
+       returns: dict field -> column, None if this is not a chemical
+                shift loop. The optional 'entity' field is only
+                present when the loop has an Entity_ID column.
+
+    '''
+
+    columns = {}
+    for field, candidates in NMRSTAR_TAGS.items():
+        column = find_column(tags, candidates)
+        if column is None:
+            return None
+        columns[field] = column
+    entity_column = find_column(tags, [ENTITY_TAG])
+    if entity_column is not None:
+        columns['entity'] = entity_column
+    return columns
+
+
+def make_record(row, columns):
+    '''Turn a row of an NMR-STAR chemical shift loop into a record,
+       returns None when the row has no shift value.
+
+    '''
+
+    value = row[columns['shift']]
+    if value in ('.', '?'):
+        return None
+    spin_system = row[columns['spin_system']]
+    if 'entity' in columns and row[columns['entity']] not in ('.', '?'):
+        spin_system = '{}:{}'.format(row[columns['entity']], spin_system)
+    return (spin_system,
+            normalise_residue_type(row[columns['residue_type']]),
+            row[columns['atom']],
+            float(value))
+
+
+def read_shifts(path, shift_list_id=None):
+    '''Read shifts from a CSV or NMR-STAR file, the format is
+       determined from the file extension.
+       args:    path:          file name
+                shift_list_id: see read_nmrstar_shifts
+       returns: generator of (spin system, residue type, atom, shift)
+
+    '''
+
+    if path.lower().endswith('.csv'):
+        return read_csv_shifts(path)
+    return read_nmrstar_shifts(path, shift_list_id)
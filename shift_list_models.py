@@ -0,0 +1,92 @@
+'''How the shifts in a shift list relate to those in other lists.
+
+Shift lists can come from samples with different isotope labelling,
+temperatures or referencing. A ShiftListModel describes, per shift
+list, whether the sample was deuterated (CA and CB shifts are then
+isotope shifted) and an offset that brings the shifts on a common
+reference. SpinSystemSnapshot uses the models to compare spin systems
+over any amount of shift lists at once.
+
+'''
+
+import numpy
+
+from isotope_shift import correct_for_isotope_shifts
+
+
+class ShiftListModel(object):
+    '''Isotope state and referencing of one shift list.'''
+
+    def __init__(self, deuterated=False, offset=0.0, table=None):
+        '''Init.
+           args:    deuterated: Boolean, True if the sample was
+                                deuterated.
+                    offset:     float added to every shift, or dict
+                                atom name -> offset for atom specific
+                                referencing.
+                    table:      optional IsotopeShiftTable, by default
+                                the one set with
+                                isotope_shift.set_iso_corr.
+
+        '''
+
+        self.deuterated = deuterated
+        self.offset = offset
+        self.table = table
+
+    def __repr__(self):
+        return '<ShiftListModel deuterated={} offset={}>'.format(self.deuterated,
+                                                               self.offset)
+
+    def offsets(self, atom_names):
+        '''Returns the offset of every atom name as an array.'''
+
+        if not isinstance(self.offset, dict):
+            return numpy.full(len(atom_names), float(self.offset))
+        unique, inverse = numpy.unique(numpy.asarray(atom_names).astype(str),
+                                       return_inverse=True)
+        return numpy.array([self.offset.get(name, 0.0) for name in unique])[inverse]
+
+    def rereference(self, atom_names, shifts):
+        '''Returns the shifts on the common reference.'''
+
+        return numpy.asarray(shifts, dtype=float) + self.offsets(atom_names)
+
+    def to_protonated(self, aa_names, atom_names, shifts):
+        '''Convert (rereferenced) CA and CB shifts of this list to the
+           shifts expected in a protonated sample.
+
+        '''
+
+        if not self.deuterated:
+            return numpy.asarray(shifts, dtype=float)
+        return correct_for_isotope_shifts(aa_names, atom_names, shifts,
+                                          deuterated=True, table=self.table)
+
+    def from_protonated(self, aa_names, atom_names, shifts):
+        '''Convert CA and CB shifts expected in a protonated sample to
+           the ones expected in this list.
+
+        '''
+
+        if not self.deuterated:
+            return numpy.asarray(shifts, dtype=float)
+        return correct_for_isotope_shifts(aa_names, atom_names, shifts,
+                                          deuterated=False, table=self.table)
+
+
+def default_models(n_shiftLists):
+    '''Models for the classic setup: a protonated shift list followed
+       by a deuterated one, without offsets.
+       args:    n_shiftLists: int, 1 or 2
+       returns: list of ShiftListModel
+       raises:  ValueError for more than two shift lists, what these
+                are can not be guessed and has to be described with a
+                model per list.
+
+    '''
+
+    if n_shiftLists > 2:
+        raise ValueError('Give a ShiftListModel for each of the {} shift '
+                         'lists.'.format(n_shiftLists))
+    return [ShiftListModel(deuterated=column > 0) for column in range(n_shiftLists)]
@@ -0,0 +1,326 @@
+'''Array based comparison of many spin systems at once.
+
+The chemical shifts of all spin systems are packed into one array with
+the shape (spin system x atom type x copy x isotope state), where copy
+distinguishes resonances of a spin system that share the same assign
+name and isotope state is protonated/deuterated. A boolean mask keeps
+track of which slots are filled. The deviations and matches that
+SpinSystemComparison calculates for one pair can than be calculated for
+one-vs-all or all-vs-all in a few array operations.
+
+'''
+
+import numpy
+
+import instrumentation
+
+#: Two shifts match when their absolute difference is below this value.
+MATCH_CUTOFF = 0.5
+
+#: The amount of compared resonance pairs is small, a 32 bit integer
+#: halves the memory of all-vs-all results.
+OVERLAP_DTYPE = numpy.int32
+
+
+class ShiftMatrix(object):
+    '''Chemical shifts of a set of spin systems packed into arrays.
+
+    '''
+
+    def __init__(self, keys, atom_names, values, present, state_mask):
+        '''Init.
+           args:    keys:       list of objects (spin systems) that
+                                identify the rows.
+                    atom_names: list of atom names identifying the
+                                columns.
+                    values:     float array (keys x atom_names x
+                                copies x states) of chemical shifts.
+                    present:    bool array (keys x atom_names x copies),
+                                True where a shift is present.
+                    state_mask: bool array (atom_names x states), True
+                                for the isotope states that are used
+                                for an atom type.
+
+        '''
+
+        self.keys = list(keys)
+        self.atom_names = list(atom_names)
+        self.values = values
+        self.present = present
+        self.state_mask = state_mask
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+
+    @classmethod
+    def from_records(cls, keys, records):
+        '''Build a ShiftMatrix.
+           args:    keys:       objects (spin systems) identifying
+                                the rows, in order.
+                    records:    iterable of (key, atom_name, values)
+                                where values is a sequence of one
+                                (no isotope correction) or two
+                                (protonated, deuterated) shifts.
+           returns: ShiftMatrix
+
+        '''
+
+        keys = list(keys)
+        row_index = dict((key, i) for i, key in enumerate(keys))
+        atom_index = {}
+        slots = {}
+        n_states = {}
+
+        for key, atom_name, shifts in records:
+            column = atom_index.setdefault(atom_name, len(atom_index))
+            slots.setdefault((row_index[key], column), []).append(shifts)
+            n_states[column] = max(n_states.get(column, 0), len(shifts))
+
+        n_copies = max([len(copies) for copies in slots.values()] or [1])
+        n_state = max(n_states.values() or [1])
+
+        values = numpy.zeros((len(keys), len(atom_index), n_copies, n_state))
+        present = numpy.zeros((len(keys), len(atom_index), n_copies),
+                              dtype=bool)
+        state_mask = numpy.zeros((len(atom_index), n_state), dtype=bool)
+
+        for column, amount in n_states.items():
+            state_mask[column, :amount] = True
+
+        for (row, column), copies in slots.items():
+            for copy, shifts in enumerate(copies):
+                values[row, column, copy, :len(shifts)] = shifts
+                present[row, column, copy] = True
+
+        atom_names = sorted(atom_index, key=atom_index.get)
+
+        return cls(keys, atom_names, values, present, state_mask)
+
+    def update_rows(self, keys, records):
+        '''Replace the shifts of some spin systems in place.
+           args:    keys:       spin systems whose shifts changed
+                    records:    iterable of (key, atom_name, values) of
+                                these spin systems, see from_records.
+           returns: Boolean, False when the new shifts do not fit in
+                    the arrays (a new atom type, more resonances with
+                    the same assign name or a different amount of
+                    isotope states). The matrix is left untouched then
+                    and should be built again.
+
+        '''
+
+        rows = [self.index[key] for key in keys]
+        atom_index = dict((name, i) for i, name in enumerate(self.atom_names))
+        n_states = self.state_mask.sum(axis=1)
+        slots = {}
+
+        for key, atom_name, shifts in records:
+            column = atom_index.get(atom_name)
+            if column is None or len(shifts) != n_states[column]:
+                return False
+            slots.setdefault((self.index[key], column), []).append(shifts)
+
+        if any(len(copies) > self.values.shape[2] for copies in slots.values()):
+            return False
+
+        self.values[rows] = 0.0
+        self.present[rows] = False
+        for (row, column), copies in slots.items():
+            for copy, shifts in enumerate(copies):
+                self.values[row, column, copy, :len(shifts)] = shifts
+                self.present[row, column, copy] = True
+
+        return True
+
+    def compare_one(self, key, rows=None):
+        '''Compare one spin system to (a subset of) all others.
+           args:    key:   spin system to compare.
+                    rows:  optional index array or slice selecting the
+                           spin systems to compare to.
+           returns: (deviation, match, overlap) arrays, see
+                    compare_blocks.
+
+        '''
+
+        i = self.index[key]
+        if rows is None:
+            rows = slice(None)
+        deviation, match, overlap = compare_blocks(self.values[i:i + 1],
+                                                   self.present[i:i + 1],
+                                                   self.values[rows],
+                                                   self.present[rows],
+                                                   self.state_mask)
+        return deviation[0], match[0], overlap[0]
+
+    def iterate_compare_one(self, key, chunk_size=256):
+        '''Compare one spin system to all others a chunk of spin
+           systems at a time, so the work can be spread out over time
+           or stopped half way.
+           args:    key:        spin system to compare.
+                    chunk_size: amount of spin systems per chunk.
+           returns: generator of (start, deviation, match, overlap),
+                    where start is the row of the first spin system in
+                    the chunk, see compare_one.
+
+        '''
+
+        for start in range(0, len(self.keys), chunk_size):
+            rows = slice(start, start + chunk_size)
+            deviation, match, overlap = self.compare_one(key, rows)
+            yield start, deviation, match, overlap
+
+    def compare_all(self, block_size=64):
+        '''Compare all spin systems to each other.
+           args:    block_size: amount of rows compared in one go,
+                                limits the memory that is used.
+           returns: (deviation, match, overlap) square arrays, see
+                    compare_blocks.
+
+        '''
+
+        rows = numpy.arange(len(self.keys))
+        return self.compare_subsets(rows, rows, block_size)
+
+    def compare_subsets(self, rows1, rows2, block_size=64):
+        '''Compare every spin system in one subset to every spin system
+           in another subset.
+           args:    rows1:      index array of the first subset
+                    rows2:      index array of the second subset
+                    block_size: amount of rows compared in one go,
+                                limits the memory that is used.
+           returns: (deviation, match, overlap) arrays of shape
+                    (rows1 x rows2), see compare_blocks.
+
+        '''
+
+        rows1 = numpy.asarray(rows1, dtype=int)
+        rows2 = numpy.asarray(rows2, dtype=int)
+        values2 = self.values[rows2]
+        present2 = self.present[rows2]
+
+        shape = (len(rows1), len(rows2))
+        deviation = numpy.empty(shape)
+        match = numpy.empty(shape, dtype=bool)
+        overlap = numpy.empty(shape, dtype=OVERLAP_DTYPE)
+
+        for start in range(0, len(rows1), block_size):
+            block = slice(start, start + block_size)
+            results = compare_blocks(self.values[rows1[block]],
+                                     self.present[rows1[block]],
+                                     values2, present2, self.state_mask)
+            deviation[block], match[block], overlap[block] = results
+
+        return deviation, match, overlap
+
+
+class ComparisonResults(object):
+    '''Deviation, match and overlap of all pairs in a set of spin
+       systems, kept as square arrays.
+
+    '''
+
+    def __init__(self, keys, deviation, match, overlap):
+        '''Init.
+           args:    keys:       list of objects (spin systems)
+                    deviation:  float array (keys x keys)
+                    match:      bool array (keys x keys)
+                    overlap:    int array (keys x keys)
+
+        '''
+
+        self.keys = list(keys)
+        self.deviation = deviation
+        self.match = match
+        self.overlap = overlap
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+
+    def get(self, key1, key2):
+        '''Returns (deviation, match, overlap) of one pair, deviation
+           is None when the spin systems have nothing in common.
+
+        '''
+
+        i = self.index[key1]
+        j = self.index[key2]
+        if not self.overlap[i, j]:
+            return None, bool(self.match[i, j]), 0
+        return (float(self.deviation[i, j]), bool(self.match[i, j]),
+                int(self.overlap[i, j]))
+
+    def update_rows(self, shiftMatrix, keys, block_size=64):
+        '''Recalculate all pairs that involve some spin systems, for
+           instance after their shifts changed.
+           args:    shiftMatrix: ShiftMatrix with the current shifts of
+                                 all spin systems in these results.
+                    keys:        spin systems that changed
+                    block_size:  int, see ShiftMatrix.compare_subsets
+
+        '''
+
+        keys = list(keys)
+        rows = numpy.array([self.index[key] for key in keys], dtype=int)
+        deviation, match, overlap = shiftMatrix.compare_subsets(
+            [shiftMatrix.index[key] for key in keys],
+            [shiftMatrix.index[key] for key in self.keys],
+            block_size)
+
+        for square, changed in [(self.deviation, deviation),
+                                (self.match, match),
+                                (self.overlap, overlap)]:
+            square[rows] = changed
+            square[:, rows] = changed.T
+
+    def amount_of_matches(self):
+        '''Count for every spin system the other spin systems that
+           overlap with it and match.
+           returns: dict key -> int
+
+        '''
+
+        matches = self.match & (self.overlap > 0)
+        numpy.fill_diagonal(matches, False)
+        return dict(zip(self.keys, matches.sum(axis=1).tolist()))
+
+
+def compare_blocks(values1, present1, values2, present2, state_mask,
+                   cutoff=MATCH_CUTOFF):
+    '''Compare every spin system in block 1 to every spin system in
+       block 2. Every pair of resonances with the same atom name
+       contributes the square of its delta, averaged over the isotope
+       states, to the squared deviation, in the same way as
+       SpinSystemComparison.compare does.
+       args:    values1:    float array (A x atoms x copies x states)
+                present1:   bool array (A x atoms x copies)
+                values2:    float array (B x atoms x copies x states)
+                present2:   bool array (B x atoms x copies)
+                state_mask: bool array (atoms x states)
+                cutoff:     float, maximal delta for a match.
+       returns: deviation: float array (A x B), root of the summed
+                           squared deviations, nan if the spin systems
+                           do not have any atom type in common.
+                match:     bool array (A x B), True if all compared
+                           shifts are within the cut-off.
+                overlap:   int array (A x B), amount of compared
+                           resonance pairs.
+
+    '''
+
+    instrumentation.count('matrix_pairs', len(values1) * len(values2))
+
+    with instrumentation.timer('matrix_compare'):
+        # (A, B, atoms, copies1, copies2, states)
+        delta = numpy.abs(values1[:, None, :, :, None, :] -
+                          values2[None, :, :, None, :, :])
+        states = state_mask[None, None, :, None, None, :]
+        n_states = numpy.maximum(state_mask.sum(axis=1), 1)[None, None, :, None, None]
+
+        pairs = present1[:, None, :, :, None] & present2[None, :, :, None, :]
+        average_delta = numpy.where(states, delta, 0.0).sum(axis=-1) / n_states
+
+        squared = numpy.where(pairs, average_delta ** 2, 0.0).sum(axis=(2, 3, 4))
+        overlap = pairs.sum(axis=(2, 3, 4))
+        violations = (delta >= cutoff) & states & pairs[..., None]
+        match = ~violations.any(axis=(2, 3, 4, 5))
+
+        deviation = numpy.sqrt(squared)
+        deviation[overlap == 0] = numpy.nan
+
+    return deviation, match, overlap
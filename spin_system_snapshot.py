@@ -0,0 +1,432 @@
+'''Plain data copy of the spin systems in a project.
+
+Attribute access on CCPN API objects is slow compared to reading from
+arrays. The spin systems, their resonances, assign names, residue types
+and shifts are therefore copied once into compact tables. The
+comparison engine (ShiftMatrix, shift tables for ranking and the shift
+index) is build from this snapshot, so it does not touch CCPN objects
+and can run without CCPN installed.
+
+Any amount of shift lists can be copied into one snapshot, every shift
+list has a ShiftListModel that describes its isotope state and
+referencing. The classic setup is one protonated and one deuterated
+shift list. More shift lists are supported by the comparison engine
+and the batch script; the popup, SpinSystemComparison and
+ShiftedResonce only know the classic setup, and
+update_resonanceGroups only updates two list snapshots.
+
+'''
+
+import numpy
+
+import instrumentation
+from ccpn_isotope_shift import find_shifts
+from isotope_shift import ISOTOPE_ATOMS
+from shift_list_models import default_models
+from shift_matrix import ShiftMatrix
+
+
+class SpinSystemSnapshot(object):
+    '''Spin systems and their shifts in a number of shift lists (by
+       default a protonated and a deuterated one), stored column wise.
+
+    '''
+
+    def __init__(self, keys, serials, residue_types, resonance_groups,
+                 resonance_names, shifts, paired_shiftLists=True,
+                 models=None):
+        '''Init.
+           args:    keys:             list of objects identifying the
+                                      spin systems (for instance the
+                                      resonance groups themselves).
+                    serials:          int per spin system
+                    residue_types:    three letter code per spin
+                                      system, None if unknown.
+                    resonance_groups: int per resonance, index of its
+                                      spin system in keys.
+                    resonance_names:  first assign name per resonance
+                    shifts:           float array (resonances x shift
+                                      lists), nan when missing.
+                    paired_shiftLists: Boolean, True if more than one
+                                      shift list was selected, only
+                                      then isotope correction is
+                                      possible.
+                    models:           ShiftListModel per shift list, by
+                                      default (protonated, deuterated).
+
+        '''
+
+        self.keys = list(keys)
+        self.serials = numpy.asarray(serials, dtype=int)
+        self.residue_types = list(residue_types)
+        self.resonance_groups = numpy.asarray(resonance_groups, dtype=int)
+        self.resonance_names = list(resonance_names)
+        self.models = list(models) if models is not None else default_models(2)
+        self.shifts = numpy.asarray(shifts, dtype=float).reshape(-1, len(self.models))
+        self.paired_shiftLists = paired_shiftLists
+        self.index = dict((key, row) for row, key in enumerate(self.keys))
+
+    @classmethod
+    def from_resonanceGroups(cls, resonanceGroups, protonatedShiftList=None,
+                             deuteratedShiftList=None, prefetch=None):
+        '''Copy the resonances that have an assign name and a shift in
+           one of the shift lists out of the CCPN project.
+           args:    resonanceGroups:     iterable of spin systems
+                    protonatedShiftList: shift list of protonated shifts
+                    deuteratedShiftList: shift list of deuterated shifts
+                    prefetch:            optional ShiftListPrefetch
+           returns: SpinSystemSnapshot
+
+        '''
+
+        keys = []
+        serials = []
+        residue_types = []
+        resonance_groups = []
+        resonance_names = []
+        shifts = []
+
+        with instrumentation.timer('snapshot'):
+            for row, resonanceGroup in enumerate(resonanceGroups):
+                keys.append(resonanceGroup)
+                serials.append(resonanceGroup.serial)
+                residue_types.append(get_residue_type(resonanceGroup))
+
+                for name, values in copy_resonances(resonanceGroup,
+                                                    protonatedShiftList,
+                                                    deuteratedShiftList,
+                                                    prefetch):
+                    resonance_groups.append(row)
+                    resonance_names.append(name)
+                    shifts.append(values)
+
+        paired = protonatedShiftList is not None and deuteratedShiftList is not None
+
+        return cls(keys, serials, residue_types, resonance_groups,
+                   resonance_names, shifts, paired_shiftLists=paired)
+
+    @classmethod
+    def from_shiftLists(cls, resonanceGroups, shiftLists, models=None):
+        '''Copy the resonances that have an assign name and a shift in
+           one of any number of shift lists out of the CCPN project.
+           args:    resonanceGroups:     iterable of spin systems
+                    shiftLists:          sequence of shift lists
+                    models:              ShiftListModel per shift list,
+                                         required for more than two
+                                         lists. By default the first
+                                         one is protonated and the
+                                         second deuterated.
+           returns: SpinSystemSnapshot
+
+        '''
+
+        keys = []
+        serials = []
+        residue_types = []
+        resonance_groups = []
+        resonance_names = []
+        shifts = []
+
+        with instrumentation.timer('snapshot'):
+            for row, resonanceGroup in enumerate(resonanceGroups):
+                keys.append(resonanceGroup)
+                serials.append(resonanceGroup.serial)
+                residue_types.append(get_residue_type(resonanceGroup))
+
+                for name, values in copy_resonances_from_shiftLists(resonanceGroup,
+                                                                    shiftLists):
+                    resonance_groups.append(row)
+                    resonance_names.append(name)
+                    shifts.append(values)
+
+        if models is None:
+            models = default_models(len(shiftLists))
+
+        return cls(keys, serials, residue_types, resonance_groups,
+                   resonance_names, shifts, paired_shiftLists=len(shiftLists) > 1,
+                   models=models)
+
+    @classmethod
+    def from_shift_records(cls, protonated_records, deuterated_records=None):
+        '''Build a snapshot from shift records read from exported shift
+           lists (see shift_list_io). Records with the same spin system
+           id and atom name in both lists are the same resonance.
+           args:    protonated_records: iterable of (spin system, residue
+                                        type, atom name, shift)
+                    deuterated_records: same for the deuterated shift
+                                        list, optional.
+           returns: SpinSystemSnapshot, keyed by spin system id.
+
+        '''
+
+        return cls.from_record_lists([protonated_records, deuterated_records])
+
+    @classmethod
+    def from_record_lists(cls, record_lists, models=None):
+        '''Build a snapshot from the shift records of any number of
+           shift lists, see from_shift_records.
+           args:    record_lists: list with an iterable of records per
+                                  shift list, None for a shift list
+                                  that was not given.
+                    models:       ShiftListModel per shift list,
+                                  required for more than two lists.
+                                  By default the first one is
+                                  protonated and the second deuterated.
+           returns: SpinSystemSnapshot, keyed by spin system id.
+
+        '''
+
+        rows = {}
+        resonances = {}
+        keys = []
+        residue_types = []
+        resonance_groups = []
+        resonance_names = []
+        shifts = []
+        n_shiftLists = len(record_lists)
+
+        for column, records in enumerate(record_lists):
+            if records is None:
+                continue
+            for spin_system, residue_type, atom_name, value in records:
+                row = rows.get(spin_system)
+                if row is None:
+                    row = rows[spin_system] = len(keys)
+                    keys.append(spin_system)
+                    residue_types.append(residue_type)
+                elif residue_type and not residue_types[row]:
+                    residue_types[row] = residue_type
+
+                resonance = resonances.get((row, atom_name))
+                if resonance is None:
+                    resonance = resonances[(row, atom_name)] = len(shifts)
+                    resonance_groups.append(row)
+                    resonance_names.append(atom_name)
+                    shifts.append([numpy.nan] * n_shiftLists)
+                shifts[resonance][column] = value
+
+        serials = range(1, len(keys) + 1)
+        paired = sum(records is not None for records in record_lists) > 1
+        if models is None:
+            models = default_models(n_shiftLists)
+
+        return cls(keys, serials, residue_types, resonance_groups,
+                   resonance_names, shifts, paired_shiftLists=paired,
+                   models=models)
+
+    def update_resonanceGroups(self, resonanceGroups, protonatedShiftList=None,
+                               deuteratedShiftList=None, prefetch=None):
+        '''Copy the resonances of some spin systems again, after their
+           shifts, assign names or residue type changed. The shift
+           lists should be the ones the snapshot was made with.
+           args:    resonanceGroups:     spin systems that changed
+                    protonatedShiftList: shift list of protonated shifts
+                    deuteratedShiftList: shift list of deuterated shifts
+                    prefetch:            optional ShiftListPrefetch
+           returns: Boolean, False if one of the spin systems is not in
+                    the snapshot or the snapshot was not made from
+                    exactly two shift lists (the popup's protonated and
+                    deuterated list), nothing is changed then.
+
+        '''
+
+        if self.shifts.shape[1] != 2:
+            return False
+        if any(resonanceGroup not in self.index for resonanceGroup in resonanceGroups):
+            return False
+
+        rows = [self.index[resonanceGroup] for resonanceGroup in resonanceGroups]
+        keep = ~numpy.in1d(self.resonance_groups, rows)
+        resonance_groups = self.resonance_groups[keep].tolist()
+        resonance_names = [name for name, kept in zip(self.resonance_names, keep) if kept]
+        shifts = self.shifts[keep].tolist()
+
+        for row, resonanceGroup in zip(rows, resonanceGroups):
+            self.residue_types[row] = get_residue_type(resonanceGroup)
+            for name, values in copy_resonances(resonanceGroup,
+                                                protonatedShiftList,
+                                                deuteratedShiftList,
+                                                prefetch):
+                resonance_groups.append(row)
+                resonance_names.append(name)
+                shifts.append(values)
+
+        self.resonance_groups = numpy.asarray(resonance_groups, dtype=int)
+        self.resonance_names = resonance_names
+        self.shifts = numpy.asarray(shifts, dtype=float).reshape(-1, 2)
+        return True
+
+    def records(self, isotope_correction=True, keys=None):
+        '''Generate the (isotope corrected) shifts of all resonances.
+           With one or two shift lists the same rules as ShiftedResonce
+           are followed: CA and CB get a shift for every shift list
+           when isotope correction is on, missing values are estimated
+           from the others. All other resonances get one shift, from
+           the first shift list that has one. With more shift lists
+           (for instance other temperatures) every resonance gets a
+           shift for every list, missing shifts of atoms that are not
+           corrected are the average of the other lists. Shifts are
+           rereferenced with the offsets of the shift list models.
+           args:    isotope_correction: Boolean
+                    keys:               optional, only generate the
+                                        shifts of these spin systems.
+           returns: generator of (key, assign name, list of shifts)
+
+        '''
+
+        correction = isotope_correction and self.paired_shiftLists
+        selected = numpy.arange(len(self.resonance_groups))
+        if keys is not None:
+            rows = [self.index[key] for key in keys]
+            selected = selected[numpy.in1d(self.resonance_groups, rows)]
+
+        isotope = numpy.zeros(len(selected), dtype=bool)
+        if correction:
+            isotope = numpy.in1d([self.resonance_names[index] for index in selected],
+                                 ISOTOPE_ATOMS)
+        shifts = self.corrected_shifts(selected, isotope)
+
+        if len(self.models) > 2:
+            shifts[~isotope] = fill_missing(shifts[~isotope])
+            for index, values in zip(selected, shifts.tolist()):
+                yield (self.keys[self.resonance_groups[index]],
+                       self.resonance_names[index], values)
+            return
+
+        first = shifts[numpy.arange(len(shifts)), numpy.argmax(shifts == shifts, axis=1)]
+
+        for index, corrected, values, value in zip(selected, isotope,
+                                                   shifts.tolist(), first.tolist()):
+            key = self.keys[self.resonance_groups[index]]
+            name = self.resonance_names[index]
+            if corrected:
+                yield key, name, values
+            else:
+                yield key, name, [value]
+
+    def corrected_shifts(self, selected, isotope):
+        '''Rereference the shifts of some resonances and, for CA and CB,
+           estimate the missing shifts from the ones in the other shift
+           lists. This is done for all resonances and shift lists at
+           once: the measured shifts are converted to a protonated
+           sample, averaged and converted to every shift list.
+           args:    selected: int array of resonances
+                    isotope:  Boolean array, True for the selected
+                              resonances that should be corrected.
+           returns: float array (selected resonances x shift lists)
+
+        '''
+
+        names = [self.resonance_names[index] for index in selected]
+        shifts = numpy.empty((len(selected), len(self.models)))
+        for column, model in enumerate(self.models):
+            shifts[:, column] = model.rereference(names, self.shifts[selected, column])
+
+        corrected = numpy.nonzero(isotope)[0]
+        if not len(corrected):
+            return shifts
+
+        residue_types = [self.residue_types[row] for row
+                         in self.resonance_groups[selected[corrected]]]
+        atom_names = [names[index] for index in corrected]
+        measured = shifts[corrected]
+        protonated = numpy.column_stack([model.to_protonated(residue_types, atom_names,
+                                                             measured[:, column])
+                                         for column, model in enumerate(self.models)])
+        counts = (protonated == protonated).sum(axis=1)
+        reference = numpy.where(protonated == protonated, protonated, 0.0).sum(axis=1) / counts
+
+        for column, model in enumerate(self.models):
+            estimated = model.from_protonated(residue_types, atom_names, reference)
+            missing = measured[:, column] != measured[:, column]
+            shifts[corrected[missing], column] = estimated[missing]
+
+        return shifts
+
+    def shift_matrix(self, isotope_correction=True):
+        '''Pack the shifts into a ShiftMatrix.
+           args:    isotope_correction: Boolean
+           returns: ShiftMatrix
+
+        '''
+
+        return ShiftMatrix.from_records(self.keys,
+                                        self.records(isotope_correction))
+
+    def shift_tables(self, isotope_correction=True, keys=None):
+        '''Collect the shifts per spin system by assign name, in the
+           same form as compare_spin_systems.spin_system_shifts.
+           args:    isotope_correction: Boolean
+                    keys:               optional, only collect the
+                                        shifts of these spin systems.
+           returns: dict key -> dict assign name -> list of shift
+                    value lists.
+
+        '''
+
+        tables = dict((key, {}) for key in (self.keys if keys is None else keys))
+        for key, name, values in self.records(isotope_correction, keys):
+            tables[key].setdefault(name, []).append(values)
+        return tables
+
+
+def fill_missing(shifts):
+    '''Replace missing shifts (nan) by the average of the shifts of the
+       same resonance in the other shift lists.
+       args:    shifts: float array (resonances x shift lists), every
+                        resonance has at least one shift.
+       returns: float array
+
+    '''
+
+    present = shifts == shifts
+    average = numpy.where(present, shifts, 0.0).sum(axis=1) / present.sum(axis=1)
+    return numpy.where(present, shifts, average[:, None])
+
+
+def get_residue_type(resonanceGroup):
+    '''Returns the three letter residue type of a spin system, None if
+       it is not known.
+
+    '''
+
+    residue_type = resonanceGroup.ccpCode
+    if not residue_type and resonanceGroup.residue:
+        residue_type = resonanceGroup.residue.ccpCode
+    return residue_type or None
+
+
+def copy_resonances_from_shiftLists(resonanceGroup, shiftLists):
+    '''Generate the assign name and the shift in every shift list (nan
+       when missing) of every resonance in a spin system that has an
+       assign name and a shift in at least one of the shift lists.
+
+    '''
+
+    for resonance in resonanceGroup.getResonances():
+        if not resonance.assignNames:
+            continue
+        shifts = [resonance.findFirstShift(parentList=shiftList) for shiftList in shiftLists]
+        if not any(shifts):
+            continue
+        yield resonance.assignNames[0], [numpy.nan if shift is None else shift.value
+                                         for shift in shifts]
+
+
+def copy_resonances(resonanceGroup, protonatedShiftList=None,
+                    deuteratedShiftList=None, prefetch=None):
+    '''Generate the assign name and the protonated and deuterated
+       shift (nan when missing) of every resonance in a spin system
+       that has an assign name and a shift in one of the shift lists.
+
+    '''
+
+    for resonance in resonanceGroup.getResonances():
+        if not resonance.assignNames:
+            continue
+        values = find_shifts(resonance, protonatedShiftList,
+                             deuteratedShiftList, prefetch=prefetch)
+        if values == (None, None):
+            continue
+        yield resonance.assignNames[0], [numpy.nan if value is None else value
+                                         for value in values]
@@ -0,0 +1,117 @@
+'''Bookkeeping that keeps the tables of the popup from doing work that
+   was already done.
+
+The cells describing a spin system are cached until its resonances,
+shifts or assignment change, and a table is only redrawn when the rows
+it should show differ from the ones it shows. Nothing in here depends
+on CCPN or Tk, so it can be tested on its own.
+
+'''
+
+import instrumentation
+from compare_spin_systems import find_all_shiftLists_for_resonanceGroup
+
+
+class SpinSystemRowCache(object):
+    '''Keeps the shift lists string and the assignment label of every
+       spin system, so the tables do not have to walk the shifts and
+       residue probabilities of all spin systems on every update. The
+       entry of a spin system has to be invalidated when its
+       resonances, shifts or assignment change.
+
+    '''
+
+    def __init__(self, make_label):
+        '''Init.
+           args:    make_label: function making the assignment label
+                                of a spin system.
+
+        '''
+
+        self.make_label = make_label
+        self.rows = {}
+        self.resonanceGroups = {}
+
+    def get(self, resonanceGroup):
+        '''Get the cells describing a spin system.
+           args:    resonanceGroup: spin system
+           returns: (shift lists string, assignment label)
+
+        '''
+
+        row = self.rows.get(resonanceGroup)
+
+        if row is not None:
+            instrumentation.count('row_cache_hits')
+        else:
+            instrumentation.count('row_cache_misses')
+            shiftLists = find_all_shiftLists_for_resonanceGroup(resonanceGroup)
+            row = (make_shiftLists_string(shiftLists),
+                   self.make_label(resonanceGroup))
+            self.rows[resonanceGroup] = row
+            for resonance in resonanceGroup.getResonances():
+                self.resonanceGroups[resonance] = resonanceGroup
+
+        return row
+
+    def invalidate_resonanceGroup(self, resonanceGroup):
+        '''Forget the cells of one spin system.'''
+
+        self.rows.pop(resonanceGroup, None)
+
+    def invalidate_resonance(self, resonance):
+        '''Forget the cells of the spin system a resonance is in, and
+           of the one it was in when the cells were made.
+
+        '''
+
+        previous = self.resonanceGroups.pop(resonance, None)
+        if previous is not None:
+            self.invalidate_resonanceGroup(previous)
+        if resonance.resonanceGroup is not None:
+            self.invalidate_resonanceGroup(resonance.resonanceGroup)
+
+    def clear(self):
+        '''Forget everything.'''
+
+        self.rows = {}
+        self.resonanceGroups = {}
+
+
+class ShownTables(object):
+    '''Remembers the rows every table shows.'''
+
+    def __init__(self):
+        '''Init.'''
+
+        self.contents = {}
+
+    def changed(self, table, objectList, data, colorMatrix=None):
+        '''Check whether a table should be updated to show these rows
+           and remember them if so.
+           args:    table:       ScrolledMatrix
+                    objectList:  list of objects, one per row
+                    data:        list of rows
+                    colorMatrix: optional list of row colours
+           returns: Boolean, False if the table already shows exactly
+                    these rows.
+
+        '''
+
+        content = (list(objectList), data, colorMatrix)
+        if self.contents.get(table) == content:
+            instrumentation.count('unchanged_tables')
+            return False
+        self.contents[table] = content
+        return True
+
+
+def make_shiftLists_string(shiftLists):
+    '''For a list iterable of shift lists, produce a short string
+       that identifies those shiftlists.
+       args:    shiftLists:    iterable of shift lists
+       returns: str of comma seperated shift list serials
+
+    '''
+
+    return ','.join([str(shiftList.serial) for shiftList in shiftLists])
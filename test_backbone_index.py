@@ -0,0 +1,43 @@
+from backbone_index import BackboneIndex
+import numpy
+import pytest
+
+nan = numpy.nan
+
+
+def brute_force(vectors, row, k):
+    results = []
+    for other, vector in enumerate(vectors):
+        shared = ~numpy.isnan(vector) & ~numpy.isnan(vectors[row])
+        if not shared.any():
+            continue
+        distance = ((vector[shared] - vectors[row][shared]) ** 2).sum() ** 0.5
+        results.append((distance, other))
+    return sorted(results)[:k]
+
+
+def test_nearest_uses_shared_dimensions():
+    vectors = [[8.0, 120.0, 55.0, 30.0],
+               [8.1, 121.0, nan, nan],
+               [nan, nan, 55.2, 30.1],
+               [nan, nan, nan, nan]]
+    index = BackboneIndex(['a', 'b', 'c', 'd'], vectors)
+    nearest = index.nearest('a', k=3)
+    assert [key for distance, key in nearest] == ['a', 'c', 'b']
+    assert nearest[1][0] == pytest.approx((0.2 ** 2 + 0.1 ** 2) ** 0.5)
+
+
+def test_nearest_agrees_with_brute_force():
+    random = numpy.random.RandomState(0)
+    vectors = random.normal([8.0, 120.0, 55.0, 35.0], [0.5, 4.0, 3.0, 8.0],
+                            size=(300, 4))
+    vectors[random.rand(300, 4) < 0.2] = nan
+    keys = list(range(300))
+    index = BackboneIndex(keys, vectors, leaf_size=4)
+    for row in [0, 17, 123, 299]:
+        if numpy.isnan(vectors[row]).all():
+            continue
+        expected = brute_force(vectors, row, 5)
+        found = index.nearest(row, k=5)
+        assert [distance for distance, key in found] == \
+            pytest.approx([distance for distance, other in expected])
@@ -0,0 +1,143 @@
+import csv
+import json
+
+import numpy
+import pytest
+
+from batch_spin_system_compare import deviation_matrix, main
+from shift_matrix import ShiftMatrix
+from shift_list_io import read_shifts
+
+PROTONATED = '''spin_system,residue_type,atom,shift
+1,ALA,N,120.0
+1,ALA,CA,52.0
+2,,N,120.1
+2,,CA,52.1
+3,Gly,N,108.0
+'''
+
+DEUTERATED = '''data_shifts
+save_shifts
+   loop_
+      _Atom_chem_shift.Seq_ID
+      _Atom_chem_shift.Comp_ID
+      _Atom_chem_shift.Atom_ID
+      _Atom_chem_shift.Val
+      1 ALA CA 51.5
+      2 .   CA 51.6
+      3 GLY N  .
+   stop_
+save_
+'''
+
+
+@pytest.fixture
+def shift_lists(tmpdir):
+    protonated = tmpdir.join('protonated.csv')
+    protonated.write(PROTONATED)
+    deuterated = tmpdir.join('deuterated.str')
+    deuterated.write(DEUTERATED)
+    return str(protonated), str(deuterated), tmpdir
+
+
+def test_read_shifts(shift_lists):
+    protonated, deuterated, tmpdir = shift_lists
+    assert list(read_shifts(protonated))[:3] == [('1', 'Ala', 'N', 120.0),
+                                                 ('1', 'Ala', 'CA', 52.0),
+                                                 ('2', None, 'N', 120.1)]
+    assert list(read_shifts(deuterated)) == [('1', 'Ala', 'CA', 51.5),
+                                             ('2', None, 'CA', 51.6)]
+
+
+def test_ranked_csv(shift_lists):
+    protonated, deuterated, tmpdir = shift_lists
+    output = str(tmpdir.join('ranked.csv'))
+    main([protonated, deuterated, '--best', '1', '--output', output])
+    rows = list(csv.DictReader(open(output)))
+    assert [(row['spin_system'], row['candidate']) for row in rows] == \
+        [('1', '2'), ('2', '1'), ('3', '1')]
+    assert rows[0]['match'] == 'True'
+    assert float(rows[0]['deviation']) == pytest.approx(0.1 * 2 ** 0.5)
+
+
+def test_matrix_jsonl(shift_lists):
+    protonated, deuterated, tmpdir = shift_lists
+    output = str(tmpdir.join('matrix.jsonl'))
+    main([protonated, deuterated, '--mode', 'matrix', '--matches-only',
+          '--output', output])
+    rows = [json.loads(line) for line in open(output)]
+    assert [(row['spin_system_1'], row['spin_system_2']) for row in rows] == [('1', '2')]
+    assert rows[0]['overlap'] == 2
+
+
+def test_more_shift_lists(shift_lists):
+    protonated, deuterated, tmpdir = shift_lists
+    warm = tmpdir.join('warm.csv')
+    warm.write('spin_system,residue_type,atom,shift\n4,,N,121.1\n')
+    output = tmpdir.join('matrix.jsonl')
+
+    main([protonated, deuterated, str(warm), '--mode', 'matrix',
+          '--matches-only', '--isotope', 'protonated', 'deuterated',
+          'protonated', '--offset', '0.0', '0.0', '-1.0',
+          '--output', str(output)])
+
+    rows = [json.loads(line) for line in output.readlines()]
+    assert [(row['spin_system_1'], row['spin_system_2']) for row in rows] == \
+        [('1', '2'), ('1', '4'), ('2', '4')]
+
+
+def test_one_option_per_shift_list(shift_lists):
+    protonated, deuterated, tmpdir = shift_lists
+    with pytest.raises(SystemExit):
+        main([protonated, deuterated, '--offset', '0.5'])
+
+
+def test_shift_list_id_per_file(shift_lists):
+    protonated, deuterated, tmpdir = shift_lists
+    both = tmpdir.join('both.str')
+    both.write(DEUTERATED.replace('_Atom_chem_shift.Val',
+                                  '_Atom_chem_shift.Val\n      _Atom_chem_shift.Assigned_chem_shift_list_ID')
+               .replace('51.5', '51.5 1').replace('51.6', '51.6 1').replace('N  .', 'N  . 1')
+               .replace('   stop_', '      1 ALA CA 60.0 2\n   stop_'))
+    output = tmpdir.join('matrix.jsonl')
+
+    with pytest.raises(ValueError):
+        main([protonated, str(both), '--output', str(output)])
+
+    main([protonated, str(both), '--shift-list-id', '-', '1', '--mode', 'matrix',
+          '--matches-only', '--output', str(output)])
+    rows = [json.loads(line) for line in output.readlines()]
+    assert [(row['spin_system_1'], row['spin_system_2']) for row in rows] == [('1', '2')]
+
+
+@pytest.mark.parametrize('mode', ['ranked', 'matrix'])
+def test_processes_give_the_same_output(shift_lists, mode):
+    protonated, deuterated, tmpdir = shift_lists
+    outputs = []
+    for processes in ['1', '2']:
+        output = tmpdir.join('{}_{}.csv'.format(mode, processes))
+        main([protonated, deuterated, '--mode', mode, '--block-size', '1',
+              '--processes', processes, '--output', str(output)])
+        outputs.append(output.read())
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].splitlines()) > 2
+
+
+def test_deviation_matrix_covers_every_pair_once():
+    random = numpy.random.RandomState(3)
+    keys = list(range(23))
+    records = [(key, atom_name, [random.normal(50.0, 0.3)])
+               for key in keys for atom_name in ['N', 'CA', 'CB']
+               if random.rand() < 0.7]
+    matrix = ShiftMatrix.from_records(keys, records)
+    deviation, match, overlap = matrix.compare_all()
+
+    rows = list(deviation_matrix(matrix, block_size=5))
+
+    pairs = [(row['spin_system_1'], row['spin_system_2']) for row in rows]
+    expected = [(i, j) for i in keys for j in keys if j > i and overlap[i, j]]
+    assert sorted(pairs) == expected
+    for row in rows:
+        i, j = row['spin_system_1'], row['spin_system_2']
+        assert row['deviation'] == pytest.approx(deviation[i, j])
+        assert row['match'] == match[i, j]
@@ -0,0 +1,151 @@
+from ccpn_isotope_shift import (ShiftedResonanceCache, ShiftedResonce,
+                                ShiftListPrefetch, find_shifts)
+from compare_spin_systems import SpinSystemComparison
+from fake_ccpn import (Resonance, ResonanceGroup, Shift, ShiftList, make_project,
+                       sample_pairs)
+from isotope_shift import set_iso_corr, talos_iso_corr
+from spin_system_snapshot import SpinSystemSnapshot
+import pytest
+
+
+def make_resonances():
+    protonated = ShiftList(1)
+    deuterated = ShiftList(2)
+    other = ShiftList(3)
+    resonanceGroup = ResonanceGroup(1, 'Ala')
+    both = Resonance(1, resonanceGroup, 'CA')
+    # The deuterated shift comes first, so findFirstShift() returns it.
+    Shift(deuterated, both, 51.5)
+    Shift(protonated, both, 52.0)
+    unselected = Resonance(2, resonanceGroup, 'N')
+    Shift(other, unselected, 120.0)
+    return protonated, deuterated, resonanceGroup, both, unselected
+
+
+def test_without_correction_the_protonated_list_is_preferred():
+    protonated, deuterated, resonanceGroup, both, unselected = make_resonances()
+
+    shifted = ShiftedResonce(both, protonated, deuterated,
+                             isotope_correction=False)
+
+    assert [shiftedShift.value for shiftedShift in shifted.shiftedShifts] == [52.0]
+    snapshot = SpinSystemSnapshot.from_resonanceGroups([resonanceGroup],
+                                                       protonated, deuterated)
+    assert list(snapshot.records(isotope_correction=False)) == [(resonanceGroup, 'CA', [52.0])]
+
+
+def test_without_correction_other_shift_lists_are_a_last_resort():
+    protonated, deuterated, resonanceGroup, both, unselected = make_resonances()
+
+    shifted = ShiftedResonce(unselected, protonated, deuterated,
+                             isotope_correction=False)
+
+    assert [shiftedShift.value for shiftedShift in shifted.shiftedShifts] == [120.0]
+
+
+def shifted_values(shiftedResonance):
+    return [(shiftedShift.value, shiftedShift.estimated, shiftedShift.deuterated)
+            for shiftedShift in shiftedResonance.shiftedShifts]
+
+
+def test_prefetch_finds_the_same_shifts_as_ccpn_lookups():
+    project = make_project(30, seed=5)
+    shiftLists = (project.protonatedShiftList, project.deuteratedShiftList)
+    prefetch = ShiftListPrefetch(*shiftLists)
+
+    for resonanceGroup in project.resonanceGroups:
+        for resonance in resonanceGroup.resonances:
+            assert prefetch.get_shifts(resonance) == find_shifts(resonance, *shiftLists)
+            assert find_shifts(resonance, *shiftLists, prefetch=prefetch) == \
+                find_shifts(resonance, *shiftLists)
+            for isotope_correction in (True, False):
+                with_prefetch = ShiftedResonce(resonance, *shiftLists,
+                                               isotope_correction=isotope_correction,
+                                               prefetch=prefetch)
+                without = ShiftedResonce(resonance, *shiftLists,
+                                         isotope_correction=isotope_correction)
+                assert shifted_values(with_prefetch) == shifted_values(without)
+
+
+def test_prefetch_only_covers_its_own_shift_lists():
+    protonated, deuterated, resonanceGroup, both, unselected = make_resonances()
+    prefetch = ShiftListPrefetch(protonated, deuterated)
+
+    assert prefetch.covers(protonated, deuterated)
+    assert not prefetch.covers(deuterated, protonated)
+    assert not prefetch.covers(protonated, None)
+    assert prefetch.contains(both)
+    assert not prefetch.contains(unselected)
+
+
+def test_prefetch_update_resonance():
+    protonated, deuterated, resonanceGroup, both, unselected = make_resonances()
+    prefetch = ShiftListPrefetch(protonated, deuterated)
+
+    both.findFirstShift(parentList=protonated).value = 53.0
+    Shift(deuterated, unselected, 119.5)
+    prefetch.update_resonance(both)
+    prefetch.update_resonance(unselected)
+
+    assert prefetch.get_shifts(both) == (53.0, 51.5)
+    assert prefetch.get_shifts(unselected) == (None, 119.5)
+
+
+def test_cache_returns_the_same_object_until_invalidated():
+    protonated, deuterated, resonanceGroup, both, unselected = make_resonances()
+    cache = ShiftedResonanceCache()
+
+    first = cache.get(both, protonated, deuterated)
+    assert cache.get(both, protonated, deuterated) is first
+    assert cache.get(both, protonated, deuterated, isotope_correction=False) is not first
+
+    cache.invalidate_resonance(both)
+    assert cache.get(both, protonated, deuterated) is not first
+
+
+def test_cache_follows_residue_type_changes_after_invalidation():
+    protonated, deuterated, resonanceGroup, both, unselected = make_resonances()
+    cache = ShiftedResonanceCache()
+    deuterated_cb = Resonance(3, resonanceGroup, 'CB')
+    Shift(deuterated, deuterated_cb, 18.0)
+
+    before = cache.get(deuterated_cb, protonated, deuterated).shiftedShifts[0].value
+    resonanceGroup.ccpCode = 'Leu'
+    assert cache.get(deuterated_cb, protonated, deuterated).shiftedShifts[0].value == before
+
+    cache.invalidate_resonanceGroup(resonanceGroup)
+    after = cache.get(deuterated_cb, protonated, deuterated).shiftedShifts[0].value
+    assert after == ShiftedResonce(deuterated_cb, protonated, deuterated).shiftedShifts[0].value
+    assert after != before
+
+
+def test_cache_is_cleared_when_other_isotope_shifts_are_set():
+    protonated, deuterated, resonanceGroup, both, unselected = make_resonances()
+    cache = ShiftedResonanceCache()
+    deuterated_cb = Resonance(3, resonanceGroup, 'CB')
+    Shift(deuterated, deuterated_cb, 18.0)
+    before = cache.get(deuterated_cb, protonated, deuterated).shiftedShifts[0].value
+
+    iso_corr = dict(talos_iso_corr)
+    iso_corr['Ala'] = (-0.4, -2.0)
+    set_iso_corr(iso_corr)
+    try:
+        after = cache.get(deuterated_cb, protonated, deuterated).shiftedShifts[0].value
+    finally:
+        set_iso_corr(None)
+
+    assert after == pytest.approx(18.0 + 2.0)
+    assert after != before
+
+
+def test_comparisons_with_a_cache_agree_with_comparisons_without():
+    project = make_project(30, seed=7)
+    settings = {'protonatedShiftList': project.protonatedShiftList,
+                'deuteratedShiftList': project.deuteratedShiftList}
+    cache = ShiftedResonanceCache()
+
+    for spinSystem1, spinSystem2 in sample_pairs(project, 60):
+        cached = SpinSystemComparison(spinSystem1, spinSystem2, cache=cache, **settings)
+        uncached = SpinSystemComparison(spinSystem1, spinSystem2, **settings)
+        assert (cached.deviation, cached.match, cached.overlap) == \
+            (uncached.deviation, uncached.match, uncached.overlap)
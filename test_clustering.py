@@ -0,0 +1,67 @@
+from clustering import UnionFind, cluster_spin_systems
+from fake_ccpn import make_project
+from shift_list_models import ShiftListModel
+from shift_index import ShiftIndex
+from spin_system_snapshot import SpinSystemSnapshot
+import numpy
+import pytest
+
+
+def test_union_find_groups():
+    unionFind = UnionFind(6)
+    assert unionFind.union(0, 1)
+    assert unionFind.union(1, 2)
+    assert not unionFind.union(0, 2)
+    unionFind.union(4, 5)
+    assert sorted(sorted(group) for group in unionFind.groups()) == [[0, 1, 2], [4, 5]]
+
+
+def brute_force_clusters(shiftMatrix, max_deviation, matches_only):
+    deviation, match, overlap = shiftMatrix.compare_all()
+    connected = overlap > 0
+    if matches_only:
+        connected &= match
+    if max_deviation is not None:
+        connected[connected] = deviation[connected] < max_deviation
+    unionFind = UnionFind(len(shiftMatrix.keys))
+    for row1, row2 in zip(*numpy.nonzero(connected)):
+        if row1 != row2:
+            unionFind.union(row1, row2)
+    return sorted(sorted(shiftMatrix.keys[row].serial for row in group)
+                  for group in unionFind.groups())
+
+
+@pytest.mark.parametrize('max_deviation, matches_only', [(None, True),
+                                                         (0.3, False),
+                                                         (1.0, True)])
+def test_clusters_equal_brute_force(max_deviation, matches_only):
+    project = make_project(150, seed=5)
+    snapshot = SpinSystemSnapshot.from_resonanceGroups(project.resonanceGroups,
+                                                       project.protonatedShiftList,
+                                                       project.deuteratedShiftList)
+    shiftMatrix = snapshot.shift_matrix()
+    tables = snapshot.shift_tables()
+    clusters = cluster_spin_systems(shiftMatrix, ShiftIndex(tables), tables,
+                                    max_deviation, matches_only)
+    found = sorted(sorted(spinSystem.serial for spinSystem in keys)
+                   for keys, complete, largest in clusters)
+    assert found
+    assert found == brute_force_clusters(shiftMatrix, max_deviation, matches_only)
+
+
+def test_clusters_of_more_shift_lists():
+    # Spin system 2 deviates 0.8 on average over three shift lists, but
+    # 2.4 in one of them: more than twice the maximum deviation.
+    record_lists = [[('1', None, 'N', 120.0), ('2', None, 'N', 120.0), ('3', None, 'N', 125.0)],
+                    [('1', None, 'N', 120.0), ('2', None, 'N', 120.0)],
+                    [('1', None, 'N', 120.0), ('2', None, 'N', 122.4)]]
+    snapshot = SpinSystemSnapshot.from_record_lists(record_lists,
+                                                    [ShiftListModel()] * 3)
+    shiftMatrix = snapshot.shift_matrix()
+    tables = snapshot.shift_tables()
+    assert shiftMatrix.values.shape[-1] == 3
+
+    clusters = cluster_spin_systems(shiftMatrix, ShiftIndex(tables), tables,
+                                    max_deviation=1.0, matches_only=False)
+    found = sorted(sorted(keys) for keys, complete, largest in clusters)
+    assert found == [['1', '2']]
@@ -0,0 +1,233 @@
+from ccpn_isotope_shift import ShiftedResonce
+from compare_spin_systems import (SpinSystemComparison, find_best_matches,
+                                  index_resonances, iterate_shift_pairs,
+                                  resonance_in_shiftLists, score_shift_pairs,
+                                  score_spin_systems)
+from fake_ccpn import Resonance, Shift, ShiftList, make_project, sample_pairs
+from spin_system_snapshot import SpinSystemSnapshot
+import pytest
+
+
+def old_divide_resonances(spinSystem1, spinSystem2, shiftLists):
+    '''The nested loop divide_resonances used to run.'''
+
+    resonances1 = spinSystem1.getResonances()
+    resonances2 = spinSystem2.getResonances()
+    combinations = []
+    compared = set()
+    bad = set()
+
+    for res1 in resonances1:
+        if not resonance_in_shiftLists(res1, shiftLists):
+            bad.add(res1)
+            continue
+        if not res1.assignNames:
+            continue
+
+        for res2 in resonances2:
+            if not resonance_in_shiftLists(res2, shiftLists):
+                bad.add(res2)
+                continue
+            if not res2.assignNames:
+                continue
+            if not res1.assignNames[0] == res2.assignNames[0]:
+                continue
+
+            combinations.append((res1, res2))
+            compared.update((res1, res2))
+
+    return resonances1 - compared - bad, resonances2 - compared - bad, combinations
+
+
+def make_messy_project():
+    '''A project with duplicate assign names, resonances without shifts
+       in the selected lists and resonances without assign names.
+
+    '''
+
+    project = make_project(40, seed=6)
+    other = ShiftList(3)
+    serial = 10000
+    for number, resonanceGroup in enumerate(project.resonanceGroups):
+        serial += 1
+        if number % 3 == 0:
+            Shift(project.protonatedShiftList, Resonance(serial, resonanceGroup, 'CA'), 55.0)
+        elif number % 3 == 1:
+            Shift(other, Resonance(serial, resonanceGroup, 'H'), 8.0)
+        else:
+            resonance = Resonance(serial, resonanceGroup, None)
+            resonance.assignNames = ()
+            Shift(project.protonatedShiftList, resonance, 30.0)
+    return project
+
+
+def test_divide_resonances_agrees_with_nested_loop():
+    project = make_messy_project()
+    shiftLists = [project.protonatedShiftList, project.deuteratedShiftList]
+
+    for spinSystem1, spinSystem2 in sample_pairs(project, 100):
+        comparison = SpinSystemComparison(spinSystem1, spinSystem2,
+                                          protonatedShiftList=shiftLists[0],
+                                          deuteratedShiftList=shiftLists[1])
+        difference1, difference2, combinations = comparison.divide_resonances()
+        old1, old2, old_combinations = old_divide_resonances(spinSystem1, spinSystem2,
+                                                             shiftLists)
+        assert difference1 == old1
+        assert difference2 == old2
+        assert sorted(combinations) == sorted(old_combinations)
+
+
+def test_index_resonances():
+    project = make_messy_project()
+    shiftLists = [project.protonatedShiftList, project.deuteratedShiftList]
+    resonanceGroup = project.resonanceGroups[1]
+
+    names, bad = index_resonances(resonanceGroup.getResonances(), shiftLists)
+
+    assert [resonance.assignNames[0] for resonance in bad] == ['H']
+    for name, resonances in names.items():
+        assert all(resonance.assignNames[0] == name for resonance in resonances)
+    assert sum(len(resonances) for resonances in names.values()) == \
+        len(resonanceGroup.resonances) - len(bad)
+
+
+def old_compare(spinSystem1, spinSystem2, protonatedShiftList,
+                deuteratedShiftList, isotope_correction=True):
+    '''The comparison that used to be made eagerly for every pair.'''
+
+    shiftLists = [protonatedShiftList, deuteratedShiftList]
+    difference1, difference2, combinations = old_divide_resonances(spinSystem1, spinSystem2,
+                                                                   shiftLists)
+    deviation = None
+    deltas = []
+    for res1, res2 in combinations:
+        shifted1 = ShiftedResonce(res1, *shiftLists, isotope_correction=isotope_correction)
+        shifted2 = ShiftedResonce(res2, *shiftLists, isotope_correction=isotope_correction)
+        pair_deltas = [abs(shiftedShift1.value - shiftedShift2.value)
+                       for shiftedShift1, shiftedShift2 in zip(shifted1.shiftedShifts,
+                                                               shifted2.shiftedShifts)]
+        deltas.extend(pair_deltas)
+        deviation = (deviation or 0.0) + (sum(pair_deltas) / len(pair_deltas))**2
+    if deviation:
+        deviation = deviation**0.5
+
+    unique = []
+    for resonances in (difference1, difference2):
+        values = set()
+        for resonance in resonances:
+            shifted = ShiftedResonce(resonance, isotope_correction=isotope_correction)
+            values.update((shiftedShift.resonance, shiftedShift.value)
+                          for shiftedShift in shifted.shiftedShifts)
+        unique.append(values)
+
+    return deviation, all(delta < 0.5 for delta in deltas), sorted(deltas), unique
+
+
+@pytest.mark.parametrize('isotope_correction', [True, False])
+def test_lazy_comparison_agrees_with_eager_comparison(isotope_correction):
+    project = make_messy_project()
+    settings = {'protonatedShiftList': project.protonatedShiftList,
+                'deuteratedShiftList': project.deuteratedShiftList}
+
+    for spinSystem1, spinSystem2 in sample_pairs(project, 60):
+        comparison = SpinSystemComparison(spinSystem1, spinSystem2,
+                                          isotope_correction=isotope_correction,
+                                          **settings)
+        deviation, match, deltas, unique = old_compare(spinSystem1, spinSystem2,
+                                                       isotope_correction=isotope_correction,
+                                                       **settings)
+
+        assert comparison.deviation == pytest.approx(deviation)
+        assert comparison.match == match
+        assert score_spin_systems(spinSystem1, spinSystem2,
+                                  isotope_correction=isotope_correction, **settings) == \
+            (comparison.deviation, comparison.match, comparison.overlap)
+        # The breakdown is only made when it is asked for.
+        assert comparison._intersection is None and comparison._unique is None
+        assert sorted(shiftComparison.delta for shiftComparison
+                      in comparison.intersection) == pytest.approx(deltas)
+        for shiftedShifts, old in zip((comparison.unique_to_1, comparison.unique_to_2), unique):
+            assert set((shiftedShift.resonance, shiftedShift.value)
+                       for shiftedShift in shiftedShifts) == old
+
+
+def brute_force_ranking(spinSystem, candidates, tables, max_deviation=None,
+                        matches_only=False):
+    ranking = []
+    for candidate in candidates:
+        deviation, match, overlap = score_shift_pairs(iterate_shift_pairs(tables[spinSystem],
+                                                                          tables[candidate]))
+        if deviation is None or (matches_only and not match):
+            continue
+        if max_deviation is not None and deviation > max_deviation:
+            continue
+        ranking.append((deviation, match, candidate))
+    ranking.sort(key=lambda item: item[0])
+    return ranking
+
+
+@pytest.fixture(scope='module')
+def ranked_project():
+    project = make_project(80, seed=8)
+    snapshot = SpinSystemSnapshot.from_resonanceGroups(project.resonanceGroups,
+                                                       project.protonatedShiftList,
+                                                       project.deuteratedShiftList)
+    return project.resonanceGroups, snapshot.shift_tables()
+
+
+@pytest.mark.parametrize('k, max_deviation, matches_only', [(1, None, False),
+                                                            (None, None, False),
+                                                            (5, None, False),
+                                                            (None, 2.0, False),
+                                                            (3, 5.0, False),
+                                                            (None, None, True)])
+def test_find_best_matches_agrees_with_brute_force(ranked_project, k, max_deviation,
+                                                   matches_only):
+    spinSystems, tables = ranked_project
+
+    for spinSystem in spinSystems[:20]:
+        best = find_best_matches(spinSystem, spinSystems, k=k,
+                                 max_deviation=max_deviation,
+                                 matches_only=matches_only, tables=tables)
+        expected = brute_force_ranking(spinSystem, spinSystems, tables,
+                                       max_deviation, matches_only)[:k]
+        assert [item[2] for item in best] == [item[2] for item in expected]
+        assert [item[0] for item in best] == pytest.approx([item[0] for item in expected])
+
+
+def test_find_best_matches_looks_up_shifts_without_tables():
+    project = make_project(20, seed=9)
+    settings = {'protonatedShiftList': project.protonatedShiftList,
+                'deuteratedShiftList': project.deuteratedShiftList}
+    spinSystem = project.resonanceGroups[0]
+
+    best = find_best_matches(spinSystem, project.resonanceGroups, k=3, **settings)
+
+    scores = [score_spin_systems(spinSystem, candidate, **settings) + (candidate,)
+              for candidate in project.resonanceGroups]
+    scores = sorted((score for score in scores if score[0] is not None),
+                    key=lambda score: score[0])
+    assert [item[2] for item in best] == [score[3] for score in scores[:3]]
+
+
+def test_score_shift_pairs_stops_at_the_bound():
+    shift_pairs = [([1.0], [2.0]), ([1.0], [3.0]), ([1.0], [1.1])]
+    consumed = []
+
+    def pairs():
+        for pair in shift_pairs:
+            consumed.append(pair)
+            yield pair
+
+    assert score_shift_pairs(pairs(), bound=1.5) is None
+    assert len(consumed) == 2
+
+
+def test_score_shift_pairs_with_a_loose_bound_is_unchanged():
+    shift_pairs = [([1.0, 2.0], [1.2, 2.4]), ([5.0], [5.1])]
+    unbounded = score_shift_pairs(shift_pairs)
+
+    assert score_shift_pairs(shift_pairs, bound=unbounded[0] + 1e-9) == unbounded
+    assert score_shift_pairs(shift_pairs, bound=unbounded[0] - 1e-3) is None
+    assert unbounded[0] == pytest.approx((0.3**2 + 0.1**2)**0.5)
+    assert unbounded[1:] == (True, 2)
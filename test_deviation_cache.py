@@ -0,0 +1,140 @@
+from deviation_cache import cache_directory, cached_compare_all, has_cache
+from isotope_shift import set_iso_corr, talos_iso_corr
+from shift_matrix import ShiftMatrix
+from spin_system_snapshot import SpinSystemSnapshot
+import numpy
+
+
+def make_matrix(shift=50.2):
+    records = [('a', 'CA', [50.0, 49.5]),
+               ('a', 'N', [120.0]),
+               ('b', 'CA', [shift, 49.9]),
+               ('b', 'N', [121.0]),
+               ('c', 'CB', [30.0, 29.0])]
+    return ShiftMatrix.from_records(['a', 'b', 'c'], records)
+
+
+def test_cache_directory_depends_on_settings(tmpdir):
+    base = str(tmpdir)
+    assert cache_directory(base, 'p', [1, 2], True) != cache_directory(base, 'p', [1, 2], False)
+    assert cache_directory(base, 'p', [1, None], True) == cache_directory(base, 'p', [1, None], True)
+
+
+def test_cache_is_loaded_memory_mapped(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    cached_compare_all(directory, make_matrix(), [1, 2, 3])
+    assert has_cache(directory)
+
+    def fail(shiftMatrix):
+        raise AssertionError('should not recompute')
+
+    results = cached_compare_all(directory, make_matrix(), [1, 2, 3], compare_all=fail)
+    assert isinstance(results.deviation, numpy.memmap)
+    assert results.get('a', 'b')[2] == 2
+
+
+def test_changed_rows_are_recomputed(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    cached_compare_all(directory, make_matrix(), [1, 2, 3])
+    matrix = make_matrix(shift=53.0)
+    results = cached_compare_all(directory, matrix, [1, 2, 3])
+    expected = matrix.compare_all()
+    assert numpy.allclose(results.deviation, expected[0], equal_nan=True)
+    assert (results.match == expected[1]).all()
+    reloaded = cached_compare_all(directory, matrix, [1, 2, 3])
+    assert numpy.allclose(reloaded.deviation, expected[0], equal_nan=True)
+
+
+def assert_same_results(results, shiftMatrix):
+    expected = shiftMatrix.compare_all()
+    assert numpy.allclose(results.deviation, expected[0], equal_nan=True)
+    assert (results.match == expected[1]).all()
+    assert (results.overlap == expected[2]).all()
+
+
+def test_only_new_spin_systems_are_compared(tmpdir, monkeypatch):
+    directory = str(tmpdir.join('cache'))
+    cached_compare_all(directory, make_matrix(), [1, 2, 3])
+
+    records = [('d', 'CA', [50.1, 49.6]),
+               ('d', 'HA', [4.2]),
+               ('c', 'CB', [30.0, 29.0]),
+               ('a', 'N', [120.0]),
+               ('a', 'CA', [50.0, 49.5]),
+               ('b', 'N', [121.0]),
+               ('b', 'CA', [50.2, 49.9])]
+    matrix = ShiftMatrix.from_records(['d', 'c', 'a', 'b'], records)
+    compared = []
+    compare_subsets = ShiftMatrix.compare_subsets
+
+    def spy(self, rows1, rows2, block_size=64):
+        compared.append([self.keys[row] for row in rows1])
+        return compare_subsets(self, rows1, rows2, block_size)
+
+    monkeypatch.setattr(ShiftMatrix, 'compare_subsets', spy)
+    results = cached_compare_all(directory, matrix, [4, 3, 1, 2])
+    assert compared == [['d']]
+    monkeypatch.undo()
+    assert_same_results(results, matrix)
+
+    reloaded = cached_compare_all(directory, matrix, [4, 3, 1, 2])
+    assert isinstance(reloaded.deviation, numpy.memmap)
+    assert_same_results(reloaded, matrix)
+
+
+def test_removed_spin_systems_are_dropped(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    cached_compare_all(directory, make_matrix(), [1, 2, 3])
+
+    records = [('c', 'CB', [30.0, 29.0]), ('a', 'CA', [50.0, 49.5]),
+               ('a', 'N', [120.0])]
+    matrix = ShiftMatrix.from_records(['c', 'a'], records)
+
+    def fail(shiftMatrix):
+        raise AssertionError('should not recompute')
+
+    results = cached_compare_all(directory, matrix, [3, 1], compare_all=fail)
+    assert_same_results(results, matrix)
+    assert isinstance(cached_compare_all(directory, matrix, [3, 1]).deviation,
+                      numpy.memmap)
+
+
+def test_changes_in_memory_do_not_reach_the_cache(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    cached_compare_all(directory, make_matrix(), [1, 2, 3])
+    results = cached_compare_all(directory, make_matrix(), [1, 2, 3])
+
+    saved = results.get('a', 'b')[0]
+    results.update_rows(make_matrix(shift=53.0), ['b'])
+    assert results.get('a', 'b')[0] != saved
+
+    reloaded = cached_compare_all(directory, make_matrix(), [1, 2, 3])
+    assert reloaded.get('a', 'b')[0] == saved
+    assert_same_results(reloaded, make_matrix())
+
+
+def test_without_directory_nothing_is_cached():
+    assert not has_cache(None)
+    results = cached_compare_all(None, make_matrix(), [1, 2, 3])
+    assert_same_results(results, make_matrix())
+
+
+def test_other_isotope_shifts_recompute_the_rows(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    protonated = [('1', 'Ala', 'CA', 52.0), ('2', 'Gly', 'CA', 45.0),
+                  ('3', 'Ala', 'N', 120.0)]
+    deuterated = [('1', 'Ala', 'CA', 51.5), ('2', 'Gly', 'CA', 44.6)]
+    snapshot = SpinSystemSnapshot.from_shift_records(protonated, deuterated)
+    serials = [1, 2, 3]
+    cached_compare_all(directory, snapshot.shift_matrix(True), serials)
+
+    iso_corr = dict(talos_iso_corr)
+    iso_corr['Ala'] = (-2.0, -2.0)
+    set_iso_corr(iso_corr)
+    try:
+        matrix = snapshot.shift_matrix(True)
+    finally:
+        set_iso_corr(None)
+
+    results = cached_compare_all(directory, matrix, serials)
+    assert_same_results(results, matrix)
@@ -0,0 +1,108 @@
+from compare_spin_systems import SpinSystemComparison, merge_unique_resonances
+from fake_ccpn import (Resonance, ResonanceGroup, Shift, ShiftList,
+                       make_project, sample_pairs)
+from spin_system_snapshot import SpinSystemSnapshot
+import pytest
+
+
+def test_make_project_is_reproducible():
+    project1 = make_project(20, seed=3)
+    project2 = make_project(20, seed=3)
+    values1 = [shift.value for shift in project1.protonatedShiftList.measurements]
+    values2 = [shift.value for shift in project2.protonatedShiftList.measurements]
+    assert values1 == values2
+    assert len(project1.resonanceGroups) == 20
+
+
+@pytest.mark.parametrize('isotope_correction', [True, False])
+def test_pairwise_and_matrix_comparison_agree(isotope_correction):
+    project = make_project(40, seed=1)
+    settings = {'protonatedShiftList': project.protonatedShiftList,
+                'deuteratedShiftList': project.deuteratedShiftList}
+    snapshot = SpinSystemSnapshot.from_resonanceGroups(project.resonanceGroups,
+                                                       **settings)
+    shiftMatrix = snapshot.shift_matrix(isotope_correction)
+
+    for spinSystem1, spinSystem2 in sample_pairs(project, 50):
+        comparison = SpinSystemComparison(spinSystem1, spinSystem2,
+                                          isotope_correction=isotope_correction,
+                                          **settings)
+        deviation, match, overlap = shiftMatrix.compare_one(spinSystem1)
+        column = shiftMatrix.index[spinSystem2]
+        assert comparison.overlap == overlap[column]
+        if comparison.overlap:
+            assert comparison.deviation == pytest.approx(deviation[column])
+            assert comparison.match == match[column]
+
+
+def test_comparison_objects_have_no_instance_dict():
+    project = make_project(10, seed=4)
+    spinSystem1, spinSystem2 = project.resonanceGroups[:2]
+    comparison = SpinSystemComparison(spinSystem1, spinSystem2,
+                                      protonatedShiftList=project.protonatedShiftList,
+                                      deuteratedShiftList=project.deuteratedShiftList)
+    assert not hasattr(comparison, '__dict__')
+    for shiftComparison in comparison.intersection:
+        assert not hasattr(shiftComparison, '__dict__')
+        assert shiftComparison.match == (shiftComparison.delta < 0.5)
+
+
+class Undo(object):
+
+    def __init__(self):
+        self.waypoints = 0
+
+    def newWaypoint(self):
+        self.waypoints += 1
+
+
+def make_merge_pairs():
+    shiftList = ShiftList(1)
+    target = ResonanceGroup(1, 'Ala')
+    source = ResonanceGroup(2, 'Ala')
+    other = ResonanceGroup(3, 'Gly')
+    for serial, (resonanceGroup, name) in enumerate([(target, 'H'), (target, 'N'),
+                                                     (source, 'H'), (source, 'CA'),
+                                                     (source, 'CB'), (other, 'HA')]):
+        Shift(shiftList, Resonance(serial, resonanceGroup, name), 1.0)
+    return shiftList, target, source, other
+
+
+def test_merge_unique_resonances_moves_missing_atoms_only():
+    shiftList, target, source, other = make_merge_pairs()
+    undo = Undo()
+
+    moved = merge_unique_resonances([(target, source), (target, other)],
+                                    undo=undo, protonatedShiftList=shiftList)
+
+    assert [(resonance.assignNames[0], from_, to) for resonance, from_, to in moved] == \
+        [('CA', source, target), ('CB', source, target), ('HA', other, target)]
+    assert sorted(resonance.assignNames[0] for resonance in target.resonances) == \
+        ['CA', 'CB', 'H', 'HA', 'N']
+    assert [resonance.assignNames[0] for resonance in source.resonances] == ['H']
+    assert undo.waypoints == 1
+
+
+def test_merge_unique_resonances_requires_undo():
+    shiftList, target, source, other = make_merge_pairs()
+    with pytest.raises(ValueError):
+        merge_unique_resonances([(target, source)], None,
+                                protonatedShiftList=shiftList)
+    assert len(target.resonances) == 2
+
+
+def test_merge_unique_resonances_holds_back_notifiers(monkeypatch):
+    shiftList, target, source, other = make_merge_pairs()
+    notified = []
+
+    def notify(resonance):
+        # Called after the whole batch is merged.
+        notified.append((resonance.assignNames[0], len(target.resonances)))
+
+    monkeypatch.setattr(Resonance, '_notifies', {'setResonanceGroup': [notify]})
+
+    merge_unique_resonances([(target, source), (target, other)], Undo(),
+                            protonatedShiftList=shiftList)
+
+    assert notified == [('CA', 5), ('CB', 5), ('HA', 5)]
+    assert Resonance._notifies == {'setResonanceGroup': [notify]}
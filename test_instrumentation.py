@@ -0,0 +1,39 @@
+import instrumentation
+from fake_ccpn import make_project
+from compare_spin_systems import SpinSystemComparison
+from ccpn_isotope_shift import ShiftedResonanceCache
+import pytest
+
+
+@pytest.fixture
+def instruments():
+    instrumentation.reset()
+    instrumentation.enable()
+    yield instrumentation
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+def test_disabled_records_nothing():
+    instrumentation.reset()
+    with instrumentation.timer('stage'):
+        instrumentation.count('pairs')
+    assert instrumentation.report() == {'timers': {}, 'counters': {}}
+
+
+def test_comparison_is_instrumented(instruments):
+    project = make_project(5, seed=2)
+    cache = ShiftedResonanceCache()
+    spinSystem1, spinSystem2 = project.resonanceGroups[:2]
+    for repeat in range(2):
+        SpinSystemComparison(spinSystem1, spinSystem2,
+                             protonatedShiftList=project.protonatedShiftList,
+                             deuteratedShiftList=project.deuteratedShiftList,
+                             cache=cache)
+    report = instruments.report()
+    assert report['counters']['pairs_compared'] == 2
+    assert report['timers']['pairwise_compare']['calls'] == 2
+    counters = report['counters']
+    assert counters.get('shifted_resonance_cache_misses', 0) == \
+        counters.get('shifted_resonance_cache_hits', 0)
+    assert 'pairwise_compare' in instruments.status_line()
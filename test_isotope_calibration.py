@@ -0,0 +1,96 @@
+import time
+
+import numpy
+import pytest
+
+from isotope_calibration import (calibrate, fit_isotope_shifts, main, read_iso_corr,
+                                 write_iso_corr)
+from isotope_shift import (correct_for_isotope_shift, correct_for_isotope_shifts,
+                           set_iso_corr, talos_iso_corr)
+from spin_system_snapshot import SpinSystemSnapshot
+
+TRUE_SHIFTS = {'Ala': (-0.40, -0.80), 'Leu': (-0.55, -1.20)}
+
+
+def make_records(n, seed=0, outliers=0.1):
+    generator = numpy.random.RandomState(seed)
+    protonated = []
+    deuterated = []
+    for spin_system in range(n):
+        residue_type = sorted(TRUE_SHIFTS)[spin_system % 2]
+        for column, atom_name in enumerate(['CA', 'CB']):
+            value = generator.normal(50.0, 5.0)
+            isotope_shift = TRUE_SHIFTS[residue_type][column] + generator.normal(0.0, 0.02)
+            if generator.rand() < outliers:
+                isotope_shift += generator.choice([-3.0, 3.0])
+            protonated.append((spin_system, residue_type, atom_name, value))
+            deuterated.append((spin_system, residue_type, atom_name, value + isotope_shift))
+        protonated.append((spin_system, residue_type, 'N', 120.0))
+    return protonated, deuterated
+
+
+def test_calibrate_recovers_isotope_shifts_despite_outliers():
+    snapshot = SpinSystemSnapshot.from_shift_records(*make_records(200))
+
+    iso_corr, amounts = calibrate(snapshot)
+
+    for residue_type, expected in TRUE_SHIFTS.items():
+        assert iso_corr[residue_type] == pytest.approx(expected, abs=0.01)
+        assert amounts[residue_type] == (100, 100)
+    assert amounts['Avg'] == (200, 200)
+    assert iso_corr['Ser'] == talos_iso_corr['Ser']
+
+
+def test_fit_keeps_default_with_too_few_measurements():
+    iso_corr, amounts = fit_isotope_shifts(['Ser', 'Ser', None], ['CA', 'CA', 'CB'],
+                                           [-0.2, -0.3, -0.5], min_pairs=3)
+    assert iso_corr['Ser'] == talos_iso_corr['Ser']
+    assert amounts['Ser'] == (2, 0)
+    assert amounts['Avg'] == (2, 1)
+
+
+def test_fit_is_fast_for_large_projects():
+    residue_types = ['Ala', 'Leu', 'Gly', None] * 25000
+    atom_names = ['CA', 'CB'] * 50000
+    isotope_shifts = numpy.random.RandomState(1).normal(-0.5, 0.1, 100000)
+    start = time.time()
+    fit_isotope_shifts(residue_types, atom_names, isotope_shifts)
+    assert time.time() - start < 1.0
+
+
+def test_calibrated_table_can_be_used_for_correction(tmpdir):
+    iso_corr = dict(talos_iso_corr)
+    iso_corr['Ala'] = (-0.4, -0.8)
+    path = tmpdir.join('iso_corr.json')
+    with open(str(path), 'w') as stream:
+        write_iso_corr(iso_corr, stream)
+    assert read_iso_corr(str(path)) == iso_corr
+
+    set_iso_corr(read_iso_corr(str(path)))
+    try:
+        assert correct_for_isotope_shift('Ala', 'CA', 0.0) == -0.4
+        assert correct_for_isotope_shifts(['Ala'], ['CB'], [0.0])[0] == -0.8
+    finally:
+        set_iso_corr(None)
+    assert correct_for_isotope_shift('Ala', 'CA', 0.0) == -0.473
+
+
+def test_main_reads_the_shift_lists_like_the_batch_script(tmpdir):
+    protonated, deuterated = make_records(40, outliers=0.0)
+    paths = []
+    for name, records, offset in [('deuterated', deuterated, 0.0),
+                                  ('protonated', protonated, 1.0)]:
+        path = tmpdir.join(name + '.csv')
+        path.write('spin_system,residue_type,atom,shift\n' +
+                   ''.join('{},{},{},{}\n'.format(spin_system, residue_type, atom_name,
+                                                   value - offset)
+                           for spin_system, residue_type, atom_name, value in records))
+        paths.append(str(path))
+    output = tmpdir.join('iso_corr.json')
+
+    main(paths + ['--isotope', 'deuterated', 'protonated', '--offset', '0.0', '1.0',
+                  '--output', str(output)])
+
+    iso_corr = read_iso_corr(str(output))
+    for residue_type, expected in TRUE_SHIFTS.items():
+        assert iso_corr[residue_type] == pytest.approx(expected, abs=0.02)
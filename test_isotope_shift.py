@@ -1,4 +1,7 @@
-from isotope_shift import correct_for_isotope_shift
+from isotope_shift import (VENTERS_TABLE, correct_for_isotope_shift,
+                           correct_for_isotope_shifts, predict_isotope_shifts,
+                           talos_iso_corr)
+import numpy
 import pytest
 
 
@@ -7,9 +10,46 @@ def test_correct_for_isotope_shift_raises_exception():
         correct_for_isotope_shift('Leu', 'CD1', 30.0)
 
 
+def test_correct_for_isotope_shift_falls_back_to_average():
+    assert correct_for_isotope_shift('Xaa', 'CA', 0.0) == talos_iso_corr['Avg'][0]
+    assert correct_for_isotope_shift(None, 'CB', 0.0,
+                                     deuterated=True) == -talos_iso_corr['Avg'][1]
+
+
 def test_correct_for_isotope_shift_correct_value_protonated():
     assert correct_for_isotope_shift('Ala', 'CA', 0.0) == -0.473
 
 
 def test_correct_for_isotope_shift_correct_value_deuterated():
     assert correct_for_isotope_shift('Ala', 'CA', 0.0, deuterated=True) == 0.473
+
+
+def test_correct_for_isotope_shifts_agrees_with_scalar_version():
+    aa_names = ['Ala', 'Gly', 'Leu', 'Ser', 'Ala']
+    atom_names = ['CA', 'CA', 'CB', 'CB', 'CB']
+    shifts = numpy.array([52.0, 45.0, 42.0, 63.0, 19.0])
+    deuterated = numpy.array([False, True, False, True, True])
+
+    corrected = correct_for_isotope_shifts(aa_names, atom_names, shifts,
+                                           deuterated)
+
+    expected = [correct_for_isotope_shift(*arguments) for arguments
+                in zip(aa_names, atom_names, shifts, deuterated)]
+    assert corrected == pytest.approx(expected)
+
+
+def test_correct_for_isotope_shifts_falls_back_to_average():
+    corrected = correct_for_isotope_shifts(['Xaa', None], ['CA', 'CB'],
+                                           [0.0, 0.0])
+    assert corrected.tolist() == list(talos_iso_corr['Avg'])
+
+
+def test_correct_for_isotope_shifts_raises_exception():
+    with pytest.raises(ValueError):
+        correct_for_isotope_shifts(['Leu'], ['CD1'], [30.0])
+
+
+def test_venters_table():
+    corrected = correct_for_isotope_shifts(['Val'], ['CB'], [0.0],
+                                           table=VENTERS_TABLE)
+    assert corrected[0] == pytest.approx(predict_isotope_shifts('Val')[1])
@@ -0,0 +1,54 @@
+from itertools import permutations
+
+from optimal_matching import solve_assignment, match_sets
+from shift_matrix import ShiftMatrix
+import numpy
+import pytest
+
+
+def total_cost(assignment, costs, unmatched_cost):
+    total = 0.0
+    for row, column in enumerate(assignment):
+        if column < 0:
+            total += unmatched_cost
+        else:
+            total += costs[row, column]
+    return total
+
+
+def brute_force(costs, unmatched_cost):
+    n = len(costs)
+    best = None
+    options = list(range(n)) + [-1] * n
+    for assignment in set(permutations(options, n)):
+        if any(column >= 0 and numpy.isinf(costs[row, column])
+               for row, column in enumerate(assignment)):
+            continue
+        cost = total_cost(assignment, costs, unmatched_cost)
+        if best is None or cost < best:
+            best = cost
+    return best
+
+
+def test_solve_assignment_is_optimal():
+    random = numpy.random.RandomState(1)
+    for trial in range(10):
+        costs = random.rand(4, 4) * 2.0
+        costs[costs > 1.5] = numpy.inf
+        rows, columns = numpy.nonzero(~numpy.isinf(costs))
+        assignment = solve_assignment(4, rows, columns,
+                                      costs[rows, columns],
+                                      unmatched_cost=1.5)
+        assert total_cost(assignment, costs, 1.5) == \
+            pytest.approx(brute_force(costs, 1.5), abs=1e-5)
+        assigned = [column for column in assignment if column >= 0]
+        assert len(assigned) == len(set(assigned))
+
+
+def test_match_sets_pairs_closest_spin_systems():
+    records = [('a', 'CA', [50.0]), ('b', 'CA', [52.0]),
+               ('x', 'CA', [52.1]), ('y', 'CA', [50.2]),
+               ('z', 'CB', [30.0])]
+    matrix = ShiftMatrix.from_records(['a', 'b', 'x', 'y', 'z'], records)
+    pairs = match_sets(matrix, ['a', 'b'], ['x', 'y', 'z'])
+    assert [(pair[0], pair[1]) for pair in pairs] == [('b', 'x'), ('a', 'y')]
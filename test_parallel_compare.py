@@ -0,0 +1,52 @@
+import parallel_compare
+from parallel_compare import (compare_all_parallel, iterate_blocks,
+                              upper_triangle_blocks)
+from shift_matrix import ShiftMatrix
+import numpy
+
+
+def make_matrix(n=50):
+    random = numpy.random.RandomState(2)
+    keys = list(range(n))
+    records = []
+    for key in keys:
+        for atom_name in ['H', 'N', 'CA', 'CB']:
+            if random.rand() < 0.8:
+                records.append((key, atom_name, [random.normal(50.0, 2.0)]))
+    return ShiftMatrix.from_records(keys, records)
+
+
+def test_upper_triangle_blocks_cover_all_pairs():
+    covered = numpy.zeros((10, 10), dtype=int)
+    for start1, end1, start2, end2 in upper_triangle_blocks(10, 3):
+        covered[start1:end1, start2:end2] += 1
+        if start1 != start2:
+            covered[start2:end2, start1:end1] += 1
+    assert (covered == 1).all()
+
+
+def test_compare_all_parallel_equals_serial():
+    matrix = make_matrix()
+    expected = matrix.compare_all()
+    found = compare_all_parallel(matrix, processes=2, block_size=16)
+    assert numpy.allclose(found[0], expected[0], equal_nan=True)
+    assert (found[1] == expected[1]).all()
+    assert (found[2] == expected[2]).all()
+
+
+def test_iterate_blocks_keeps_the_order_of_the_blocks():
+    matrix = make_matrix()
+    blocks = upper_triangle_blocks(50, 8)[::-1]
+    results = list(iterate_blocks(matrix, blocks, processes=2))
+    assert [result[0] for result in results] == blocks
+    for (start1, end1, start2, end2), deviation, match, overlap in results:
+        expected = matrix.compare_subsets(numpy.arange(start1, end1),
+                                          numpy.arange(start2, end2))
+        assert (overlap == expected[2]).all()
+
+
+def test_arrays_are_released_after_the_comparison():
+    compare_all_parallel(make_matrix(10), processes=1)
+    assert parallel_compare._arrays is None
+    compare_all_parallel(make_matrix(), processes=2, block_size=16)
+    assert parallel_compare._arrays is None
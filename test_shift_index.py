@@ -0,0 +1,24 @@
+from shift_index import ShiftIndex
+
+
+def make_index():
+    tables = {'a': {'CA': [[50.0]], 'N': [[120.0]]},
+              'b': {'CA': [[50.3]], 'N': [[121.0]]},
+              'c': {'CA': [[50.1], [55.0]]},
+              'd': {'CB': [[30.0]]}}
+    return ShiftIndex(tables)
+
+
+def test_candidates_within_all_windows():
+    table = {'CA': [[50.0]], 'N': [[120.2]]}
+    assert make_index().candidates(table) == set(['a'])
+
+
+def test_candidates_need_all_duplicates_inside_window():
+    table = {'CA': [[50.0]]}
+    assert make_index().candidates(table) == set(['a', 'b'])
+
+
+def test_candidates_without_shared_atom_type_are_left_out():
+    table = {'HA': [[4.5]]}
+    assert make_index().candidates(table) == set()
@@ -0,0 +1,133 @@
+import pytest
+
+from shift_list_io import parse_nmrstar_shifts
+from spin_system_snapshot import SpinSystemSnapshot
+
+NMRSTAR3 = '''data_12345
+
+save_entry_information
+   _Entry.ID 12345
+   _Entry.Title
+;
+loop_
+   _Atom_chem_shift.Seq_ID
+stop_
+;
+   loop_
+      _Entry_author.Ordinal
+      _Entry_author.Given_name
+      1 'Jan Jansen'
+   stop_
+save_
+
+save_assigned_chem_shift_list_1
+   loop_
+      _Atom_chem_shift.ID
+      _Atom_chem_shift.Seq_ID
+      _Atom_chem_shift.Comp_ID
+      _Atom_chem_shift.Atom_ID
+      _Atom_chem_shift.Val
+      _Atom_chem_shift.Assigned_chem_shift_list_ID
+      1 5 ALA CA 52.1 1
+      2 5 ALA "H2'" 4.2 1  # comment
+      3 6 GLY N
+        108.3 1
+      4 6 GLY CA . 1
+   stop_
+save_
+
+save_assigned_chem_shift_list_2
+   loop_
+      _Atom_chem_shift.ID
+      _Atom_chem_shift.Seq_ID
+      _Atom_chem_shift.Comp_ID
+      _Atom_chem_shift.Atom_ID
+      _Atom_chem_shift.Val
+      _Atom_chem_shift.Assigned_chem_shift_list_ID
+      1 5 ALA CA 51.6 2
+   stop_
+save_
+'''
+
+NMRSTAR2 = '''data_4321
+   loop_
+      _Atom_shift_assign_ID
+      _Residue_seq_code
+      _Residue_label
+      _Atom_name
+      _Chem_shift_value
+      1 7 LYS CB 32.9
+   stop_
+'''
+
+NMRSTAR_ENTITIES = '''data_2222
+   loop_
+      _Atom_chem_shift.ID
+      _Atom_chem_shift.Entity_ID
+      _Atom_chem_shift.Seq_ID
+      _Atom_chem_shift.Comp_ID
+      _Atom_chem_shift.Atom_ID
+      _Atom_chem_shift.Val
+      1 1 5 ALA CA 52.1
+      2 2 5 SER CA 58.3
+      3 . 5 GLY CA 45.1
+   stop_
+'''
+
+
+
+def test_parse_nmrstar3_skips_other_loops_and_text():
+    records = list(parse_nmrstar_shifts(NMRSTAR3.splitlines(True),
+                                        shift_list_id=1))
+    assert records == [('5', 'Ala', 'CA', 52.1),
+                       ('5', 'Ala', "H2'", 4.2),
+                       ('6', 'Gly', 'N', 108.3)]
+
+
+def test_parse_nmrstar3_requires_id_with_several_shift_lists():
+    with pytest.raises(ValueError):
+        list(parse_nmrstar_shifts(NMRSTAR3.splitlines(True)))
+
+
+def test_parse_nmrstar3_single_shift_list_needs_no_id():
+    lines = NMRSTAR3.splitlines(True)
+    end = lines.index('save_assigned_chem_shift_list_2\n')
+    assert len(list(parse_nmrstar_shifts(lines[:end]))) == 3
+
+
+def test_parse_nmrstar2_requires_single_shift_loop():
+    with pytest.raises(ValueError):
+        list(parse_nmrstar_shifts((NMRSTAR2 * 2).splitlines(True)))
+
+
+def test_parse_nmrstar3_selects_shift_list():
+    records = list(parse_nmrstar_shifts(NMRSTAR3.splitlines(True),
+                                        shift_list_id=2))
+    assert records == [('5', 'Ala', 'CA', 51.6)]
+
+
+def test_parse_nmrstar2():
+    assert list(parse_nmrstar_shifts(iter(NMRSTAR2.splitlines(True)))) == \
+        [('7', 'Lys', 'CB', 32.9)]
+
+
+def test_parse_nmrstar2_rejects_shift_list_id():
+    with pytest.raises(ValueError):
+        list(parse_nmrstar_shifts(NMRSTAR2.splitlines(True), shift_list_id=1))
+
+
+def test_parse_nmrstar3_keys_spin_systems_by_entity():
+    lines = NMRSTAR_ENTITIES.splitlines(True)
+    assert list(parse_nmrstar_shifts(lines)) == [('1:5', 'Ala', 'CA', 52.1),
+                                                 ('2:5', 'Ser', 'CA', 58.3),
+                                                 ('5', 'Gly', 'CA', 45.1)]
+
+
+def test_records_stream_into_snapshot():
+    lines = NMRSTAR3.splitlines(True)
+    snapshot = SpinSystemSnapshot.from_shift_records(
+        parse_nmrstar_shifts(lines, shift_list_id=1),
+        parse_nmrstar_shifts(lines, shift_list_id=2))
+    assert snapshot.keys == ['5', '6']
+    assert snapshot.residue_types == ['Ala', 'Gly']
+    assert snapshot.shifts[0].tolist() == [52.1, 51.6]
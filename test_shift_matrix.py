@@ -0,0 +1,72 @@
+from shift_matrix import ComparisonResults, ShiftMatrix
+import numpy
+import pytest
+
+
+def make_matrix():
+    records = [('a', 'CA', [50.0, 49.5]),
+               ('a', 'N', [120.0]),
+               ('b', 'CA', [50.2, 49.9]),
+               ('b', 'N', [121.0]),
+               ('c', 'CB', [30.0, 29.0])]
+    return ShiftMatrix.from_records(['a', 'b', 'c'], records)
+
+
+def test_compare_one_deviation():
+    deviation, match, overlap = make_matrix().compare_one('a')
+    # CA: average of 0.2 and 0.4, N: 1.0
+    assert deviation[1] == pytest.approx((0.3 ** 2 + 1.0 ** 2) ** 0.5)
+    assert deviation[0] == 0.0
+    assert numpy.isnan(deviation[2])
+    assert list(overlap) == [2, 2, 0]
+
+
+def test_compare_one_match():
+    deviation, match, overlap = make_matrix().compare_one('a')
+    assert list(match) == [True, False, True]
+
+
+def test_duplicate_assign_names_are_all_compared():
+    records = [('a', 'CA', [50.0]), ('a', 'CA', [51.0]), ('b', 'CA', [50.0])]
+    matrix = ShiftMatrix.from_records(['a', 'b'], records)
+    deviation, match, overlap = matrix.compare_one('b')
+    assert overlap[0] == 2
+    assert deviation[0] == pytest.approx(1.0)
+
+
+def test_compare_all_is_symmetric():
+    deviation, match, overlap = make_matrix().compare_all(block_size=2)
+    assert numpy.allclose(deviation, deviation.T, equal_nan=True)
+    assert (match == match.T).all()
+
+
+def test_iterate_compare_one_covers_all_rows():
+    matrix = make_matrix()
+    chunks = list(matrix.iterate_compare_one('a', chunk_size=2))
+    assert [start for start, deviation, match, overlap in chunks] == [0, 2]
+    deviation = numpy.concatenate([chunk[1] for chunk in chunks])
+    assert numpy.allclose(deviation, matrix.compare_one('a')[0], equal_nan=True)
+
+
+def test_update_rows_and_results():
+    matrix = make_matrix()
+    results = ComparisonResults(matrix.keys, *matrix.compare_all())
+    assert matrix.update_rows(['b'], [('b', 'CA', [50.0, 49.5]),
+                                      ('b', 'N', [120.0])])
+    results.update_rows(matrix, ['b'])
+    expected = ComparisonResults(matrix.keys, *matrix.compare_all())
+    assert numpy.allclose(results.deviation, expected.deviation, equal_nan=True)
+    assert (results.match == expected.match).all()
+    assert (results.overlap == expected.overlap).all()
+
+
+def test_update_rows_refuses_new_atom_type():
+    matrix = make_matrix()
+    before = matrix.values.copy()
+    assert not matrix.update_rows(['b'], [('b', 'HA', [4.2])])
+    assert (matrix.values == before).all()
+
+
+def test_all_vs_all_overlap_is_compact():
+    deviation, match, overlap = make_matrix().compare_all()
+    assert overlap.dtype == numpy.int32
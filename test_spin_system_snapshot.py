@@ -0,0 +1,95 @@
+from compare_spin_systems import make_shift_matrix
+from fake_ccpn import ShiftList, make_project
+from shift_list_models import ShiftListModel
+from spin_system_snapshot import SpinSystemSnapshot
+import numpy
+import pytest
+
+nan = float('nan')
+
+
+def make_snapshot():
+    return SpinSystemSnapshot(keys=['a', 'b'],
+                              serials=[1, 2],
+                              residue_types=['Ala', None],
+                              resonance_groups=[0, 0, 1],
+                              resonance_names=['CA', 'N', 'CB'],
+                              shifts=[[52.0, nan], [120.0, 121.0], [nan, 40.0]])
+
+
+def test_records_estimate_missing_isotope_state():
+    records = list(make_snapshot().records(isotope_correction=True))
+    assert records[0][:2] == ('a', 'CA')
+    assert records[0][2] == pytest.approx([52.0, 52.0 - 0.473])
+    assert records[2][2] == pytest.approx([40.0 + 0.837, 40.0])
+
+
+def test_records_without_correction_prefer_protonated_list():
+    records = list(make_snapshot().records(isotope_correction=False))
+    assert [values for key, name, values in records] == [[52.0], [120.0], [40.0]]
+
+
+def test_shift_tables_group_by_assign_name():
+    tables = make_snapshot().shift_tables(isotope_correction=False)
+    assert tables == {'a': {'CA': [[52.0]], 'N': [[120.0]]},
+                      'b': {'CB': [[40.0]]}}
+
+
+def test_records_of_selected_spin_systems():
+    records = list(make_snapshot().records(isotope_correction=False, keys=['b']))
+    assert records == [('b', 'CB', [40.0])]
+
+
+def test_records_of_more_shift_lists():
+    protonated = [('a', 'Ala', 'CA', 52.0), ('a', 'Ala', 'N', 120.0)]
+    deuterated = [('b', 'Ala', 'CA', 51.6)]
+    warm = [('a', 'Ala', 'CA', 52.3), ('b', 'Ala', 'N', 121.5)]
+    models = [ShiftListModel(), ShiftListModel(deuterated=True),
+              ShiftListModel(offset={'CA': -0.2, 'N': -1.0})]
+
+    snapshot = SpinSystemSnapshot.from_record_lists([protonated, deuterated, warm],
+                                                    models)
+    records = dict(((key, name), values) for key, name, values in snapshot.records())
+
+    # CA of a: measured in both protonated lists, the deuterated shift
+    # is estimated from their average.
+    assert records[('a', 'CA')] == pytest.approx([52.0, 52.05 - 0.473, 52.1])
+    assert records[('b', 'CA')] == pytest.approx([52.073, 51.6, 52.073])
+    # Other atoms keep a shift per list, missing ones are averaged.
+    assert records[('a', 'N')] == [120.0, 120.0, 120.0]
+    assert records[('b', 'N')] == [120.5, 120.5, 120.5]
+
+
+def test_records_of_more_shift_lists_keep_every_list():
+    protonated = [('a', 'Ala', 'H', 8.0), ('a', 'Ala', 'N', 120.0)]
+    cold = [('a', 'Ala', 'H', 8.3)]
+    warm = [('a', 'Ala', 'H', 7.8), ('a', 'Ala', 'N', 121.0)]
+
+    snapshot = SpinSystemSnapshot.from_record_lists([protonated, cold, warm],
+                                                    [ShiftListModel()] * 3)
+    records = dict(((key, name), values) for key, name, values
+                   in snapshot.records(isotope_correction=False))
+
+    assert records[('a', 'H')] == [8.0, 8.3, 7.8]
+    assert records[('a', 'N')] == [120.0, 120.5, 121.0]
+
+
+def test_more_shift_lists_need_models():
+    with pytest.raises(ValueError):
+        SpinSystemSnapshot.from_record_lists([[], [], []])
+
+
+def test_two_default_shift_lists_give_the_same_matrix():
+    project = make_project(30, seed=2)
+    shiftLists = [project.protonatedShiftList, project.deuteratedShiftList]
+    classic = make_shift_matrix(project.resonanceGroups,
+                                protonatedShiftList=shiftLists[0],
+                                deuteratedShiftList=shiftLists[1])
+    general = make_shift_matrix(project.resonanceGroups, shiftLists=shiftLists)
+    assert numpy.array_equal(classic.compare_all()[0], general.compare_all()[0])
+
+    general = make_shift_matrix(project.resonanceGroups,
+                                shiftLists=shiftLists + [ShiftList(3)],
+                                models=[ShiftListModel(), ShiftListModel(deuterated=True),
+                                        ShiftListModel()])
+    assert general.values.shape[-1] == 3
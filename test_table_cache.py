@@ -0,0 +1,79 @@
+from fake_ccpn import Resonance, ResonanceGroup, Shift, ShiftList
+from table_cache import ShownTables, SpinSystemRowCache
+
+
+def make_labels():
+    made = []
+
+    def make_label(resonanceGroup):
+        made.append(resonanceGroup)
+        return resonanceGroup.ccpCode or '-'
+
+    return made, make_label
+
+
+def make_spin_systems():
+    protonated = ShiftList(1)
+    deuterated = ShiftList(2)
+    first = ResonanceGroup(1, 'Ala')
+    second = ResonanceGroup(2)
+    resonance = Resonance(1, first, 'CA')
+    Shift(protonated, resonance, 52.0)
+    Shift(deuterated, resonance, 51.5)
+    Shift(deuterated, Resonance(2, second, 'CA'), 55.0)
+    return deuterated, first, second, resonance
+
+
+def test_rows_are_made_once():
+    made, make_label = make_labels()
+    deuterated, first, second, resonance = make_spin_systems()
+    cache = SpinSystemRowCache(make_label)
+
+    assert cache.get(first) == ('2,1', 'Ala')
+    assert cache.get(second) == ('2', '-')
+    assert cache.get(first) == ('2,1', 'Ala')
+    assert made == [first, second]
+
+
+def test_moved_resonance_invalidates_both_spin_systems():
+    made, make_label = make_labels()
+    deuterated, first, second, resonance = make_spin_systems()
+    cache = SpinSystemRowCache(make_label)
+    cache.get(first)
+    cache.get(second)
+
+    first.resonances.remove(resonance)
+    resonance.resonanceGroup = second
+    second.resonances.append(resonance)
+    cache.invalidate_resonance(resonance)
+
+    assert cache.get(first) == ('', 'Ala')
+    assert cache.get(second) == ('2,1', '-')
+    assert made == [first, second, first, second]
+
+
+def test_changed_assignment_invalidates_one_spin_system():
+    made, make_label = make_labels()
+    deuterated, first, second, resonance = make_spin_systems()
+    cache = SpinSystemRowCache(make_label)
+    cache.get(first)
+    cache.get(second)
+
+    second.ccpCode = 'Gly'
+    cache.invalidate_resonanceGroup(second)
+
+    assert cache.get(second) == ('2', 'Gly')
+    assert cache.get(first) == ('2,1', 'Ala')
+    assert made == [first, second, second]
+
+
+def test_unchanged_tables_are_skipped():
+    shownTables = ShownTables()
+    rows = [[1, '2,1', 'Ala', '-']]
+
+    assert shownTables.changed('A1', ['first'], rows)
+    assert not shownTables.changed('A1', ['first'], [list(row) for row in rows])
+    assert shownTables.changed('A2', ['first'], rows)
+    assert shownTables.changed('A1', ['first'], [[1, '2,1', 'Ala', 3]])
+    assert shownTables.changed('A1', ['first'], [[1, '2,1', 'Ala', 3]],
+                               colorMatrix=[['#FFFFFF'] * 4])